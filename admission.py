@@ -0,0 +1,225 @@
+import asyncio
+import itertools
+import logging
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+DEADLINE = 'deadline'
+QUEUE_FULL = 'queue_full'
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a request is not admitted; ``retry_after`` is a hint in whole seconds"""
+
+    def __init__(self, message, route_class, reason, retry_after):
+        super().__init__(message)
+        self.route_class = route_class
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RouteClass:
+    """Admission settings of one group of routes, with its rolling service time"""
+
+    def __init__(self, name, priority, limit, queue_size, deadline, expected_seconds):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self.expected_seconds = expected_seconds
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = {QUEUE_FULL: 0, DEADLINE: 0}
+
+
+class _Waiter:
+    def __init__(self, route, seq, deadline, notify=None):
+        self.route = route
+        self.seq = seq
+        self.deadline = deadline
+        self.notify = notify
+        self.granted = False
+
+
+class AdmissionController:
+    """Per-route concurrency limits and priority queues in front of the slow routes.
+
+    At most ``capacity`` requests run at once in this process, and at most
+    ``limit`` of each route class. A request that cannot start right away
+    waits in its class's queue of ``queue_size``; free slots go to the
+    highest priority class (lowest number) that has room, first come first
+    served within a class. A request is rejected up front when its queue is
+    full or when the expected wait plus its expected service time would
+    not fit before its deadline, and dropped from the queue once it can no
+    longer finish in time. Rejections carry a ``retry_after`` estimate.
+
+    Expected service time starts at the configured value and follows an
+    exponential moving average of the requests that finished.
+
+    Limits are per process, so they only take effect where one process
+    serves requests concurrently: gunicorn gthread workers or the ASGI app.
+    A sync worker handles one request at a time and never queues here;
+    there the number of workers is the only limit. Threads wait with
+    ``admit`` and coroutines with ``admit_async``; both share the limits.
+    """
+
+    def __init__(self, capacity, route_classes, smoothing=0.2):
+        self.capacity = capacity
+        self.smoothing = smoothing
+        self.routes = {route.name: route for route in route_classes}
+        self.running = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._lock = threading.Condition()
+
+    def _has_room(self, route):
+        return self.running < self.capacity and route.running < route.limit
+
+    def _expected_wait(self, route):
+        """Seconds until a newly queued request of ``route`` would likely start"""
+        ahead = sum(1 for w in self._waiters if w.route.priority <= route.priority)
+        slots = max(1, min(route.limit, self.capacity))
+        return math.ceil((ahead + 1) / slots) * route.expected_seconds
+
+    def _retry_after(self, route):
+        return max(1, min(60, math.ceil(self._expected_wait(route))))
+
+    def _start(self, route):
+        self.running += 1
+        route.running += 1
+        route.admitted += 1
+
+    def _dispatch(self):
+        """Hand free slots to queued requests in priority order; call with the lock held"""
+        now = time.monotonic()
+        for waiter in sorted(self._waiters, key=lambda w: (w.route.priority, w.seq)):
+            if self.running >= self.capacity:
+                break
+            if now + waiter.route.expected_seconds > waiter.deadline or not self._has_room(waiter.route):
+                continue
+            waiter.granted = True
+            self._waiters.remove(waiter)
+            waiter.route.waiting -= 1
+            self._start(waiter.route)
+            if waiter.notify:
+                waiter.notify()
+        self._lock.notify_all()
+
+    def _reject(self, route, reason, message):
+        route.rejected[reason] += 1
+        retry_after = self._retry_after(route)
+        logging.warning(f"Admission rejected {route.name} ({reason}): {message}, retry after {retry_after}s")
+        raise AdmissionRejectedError(message, route.name, reason, retry_after)
+
+    def _arrive(self, route, budget, notify=None):
+        """Start a request of ``route`` now, or queue it and return its waiter; call with the lock held"""
+        if self._has_room(route) and not route.waiting:
+            self._start(route)
+            return None
+        if route.waiting >= route.queue_size:
+            self._reject(route, QUEUE_FULL, f'{route.name} queue is full')
+        if self._expected_wait(route) + route.expected_seconds > budget:
+            self._reject(route, DEADLINE, f'{route.name} cannot finish within {budget:.0f}s')
+        waiter = _Waiter(route, next(self._seq), time.monotonic() + budget, notify)
+        self._waiters.append(waiter)
+        route.waiting += 1
+        self._dispatch()
+        return waiter
+
+    def _time_to_start(self, waiter):
+        """Seconds the waiter may still wait; rejects it once it can no longer finish in time"""
+        remaining = waiter.deadline - waiter.route.expected_seconds - time.monotonic()
+        if remaining <= 0:
+            self._waiters.remove(waiter)
+            waiter.route.waiting -= 1
+            self._reject(waiter.route, DEADLINE, f'{waiter.route.name} waited too long to start')
+        return remaining
+
+    def _finish(self, route, seconds):
+        with self._lock:
+            self.running -= 1
+            route.running -= 1
+            route.expected_seconds += self.smoothing * (seconds - route.expected_seconds)
+            self._dispatch()
+
+    def _budget(self, route, timeout):
+        return route.deadline if timeout is None else min(route.deadline, timeout)
+
+    @contextmanager
+    def admit(self, route_class, timeout=None):
+        """Hold a slot of ``route_class`` for the duration of the block.
+
+        ``timeout`` (seconds) shortens the class deadline for this request,
+        e.g. when the client will give up sooner. Yields the seconds spent
+        waiting; raises AdmissionRejectedError.
+        """
+        route = self.routes[route_class]
+        arrived = time.monotonic()
+        with self._lock:
+            waiter = self._arrive(route, self._budget(route, timeout))
+            while waiter and not waiter.granted:
+                self._lock.wait(self._time_to_start(waiter))
+
+        started = time.monotonic()
+        try:
+            yield started - arrived
+        finally:
+            self._finish(route, time.monotonic() - started)
+
+    @asynccontextmanager
+    async def admit_async(self, route_class, timeout=None):
+        """Like ``admit``, for coroutines: waits for a slot without blocking the event loop"""
+        route = self.routes[route_class]
+        arrived = time.monotonic()
+        loop = asyncio.get_running_loop()
+        granted = asyncio.Event()
+        with self._lock:
+            waiter = self._arrive(route, self._budget(route, timeout),
+                                  notify=lambda: loop.call_soon_threadsafe(granted.set))
+        try:
+            while waiter:
+                with self._lock:
+                    if waiter.granted:
+                        break
+                    remaining = self._time_to_start(waiter)
+                try:
+                    await asyncio.wait_for(granted.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self.running -= 1
+                    route.running -= 1
+                    self._dispatch()
+                elif waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    route.waiting -= 1
+            raise
+
+        started = time.monotonic()
+        try:
+            yield started - arrived
+        finally:
+            self._finish(route, time.monotonic() - started)
+
+    def pressure(self):
+        """Fullest route queue relative to its size (1.0 = full)"""
+        with self._lock:
+            return max([route.waiting / route.queue_size for route in self.routes.values() if route.queue_size] or [0.0])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'running': self.running,
+                'routes': {name: {'priority': route.priority, 'limit': route.limit, 'running': route.running,
+                                  'waiting': route.waiting, 'queue_size': route.queue_size,
+                                  'expected_seconds': route.expected_seconds, 'admitted': route.admitted,
+                                  'rejected': dict(route.rejected)}
+                           for name, route in self.routes.items()},
+            }
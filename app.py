@@ -1,5 +1,6 @@
 import os
 import logging
+import tempfile
 from flask import Flask
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -14,7 +15,74 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 # Configure upload settings
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
+app.config['PERSIST_UPLOADS'] = os.environ.get('PERSIST_UPLOADS', '').lower() in ('1', 'true', 'yes')
 app.config['RESULTS_FOLDER'] = 'static/results'
+app.config['RESULTS_MAX_BYTES'] = int(os.environ.get('RESULTS_MAX_BYTES', 1024 * 1024 * 1024))
+app.config['RESULTS_MAX_AGE'] = int(os.environ.get('RESULTS_MAX_AGE', 7 * 24 * 3600))
+app.config['RESULTS_JANITOR_INTERVAL'] = int(os.environ.get('RESULTS_JANITOR_INTERVAL', 300))
+app.config['RESULTS_CACHE_MAX_AGE'] = 365 * 24 * 3600  # result file names are content hashes
+app.config['THUMBNAIL_WIDTHS'] = [int(w) for w in os.environ.get('THUMBNAIL_WIDTHS', '160,320,640').split(',')]
+
+# Configure background try-on jobs
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 4))
+app.config['JOB_QUEUE_SIZE'] = int(os.environ.get('JOB_QUEUE_SIZE', 32))
+app.config['JOB_RESULT_TTL'] = int(os.environ.get('JOB_RESULT_TTL', 3600))
+app.config['JOB_STATE_DIR'] = os.environ.get('JOB_STATE_DIR', os.path.join(tempfile.gettempdir(), 'musefit-jobs'))
+app.config['SSE_KEEPALIVE'] = int(os.environ.get('SSE_KEEPALIVE', 15))
+# An event stream holds a whole sync worker, which gunicorn kills after its timeout (30s by
+# default), so streams end after SSE_MAX_STREAM seconds and the browser reconnects where it
+# left off. The page only uses them when enabled (gunicorn.conf.py and asgi.py turn them on
+# for threaded workers); otherwise it polls the job status.
+app.config['SSE_MAX_STREAM'] = int(os.environ.get('SSE_MAX_STREAM', 20))
+app.config['SSE_ENABLED'] = os.environ.get('SSE_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+# Configure batch try-on
+app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', 4))
+app.config['BATCH_MAX_ITEMS'] = int(os.environ.get('BATCH_MAX_ITEMS', 24))
+
+# Configure the image processing pool (0 processes runs image work inline)
+app.config['IMAGE_PROCESSES'] = int(os.environ.get('IMAGE_PROCESSES', min(4, os.cpu_count() or 1)))
+app.config['IMAGE_QUEUE_SIZE'] = int(os.environ.get('IMAGE_QUEUE_SIZE', 16))
+app.config['IMAGE_TIMEOUT'] = float(os.environ.get('IMAGE_TIMEOUT', 30))
+
+# Configure admission control for the generation routes: at most ADMISSION_CAPACITY
+# run at once per process; each class has a priority (0 first), a concurrency
+# limit, a queue size, a deadline and a starting estimate of its service time.
+# These only apply with gthread workers or the ASGI app, not sync workers.
+app.config['ADMISSION_CAPACITY'] = int(os.environ.get('ADMISSION_CAPACITY', 8))
+app.config['ADMISSION_ROUTES'] = {
+    'tryon': {'priority': 0, 'limit': int(os.environ.get('ADMISSION_TRYON_LIMIT', 8)),
+              'queue_size': int(os.environ.get('ADMISSION_TRYON_QUEUE', 32)),
+              'deadline': float(os.environ.get('ADMISSION_TRYON_DEADLINE', 30)), 'expected_seconds': 1.0},
+    'prompt': {'priority': 1, 'limit': int(os.environ.get('ADMISSION_PROMPT_LIMIT', 4)),
+               'queue_size': int(os.environ.get('ADMISSION_PROMPT_QUEUE', 16)),
+               'deadline': float(os.environ.get('ADMISSION_PROMPT_DEADLINE', 120)), 'expected_seconds': 15.0},
+    'enhanced': {'priority': 2, 'limit': int(os.environ.get('ADMISSION_ENHANCED_LIMIT', 2)),
+                 'queue_size': int(os.environ.get('ADMISSION_ENHANCED_QUEUE', 8)),
+                 'deadline': float(os.environ.get('ADMISSION_ENHANCED_DEADLINE', 120)), 'expected_seconds': 25.0},
+}
+
+# Configure the generation archive (SQLite, outside static/ so it is never served)
+app.config['ARCHIVE_PATH'] = os.environ.get('ARCHIVE_PATH', os.path.join('instance', 'archive.sqlite3'))
+app.config['ARCHIVE_BATCH_SIZE'] = int(os.environ.get('ARCHIVE_BATCH_SIZE', 100))
+app.config['ARCHIVE_FLUSH_INTERVAL'] = float(os.environ.get('ARCHIVE_FLUSH_INTERVAL', 1.0))
+app.config['HISTORY_MAX_PAGE'] = int(os.environ.get('HISTORY_MAX_PAGE', 100))
+app.config['SHOPPER_COOKIE_MAX_AGE'] = 365 * 24 * 3600
+
+# Configure speculative try-ons of the sizes next to the one a shopper asked for
+app.config['SPECULATIVE_SIZES'] = os.environ.get('SPECULATIVE_SIZES', '').lower() in ('1', 'true', 'yes')
+app.config['SPECULATIVE_NEIGHBORS'] = int(os.environ.get('SPECULATIVE_NEIGHBORS', 1))  # sizes each way
+app.config['SPECULATIVE_BUDGET'] = int(os.environ.get('SPECULATIVE_BUDGET', 30))  # generations per hour
+app.config['SPECULATIVE_MAX_PRESSURE'] = float(os.environ.get('SPECULATIVE_MAX_PRESSURE', 0.25))
+
+# Configure near-duplicate upload detection
+app.config['UPLOAD_INDEX_DIR'] = os.environ.get('UPLOAD_INDEX_DIR', os.path.join(tempfile.gettempdir(), 'musefit-uploads'))
+app.config['UPLOAD_DEDUP_DISTANCE'] = int(os.environ.get('UPLOAD_DEDUP_DISTANCE', 4))  # bits out of 64
+app.config['UPLOAD_INDEX_MAX_BYTES'] = int(os.environ.get('UPLOAD_INDEX_MAX_BYTES', 512 * 1024 * 1024))
+app.config['UPLOAD_INDEX_LOG_MAX_BYTES'] = int(os.environ.get('UPLOAD_INDEX_LOG_MAX_BYTES', 8 * 1024 * 1024))  # compacted past this
+
+# Configure the product catalog (preloaded at startup)
+app.config['PRODUCT_CATALOG'] = os.environ.get('PRODUCT_CATALOG', os.path.join('static', 'catalog', 'catalog.json'))
 
 # Ensure upload directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -0,0 +1,181 @@
+import contextvars
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    kind TEXT NOT NULL,
+    session_id TEXT,
+    product TEXT,
+    inputs_hash TEXT,
+    prompt_hash TEXT,
+    model TEXT,
+    latency_ms REAL,
+    prompt_tokens INTEGER,
+    output_tokens INTEGER,
+    total_tokens INTEGER,
+    cached INTEGER NOT NULL DEFAULT 0,
+    recommendation TEXT,
+    fit_recommendation TEXT,
+    result_url TEXT
+);
+CREATE INDEX IF NOT EXISTS generations_session ON generations (session_id, id);
+CREATE INDEX IF NOT EXISTS generations_product ON generations (product, id);
+"""
+
+COLUMNS = ('created_at', 'kind', 'session_id', 'product', 'inputs_hash', 'prompt_hash', 'model', 'latency_ms',
+           'prompt_tokens', 'output_tokens', 'total_tokens', 'cached', 'recommendation', 'fit_recommendation',
+           'result_url')
+
+_current = contextvars.ContextVar('generation_record', default=None)
+
+
+def note_generation(**fields):
+    """Add details to the record of the generation running in this context, if any.
+
+    Worker threads only see the record when they run in a copy of the
+    caller's context (``contextvars.copy_context().run``).
+    """
+    record = _current.get()
+    if record is not None:
+        record.update(fields)
+
+
+class GenerationArchive:
+    """Append-only SQLite archive of finished generations, for history and accounting.
+
+    The database runs in WAL mode so history reads never wait for the
+    writer. Records are queued by the request or job thread and inserted
+    by a background thread in batches of up to ``batch_size``, at least
+    every ``flush_interval`` seconds; when more than ``max_pending`` are
+    waiting, new records are dropped (and counted) rather than blocking.
+    """
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0, max_pending=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _reader(self):
+        """Per-thread connection for history queries"""
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = self._connect()
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def ensure_started(self):
+        """Start the writer thread in the current process if not already running"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(target=self._run, name='archive-writer', daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    @contextmanager
+    def collecting(self, kind, **fields):
+        """Collect a record for the generation run inside the block, leaving it to the caller to ``add``"""
+        record = dict(fields, kind=kind, created_at=time.time(), cached=False)
+        token = _current.set(record)
+        try:
+            yield record
+        finally:
+            _current.reset(token)
+
+    @contextmanager
+    def recording(self, kind, **fields):
+        """Collect a record for the generation run inside the block and archive it on success.
+
+        Yields the record dict; gemini.py fills in the model, hashes, latency
+        and token usage through note_generation, and the caller adds the
+        result and recommendations.
+        """
+        with self.collecting(kind, **fields) as record:
+            yield record
+        self.add(record)
+
+    def add(self, record):
+        """Queue a record for the writer thread; never blocks"""
+        self.ensure_started()
+        try:
+            self._pending.put_nowait(tuple(record.get(column) for column in COLUMNS))
+        except queue.Full:
+            self.dropped += 1
+            logging.warning("Generation archive is backed up; dropping a record")
+
+    def _run(self):
+        connection = self._connect()
+        insert = f"INSERT INTO generations ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._pending.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                with connection:
+                    connection.executemany(insert, batch)
+                self.written += len(batch)
+            except sqlite3.Error as e:
+                self.dropped += len(batch)
+                logging.error(f"Failed to archive {len(batch)} generations: {e}")
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+
+    def flush(self):
+        """Wait until every queued record has been written"""
+        if self._pid == os.getpid():
+            self._pending.join()
+
+    def history(self, session_id, limit=20, before=None, product=None):
+        """A shopper's generations, newest first.
+
+        Pages are keyed by id: pass the ``id`` of the last row returned as
+        ``before`` to get the next page.
+        """
+        query = 'SELECT * FROM generations WHERE session_id = ?'
+        params = [session_id]
+        if product:
+            query += ' AND product = ?'
+            params.append(product)
+        if before:
+            query += ' AND id < ?'
+            params.append(before)
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+        return [dict(row) for row in self._reader().execute(query, params)]
+
+    def stats(self):
+        return {'written': self.written, 'dropped': self.dropped, 'pending': self._pending.qsize()}
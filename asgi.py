@@ -0,0 +1,219 @@
+"""ASGI entry point: async try-on routes in front of the Flask app.
+
+Run with ``uvicorn asgi:app --host 0.0.0.0 --port 5000``. ``POST /api/tryon``
+is handled natively: Gemini calls go through the async client, image
+decoding runs in the image process pool and result files are written from
+worker threads, so one process can hold hundreds of generations in flight.
+Every other route is served by the Flask app through a WSGI bridge.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+from admission import AdmissionRejectedError
+from binary_upload import BINARY_MIMETYPES, fits_profile, parse_binary_body, sniff_image_type
+from catalog import UnknownProductError
+from gemini import IMAGE_MODEL, generate_tryon_with_fit_async
+from imagepool import ImagePoolBusyError
+from imaging import normalization_profile
+from main import (SHOPPER_COOKIE, SHOPPER_ID_PATTERN, admission, allowed_file, app as flask_app, generation_archive,
+                  normalize_upload, parse_body_measurements, product_catalog, product_key, request_timeout)
+from metrics import REQUEST_SECONDS, REQUESTS_IN_FLIGHT, STAGE_SECONDS
+
+# Threads that wait on the image pool (see main.image_pool), keeping the event loop free
+image_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('IMAGE_WORKERS', os.cpu_count() or 4)),
+                                    thread_name_prefix='image')
+
+# Flask views run on WSGIMiddleware threads here, so an event stream only holds a thread
+if 'SSE_ENABLED' not in os.environ:
+    flask_app.config['SSE_ENABLED'] = True
+
+
+class BodyTooLargeError(Exception):
+    """Raised when a request body grows past the upload size limit"""
+
+
+def limit_body(request, max_bytes):
+    """A view of ``request`` whose body reads raise BodyTooLargeError past ``max_bytes``.
+
+    Counts the bytes as they arrive, so chunked uploads without a
+    Content-Length are cut off as soon as they pass the limit.
+    """
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > max_bytes:
+                raise BodyTooLargeError(f'Upload larger than {max_bytes} bytes')
+        return message
+
+    return Request(request.scope, receive)
+
+
+async def read_upload(form, field, upload_type, shopper):
+    """Read an uploaded image from a form and normalize it on the image pool"""
+    upload = form.get(field)
+    if upload is None or not getattr(upload, 'filename', None):
+        raise ValueError(f'Please upload a {upload_type} photo.')
+    if not allowed_file(upload.filename):
+        raise ValueError(f'Invalid file type for {upload_type}. Please upload PNG, JPG, JPEG, GIF, or WEBP files.')
+    data = await upload.read()
+    loop = asyncio.get_running_loop()
+    scope = shopper if upload_type == 'user' else None
+    image_bytes, stats = await loop.run_in_executor(image_executor, normalize_upload, data, IMAGE_MODEL, scope)
+    logging.info(f"Normalized {upload_type} image: {stats['original_bytes']} -> "
+                 f"{stats['normalized_bytes']} bytes in {stats['elapsed_ms']:.1f}ms")
+    return image_bytes
+
+
+async def read_binary_image(images, field, upload_type, shopper):
+    """Model-ready bytes for an image from a binary upload body (see main.binary_upload_image)"""
+    data = images.get(field)
+    if not data:
+        raise ValueError(f'Please upload a {upload_type} photo.')
+    if fits_profile(data, normalization_profile(IMAGE_MODEL)):
+        return data
+    if sniff_image_type(data) is None:
+        raise ValueError(f'{upload_type} photo is not a JPEG, PNG, WEBP or GIF image')
+    loop = asyncio.get_running_loop()
+    scope = shopper if upload_type == 'user' else None
+    image_bytes, _ = await loop.run_in_executor(image_executor, normalize_upload, data, IMAGE_MODEL, scope)
+    return image_bytes
+
+
+async def tryon(request):
+    """Generate a try-on and fit recommendation, returning them as JSON.
+
+    Accepts the same multipart fields as the upload form on ``/``: a
+    ``user_photo``, a ``product_photo`` or catalog ``product_sku``, body
+    measurements and ``product_size`` / ``product_chest`` / ``product_length``.
+    The binary upload protocol (see binary_upload) is accepted as well.
+    """
+    max_bytes = flask_app.config['MAX_CONTENT_LENGTH']
+    try:
+        content_length = int(request.headers.get('content-length') or 0)
+    except ValueError:
+        return JSONResponse({'error': 'Invalid Content-Length'}, status_code=400)
+    if content_length > max_bytes:
+        return JSONResponse({'error': 'Upload too large'}, status_code=413)
+    request = limit_body(request, max_bytes)
+
+    shopper = request.cookies.get(SHOPPER_COOKIE, '')
+    new_shopper = not SHOPPER_ID_PATTERN.match(shopper)
+    if new_shopper:
+        shopper = uuid.uuid4().hex
+
+    form = None
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    try:
+        if mimetype in BINARY_MIMETYPES:
+            fields, images = parse_binary_body(mimetype, await request.body(), request.query_params)
+
+            def upload(field, upload_type):
+                return read_binary_image(images, field, upload_type, shopper)
+        else:
+            fields = form = await request.form()
+
+            def upload(field, upload_type):
+                return read_upload(form, field, upload_type, shopper)
+
+        body_measurements = parse_body_measurements(fields)
+        product_size = {
+            'size': str(fields.get('product_size', '')),
+            'chest': str(fields.get('product_chest', '')),
+            'length': str(fields.get('product_length', ''))
+        }
+        if not product_size['size']:
+            raise ValueError('Please enter the product size.')
+
+        product_sku = str(fields.get('product_sku') or '').strip()
+        if product_sku:
+            product = product_catalog.get(product_sku)
+            user_image = await upload('user_photo', 'user')
+            product_image = product.image
+            product_size = product.product_size(**product_size)
+        else:
+            user_image, product_image = await asyncio.gather(upload('user_photo', 'user'),
+                                                             upload('product_photo', 'product'))
+    except BodyTooLargeError:
+        return JSONResponse({'error': 'Upload too large'}, status_code=413)
+    except (ValueError, UnknownProductError) as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except ImagePoolBusyError as e:
+        return JSONResponse({'error': str(e)}, status_code=503, headers={'Retry-After': '1'})
+    finally:
+        if form is not None:
+            await form.close()
+
+    try:
+        with generation_archive.recording('tryon', session_id=shopper,
+                                          product=product_key(product_sku, product_image)) as record:
+            result_image, recommendation, fit_recommendation = await generate_tryon_with_fit_async(
+                user_image, product_image, body_measurements, product_size
+            )
+            record.update(result_url=result_image, recommendation=recommendation,
+                          fit_recommendation=fit_recommendation)
+    except Exception as e:
+        logging.error(f"Async try-on generation failed: {e}")
+        return JSONResponse({'error': str(e)}, status_code=502)
+
+    response = JSONResponse({
+        'result_image': result_image,
+        'recommendation': recommendation,
+        'fit_recommendation': fit_recommendation,
+        'body_measurements': body_measurements,
+        'product_size': {key: product_size[key] for key in ('size', 'chest', 'length')}
+    })
+    if new_shopper:
+        response.set_cookie(SHOPPER_COOKIE, shopper, max_age=flask_app.config['SHOPPER_COOKIE_MAX_AGE'],
+                            httponly=True, samesite='lax')
+    return response
+
+
+def timed(route, handler):
+    """Record request metrics for a native async route like the Flask hooks do"""
+    async def wrapper(request):
+        REQUESTS_IN_FLIGHT.inc(route=route)
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status_code
+            return response
+        finally:
+            REQUESTS_IN_FLIGHT.dec(route=route)
+            REQUEST_SECONDS.observe(time.perf_counter() - started, route=route,
+                                    method=request.method, status=status)
+    return wrapper
+
+
+def admitted(route, route_class, handler):
+    """Run a native async route under the Flask app's admission control (see main.admitted)"""
+    async def wrapper(request):
+        try:
+            async with admission.admit_async(route_class, timeout=request_timeout(request.headers)) as waited:
+                STAGE_SECONDS.observe(waited, stage='admission_wait', route=route)
+                return await handler(request)
+        except AdmissionRejectedError as e:
+            return JSONResponse({'error': 'The service is busy right now. Please try again shortly.',
+                                 'retry_after': e.retry_after},
+                                status_code=503, headers={'Retry-After': str(e.retry_after)})
+    return wrapper
+
+
+app = Starlette(routes=[
+    Route('/api/tryon', timed('/api/tryon', admitted('/api/tryon', 'tryon', tryon)), methods=['POST']),
+    Mount('/', app=WSGIMiddleware(flask_app, workers=int(os.environ.get('WSGI_WORKERS', 10)))),
+])
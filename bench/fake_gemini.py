@@ -0,0 +1,133 @@
+"""Offline stand-in for the Gemini API used by the benchmarks.
+
+Responses are real ``google.genai`` types, so the app code runs unchanged.
+Latency, error rate and image size are configurable, and all randomness
+comes from one seeded generator so runs are repeatable.
+"""
+import asyncio
+import math
+import os
+import random
+import threading
+import time
+
+from google.genai import errors, types
+
+
+class FakeGeminiModels:
+    """Drop-in for ``client.models`` with simulated latency and failures.
+
+    Latencies are log-normal around the given medians (``sigma`` is the
+    standard deviation of the underlying normal distribution).
+    """
+
+    def __init__(self, image_latency_ms=8000, text_latency_ms=800, sigma=0.3,
+                 error_rate=0.0, image_bytes=300 * 1024, seed=1234):
+        self.image_latency_ms = image_latency_ms
+        self.text_latency_ms = text_latency_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.image_bytes = image_bytes
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a fake configured by BENCH_* environment variables"""
+        return cls(
+            image_latency_ms=float(os.environ.get("BENCH_IMAGE_LATENCY_MS", 8000)),
+            text_latency_ms=float(os.environ.get("BENCH_TEXT_LATENCY_MS", 800)),
+            sigma=float(os.environ.get("BENCH_LATENCY_SIGMA", 0.3)),
+            error_rate=float(os.environ.get("BENCH_ERROR_RATE", 0.0)),
+            image_bytes=int(os.environ.get("BENCH_IMAGE_BYTES", 300 * 1024)),
+            seed=int(os.environ.get("BENCH_SEED", 1234)) + os.getpid(),
+        )
+
+    def _sample(self, model):
+        """Draw a latency, a failure flag and a random image payload for one call"""
+        is_image = "image" in model
+        median = self.image_latency_ms if is_image else self.text_latency_ms
+        with self._lock:
+            self.calls += 1
+            latency = median * math.exp(self._random.gauss(0, self.sigma)) / 1000
+            failed = self._random.random() < self.error_rate
+            payload = self._random.randbytes(self.image_bytes) if is_image else None
+        return latency, failed, payload
+
+    def _response(self, model, contents, failed, payload):
+        if failed:
+            raise errors.APIError(503, {"error": {"code": 503, "message": "Simulated overload",
+                                                  "status": "UNAVAILABLE"}})
+        text = "Here is a simulated try-on result."
+        parts = [types.Part(text=text)]
+        if payload is not None:
+            parts.append(types.Part(inline_data=types.Blob(data=payload, mime_type="image/jpeg")))
+        # Gemini bills a generated image as 1290 output tokens
+        prompt_tokens = self.count_tokens(model=model, contents=contents).total_tokens
+        output_tokens = len(text) // 4 + (1290 if payload is not None else 0)
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=parts))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens, candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens)
+        )
+
+    def generate_content(self, *, model, contents, config=None, **kwargs):
+        latency, failed, payload = self._sample(model)
+        time.sleep(latency)
+        return self._response(model, contents, failed, payload)
+
+    async def generate_content_async(self, *, model, contents, config=None, **kwargs):
+        latency, failed, payload = self._sample(model)
+        await asyncio.sleep(latency)
+        return self._response(model, contents, failed, payload)
+
+    def generate_content_stream(self, *, model, contents, config=None, **kwargs):
+        response = self.generate_content(model=model, contents=contents, config=config)
+        parts = response.candidates[0].content.parts
+        for index, part in enumerate(parts):
+            yield types.GenerateContentResponse(
+                candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))],
+                usage_metadata=response.usage_metadata if index == len(parts) - 1 else None
+            )
+
+    def count_tokens(self, *, model, contents, **kwargs):
+        # Rough heuristic: ~4 characters per token, 258 tokens per image
+        total = 0
+        for item in contents if isinstance(contents, list) else [contents]:
+            total += 258 if isinstance(item, types.Part) and item.inline_data else len(str(item)) // 4
+        return types.CountTokensResponse(total_tokens=total)
+
+
+class FakeAsyncModels:
+    """``client.aio.models`` counterpart sharing a FakeGeminiModels' settings and randomness"""
+
+    def __init__(self, models):
+        self._models = models
+
+    async def generate_content(self, **kwargs):
+        return await self._models.generate_content_async(**kwargs)
+
+
+class FakeAsyncClient:
+    def __init__(self, models):
+        self.models = FakeAsyncModels(models)
+
+
+class FakeTransport:
+    """Minimal ``genai.Client`` look-alike wrapping FakeGeminiModels"""
+
+    def __init__(self, models):
+        self.models = models
+        self.aio = FakeAsyncClient(models)
+
+
+def install(models=None):
+    """Point ``gemini.client`` at a fake, keeping the retry/limit wrapper in place"""
+    import gemini
+    from gemini_client import GeminiClient
+
+    models = models or FakeGeminiModels.from_env()
+    gemini.client = GeminiClient(transport=FakeTransport(models), router=gemini.model_router)
+    return models
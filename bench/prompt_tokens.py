@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Input token counts per prompt template.
+
+Renders every current template in prompts.py with sample values and counts
+tokens with ``count_tokens``, both for the template source as written
+(indentation included) and for the normalized prompt that is actually
+sent. Uses the offline fake by default; ``--live`` asks the Gemini API
+(needs GEMINI_API_KEY).
+
+Examples:
+    python -m bench.prompt_tokens
+    python -m bench.prompt_tokens --json prompt_tokens.json
+    python -m bench.prompt_tokens --live --model gemini-2.5-flash
+"""
+
+import argparse
+import json
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from prompts import measurement_values, prompts  # noqa: E402
+
+MEASUREMENTS = measurement_values({'chest': 40, 'waist': 32, 'height': 70},
+                                  {'size': 'M', 'chest': 42, 'length': 28})
+
+SAMPLES = {
+    'tryon': MEASUREMENTS,
+    'fit_polish': dict(MEASUREMENTS, recommendation='Size M looks like a great fit, with about '
+                                                   '2 inches of room across the chest.'),
+    'description_tryon': {'user_description': 'Tall woman with shoulder-length dark hair, athletic build',
+                          'product_description': 'Navy cotton crew-neck t-shirt, relaxed fit'},
+    'enhanced_tryon': {'person_measurements': 'Chest 40in, waist 32in, height 5ft 10in',
+                       'product_details': 'Size M, chest 42in, length 28in, slim fit'},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--live', action='store_true', help='count with the Gemini API instead of the fake')
+    parser.add_argument('--model', default='gemini-2.5-flash')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    if args.live:
+        from gemini_client import GeminiClient
+        models = GeminiClient(api_key=os.environ.get('GEMINI_API_KEY')).models
+    else:
+        from bench.fake_gemini import FakeGeminiModels
+        models = FakeGeminiModels()
+
+    counts = prompts.count_tokens(models, args.model, SAMPLES)
+    print(f"{'template':<20} {'version':>7} {'hash':<16} {'source':>7} {'sent':>6} {'saved':>6}")
+    results = []
+    for template in prompts.current():
+        source, sent = counts[template.name]
+        print(f"{template.name:<20} {template.version:>7} {template.hash:<16} {source:>7} {sent:>6} "
+              f"{source - sent:>6}")
+        results.append({'name': template.name, 'version': template.version, 'hash': template.hash,
+                        'source_tokens': source, 'tokens': sent})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'model': args.model, 'live': args.live, 'templates': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
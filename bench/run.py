@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Load test for MuseFit against the fake Gemini backend.
+
+Starts gunicorn with each requested worker class, drives the try-on routes
+at a fixed concurrency and reports latency percentiles, throughput, worker
+memory and per-stage timings. Everything runs offline.
+
+Examples:
+    python -m bench.run
+    python -m bench.run --worker-classes sync gthread gevent --concurrency 32 --requests 200
+    python -m bench.run --json bench_output.json
+    python -m bench.run --baseline bench_output.json --max-regression 0.10
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from PIL import Image
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTES = ['/', '/generate-prompt', '/generate-enhanced']
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def make_images(count, size, seed):
+    """Pre-generate JPEGs that stay distinct after normalization, so the result cache never short-circuits a request.
+
+    Each image carries its index as a row of dark blocks, large enough to
+    survive downscaling and recompression.
+    """
+    rng = random.Random(seed)
+    width, height = size
+    block = width // 16
+    images = []
+    for index in range(count):
+        img = Image.new('RGB', size, tuple(rng.randrange(64, 256) for _ in range(3)))
+        for bit in range(16):
+            if index >> bit & 1:
+                img.paste((0, 0, 0), (bit * block, 0, (bit + 1) * block, height // 4))
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def encode_multipart(fields, files):
+    """Build a multipart/form-data body"""
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, value in fields.items():
+        lines.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        lines.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b'\r\n')
+    lines.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(lines), f'multipart/form-data; boundary={boundary}'
+
+
+class LoadDriver:
+    """Issues requests against one server and collects per-route latencies"""
+
+    def __init__(self, port, images, poll_interval=0.05, timeout=300):
+        self.port = port
+        self.images = images
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def _request(self, method, path, body=None, headers=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.timeout)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            connection.close()
+
+    def _next_images(self):
+        """A user and product image pair no earlier request used, while the images last"""
+        with self.lock:
+            n = self.counter
+            self.counter += 1
+        return self.images[(2 * n) % len(self.images)], self.images[(2 * n + 1) % len(self.images)], n
+
+    def run_one(self, route):
+        """Run one request end to end; returns (ok, seconds), ok is None when admission turned it away"""
+        user_image, product_image, n = self._next_images()
+        started = time.perf_counter()
+        if route == '/':
+            body, content_type = encode_multipart(
+                {'chest': 40, 'waist': 32, 'height': 70, 'product_size': 'M'},
+                {'user_photo': ('user.jpg', user_image), 'product_photo': ('product.jpg', product_image)})
+            status, _, data = self._request('POST', '/', body,
+                                            {'Content-Type': content_type, 'Accept': 'application/json'})
+            if status != 202:
+                return (None if status == 503 else False), time.perf_counter() - started
+            status_url = json.loads(data)['status_url']
+            # The index route only queues the job; poll until it finishes
+            while True:
+                time.sleep(self.poll_interval)
+                status, _, data = self._request('GET', status_url)
+                job = json.loads(data) if status == 200 else {'status': 'failed'}
+                if job['status'] in ('done', 'failed'):
+                    return job['status'] == 'done', time.perf_counter() - started
+        if route == '/generate-prompt':
+            body, content_type = encode_multipart(
+                {'user_description': f'person {n}', 'product_description': f'red shirt {n}'}, {})
+        else:
+            body, content_type = encode_multipart(
+                {'person_measurements': 'chest 40, waist 32', 'product_details': 'size M'},
+                {'user_photo': ('user.jpg', user_image), 'product_photo': ('product.jpg', product_image)})
+        status, headers, data = self._request('POST', route, body, {'Content-Type': content_type})
+        if status == 503 and 'Retry-After' in headers:
+            return None, time.perf_counter() - started
+        ok = status == 200 and b'Your Try-On Result' in data
+        return ok, time.perf_counter() - started
+
+    def run(self, routes, concurrency, total_requests):
+        """Drive ``total_requests`` spread over routes with ``concurrency`` client threads"""
+        plan = [routes[i % len(routes)] for i in range(total_requests)]
+        results = defaultdict(list)
+        errors = defaultdict(int)
+        rejected = defaultdict(int)
+        plan_lock = threading.Lock()
+
+        def client():
+            while True:
+                with plan_lock:
+                    if not plan:
+                        return
+                    route = plan.pop()
+                try:
+                    ok, seconds = self.run_one(route)
+                except OSError:
+                    ok, seconds = False, 0.0
+                with plan_lock:
+                    if ok:
+                        results[route].append(seconds)
+                    elif ok is None:
+                        rejected[route] += 1
+                    else:
+                        errors[route] += 1
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors, rejected, time.perf_counter() - started
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and its direct children (Linux /proc)"""
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    total = 0
+    for p in pids:
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+def start_server(worker_class, workers, threads, port, workdir, stage_dir, env_overrides):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, BENCH_STAGE_DIR=stage_dir, GEMINI_API_KEY='bench')
+    env.update(env_overrides)
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+               '--worker-class', worker_class, '--timeout', '300', '--chdir', workdir,
+               '--log-level', 'warning', 'bench.wsgi:app']
+    if worker_class == 'gthread':
+        command[command.index('--worker-class'):command.index('--worker-class')] = ['--threads', str(threads)]
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited: {server.stderr.read().decode()[-2000:]}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/test-images')
+            connection.getresponse().read()
+            connection.close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("gunicorn did not start within 60s")
+
+
+def read_stage_timings(stage_dir):
+    stages = defaultdict(list)
+    for name in os.listdir(stage_dir):
+        with open(os.path.join(stage_dir, name)) as f:
+            for line in f:
+                record = json.loads(line)
+                stages[record['stage']].append(record['seconds'])
+    return stages
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 0.50) * 1000 if values else None,
+        'p95_ms': percentile(values, 0.95) * 1000 if values else None,
+        'p99_ms': percentile(values, 0.99) * 1000 if values else None,
+        'mean_ms': statistics.fmean(values) * 1000 if values else None,
+    }
+
+
+def worker_class_available(worker_class):
+    module = {'gevent': 'gevent', 'eventlet': 'eventlet'}.get(worker_class)
+    if not module:
+        return True
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def warmup_requests(args):
+    return len(args.routes) * args.workers
+
+
+def run_benchmark(args, worker_class, images):
+    workdir = tempfile.mkdtemp(prefix='musefit-bench-')
+    stage_dir = os.path.join(workdir, 'stages')
+    port = free_port()
+    env_overrides = {
+        'BENCH_IMAGE_LATENCY_MS': str(args.image_latency_ms),
+        'BENCH_TEXT_LATENCY_MS': str(args.text_latency_ms),
+        'BENCH_LATENCY_SIGMA': str(args.sigma),
+        'BENCH_ERROR_RATE': str(args.error_rate),
+        'BENCH_IMAGE_BYTES': str(args.image_bytes),
+        'BENCH_SEED': str(args.seed),
+    }
+    server = start_server(worker_class, args.workers, args.threads, port, workdir, stage_dir, env_overrides)
+    try:
+        driver = LoadDriver(port, images)
+        # Warm up every route once per worker before measuring
+        driver.run(args.routes, args.concurrency, warmup_requests(args))
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        os.makedirs(stage_dir, exist_ok=True)
+
+        peak_rss = 0
+        sampling = True
+
+        def sample_rss():
+            nonlocal peak_rss
+            while sampling:
+                peak_rss = max(peak_rss, process_tree_rss(server.pid))
+                time.sleep(0.25)
+
+        sampler = threading.Thread(target=sample_rss, daemon=True)
+        sampler.start()
+        results, errors, rejected, elapsed = driver.run(args.routes, args.concurrency, args.requests)
+        sampling = False
+        sampler.join()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    stages = read_stage_timings(stage_dir)
+    shutil.rmtree(workdir, ignore_errors=True)
+    completed = sum(len(v) for v in results.values())
+    return {
+        'worker_class': worker_class,
+        'requests': args.requests,
+        'completed': completed,
+        'cache_hits': len(stages.pop('result_cache_hit', [])),
+        'errors': dict(errors),
+        'rejected': dict(rejected),
+        'elapsed_s': elapsed,
+        'requests_per_second': completed / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss / (1024 * 1024),
+        'routes': {route: summarize(values) for route, values in results.items()},
+        'all': summarize([v for values in results.values() for v in values]),
+        'stages': {stage: summarize(values) for stage, values in sorted(stages.items())},
+    }
+
+
+def print_report(report):
+    def fmt(value):
+        return '-' if value is None else f'{value:9.1f}'
+
+    print(f"\n=== {report['worker_class']}: {report['completed']}/{report['requests']} ok, "
+          f"{report['requests_per_second']:.2f} req/s, peak RSS {report['peak_rss_mb']:.0f} MB, "
+          f"errors {report['errors'] or 0}, rejected {report.get('rejected') or 0}, "
+          f"cache hits {report['cache_hits']}")
+    print(f"{'':32}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, summary in [('ALL', report['all'])] + sorted(report['routes'].items()) + \
+            [(f'stage:{k}', v) for k, v in report['stages'].items()]:
+        print(f"{name:32}{summary['count']:>7}{fmt(summary['p50_ms'])} {fmt(summary['p95_ms'])} {fmt(summary['p99_ms'])}")
+
+
+def check_regressions(reports, baseline_path, max_regression):
+    """Compare p95 latency and throughput against a baseline report; returns failures"""
+    with open(baseline_path) as f:
+        baseline = {r['worker_class']: r for r in json.load(f)['results']}
+    failures = []
+    for report in reports:
+        base = baseline.get(report['worker_class'])
+        if not base:
+            continue
+        if base['all']['p95_ms'] and report['all']['p95_ms'] > base['all']['p95_ms'] * (1 + max_regression):
+            failures.append(f"{report['worker_class']}: p95 {report['all']['p95_ms']:.0f}ms "
+                            f"vs baseline {base['all']['p95_ms']:.0f}ms")
+        if report['requests_per_second'] < base['requests_per_second'] * (1 - max_regression):
+            failures.append(f"{report['worker_class']}: {report['requests_per_second']:.2f} req/s "
+                            f"vs baseline {base['requests_per_second']:.2f} req/s")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--worker-classes', nargs='+', default=['sync', 'gthread', 'gevent'])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='threads per gthread worker')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=120)
+    parser.add_argument('--routes', nargs='+', default=ROUTES, choices=ROUTES)
+    parser.add_argument('--image-latency-ms', type=float, default=2000)
+    parser.add_argument('--text-latency-ms', type=float, default=400)
+    parser.add_argument('--sigma', type=float, default=0.3, help='log-normal latency spread')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--image-bytes', type=int, default=300 * 1024, help='generated image payload size')
+    parser.add_argument('--upload-size', type=int, nargs=2, default=[1600, 1200], metavar=('W', 'H'))
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--json', help='write the full report to this file')
+    parser.add_argument('--baseline', help='fail if results regress against this report')
+    parser.add_argument('--max-regression', type=float, default=0.10)
+    args = parser.parse_args()
+
+    # Two images per request, so no pair repeats and every generation is a cache miss
+    images = make_images(2 * (args.requests + warmup_requests(args)), tuple(args.upload_size), args.seed)
+    reports = []
+    for worker_class in args.worker_classes:
+        if not worker_class_available(worker_class):
+            print(f"Skipping {worker_class}: worker class not installed")
+            continue
+        try:
+            report = run_benchmark(args, worker_class, images)
+        except RuntimeError as e:
+            print(f"Skipping {worker_class}: {e}")
+            continue
+        print_report(report)
+        reports.append(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': vars(args), 'results': reports}, f, indent=2)
+
+    cached = [f"{report['worker_class']}: {report['cache_hits']}" for report in reports if report['cache_hits']]
+    if cached:
+        print(f"INVALID RUN: requests were answered from the result cache ({', '.join(cached)})")
+        sys.exit(1)
+
+    if args.baseline:
+        failures = check_regressions(reports, args.baseline, args.max_regression)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
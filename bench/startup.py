@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark: import time of the app and time to its first request.
+
+Each run starts a fresh interpreter, imports ``main`` under
+``-X importtime`` and then serves one request through the Flask test
+client, the same work a new gunicorn worker does before it can answer.
+Reports the median over several runs and the modules with the largest
+cumulative import time, and fails when the import budget is exceeded.
+
+Examples:
+    python -m bench.startup
+    python -m bench.startup --runs 10 --budget-ms 400
+    python -m bench.startup --path / --json startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+response = main.app.test_client().get(sys.argv[1])
+served = time.perf_counter()
+heavy = [m for m in ('google.genai', 'httpx', 'pydantic', 'PIL.Image', 'numpy') if m in sys.modules]
+print(json.dumps({'import_ms': (imported - started) * 1000, 'first_request_ms': (served - imported) * 1000,
+                  'status': response.status_code, 'loaded': heavy}))
+"""
+
+
+def parse_importtime(stderr):
+    """Cumulative microseconds per module from ``-X importtime`` output"""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumul, name = line[len('import time:'):].split('|')
+        cumulative[name.strip()] = int(cumul)
+    return cumulative
+
+
+def run_once(path):
+    env = dict(os.environ, GEMINI_API_KEY=os.environ.get('GEMINI_API_KEY', 'bench-fake'))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD, path], cwd=REPO_ROOT, env=env,
+                            capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(f"startup run failed:\n{result.stderr[-2000:]}")
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    stats['modules'] = parse_importtime(result.stderr)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/', help='route requested after the import')
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('STARTUP_IMPORT_BUDGET_MS', 400)),
+                        help='fail if the median import time of main is above this')
+    parser.add_argument('--top', type=int, default=12, help='number of slowest modules to list')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    runs = [run_once(args.path) for _ in range(args.runs)]
+    import_ms = statistics.median(run['import_ms'] for run in runs)
+    first_request_ms = statistics.median(run['first_request_ms'] for run in runs)
+
+    modules = {}
+    for run in runs:
+        for name, micros in run['modules'].items():
+            modules.setdefault(name, []).append(micros)
+    slowest = sorted(((statistics.median(v) / 1000, name) for name, v in modules.items()), reverse=True)
+
+    print(f"import main:        {import_ms:8.1f} ms (median of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    print(f"first request {args.path:<5} {first_request_ms:8.1f} ms (status {runs[-1]['status']})")
+    print(f"heavy modules loaded: {', '.join(runs[-1]['loaded']) or 'none'}")
+    print("\nslowest imports (cumulative):")
+    for ms, name in slowest[:args.top]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'import_ms': import_ms, 'first_request_ms': first_request_ms, 'budget_ms': args.budget_ms,
+                       'loaded': runs[-1]['loaded'],
+                       'slowest': [{'module': name, 'ms': ms} for ms, name in slowest[:args.top]]}, f, indent=2)
+
+    if import_ms > args.budget_ms:
+        print(f"\nFAIL: import time {import_ms:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
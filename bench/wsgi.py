@@ -0,0 +1,63 @@
+"""WSGI entry point for benchmarks: the real app on top of the fake Gemini backend.
+
+Run with ``gunicorn bench.wsgi:app`` from the repository root. When
+BENCH_STAGE_DIR is set, each worker appends per-stage timings to
+``<BENCH_STAGE_DIR>/<pid>.jsonl`` for the runner to aggregate.
+"""
+import functools
+import json
+import os
+import time
+
+from bench import fake_gemini
+
+fake_gemini.install()
+
+import gemini  # noqa: E402
+import main  # noqa: E402
+
+STAGE_DIR = os.environ.get("BENCH_STAGE_DIR")
+
+
+def _record(stage, seconds):
+    with open(os.path.join(STAGE_DIR, f"{os.getpid()}.jsonl"), "a") as f:
+        f.write(json.dumps({"stage": stage, "seconds": seconds}) + "\n")
+
+
+def timed(stage, func):
+    """Wrap ``func`` so each call's duration is recorded under ``stage``"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record(stage, time.perf_counter() - started)
+    return wrapper
+
+
+if STAGE_DIR:
+    os.makedirs(STAGE_DIR, exist_ok=True)
+    main.process_uploaded_image = timed("normalize_upload", main.process_uploaded_image)
+    main.render_template = timed("render_template", main.render_template)
+    main.generate_tryon_with_fit = timed("generate_tryon_with_fit", main.generate_tryon_with_fit)
+    main.generate_tryon_from_description = timed("generate_tryon_from_description",
+                                                 main.generate_tryon_from_description)
+    main.generate_enhanced_tryon = timed("generate_enhanced_tryon", main.generate_enhanced_tryon)
+    gemini.save_result = timed("write_result", gemini.save_result)
+
+    cache_get = gemini.result_cache.get
+
+    def counted_cache_get(key):
+        started = time.perf_counter()
+        entry = cache_get(key)
+        if entry is not None:
+            _record("result_cache_hit", time.perf_counter() - started)
+        return entry
+
+    # Reported as a count: a benchmark request answered from the cache measures nothing
+    gemini.result_cache.get = counted_cache_get
+    models = gemini.client.models._models
+    models.generate_content = timed("gemini_call", models.generate_content)
+
+app = main.app
@@ -0,0 +1,148 @@
+"""Binary upload protocol for clients that already hold encoded images.
+
+Two request bodies are accepted instead of a multipart form:
+
+* A raw image (``Content-Type: image/jpeg``, ``image/png``, ``image/webp``
+  or ``image/gif``): the body is the user photo and the other fields
+  (``chest``, ``waist``, ``height``, ``product_size``, ``product_sku``...)
+  travel in the query string.
+
+* ``application/x-musefit-frames``: the magic ``MFT1`` followed by frames
+  of ``<1-byte name length><name><4-byte big-endian length><payload>``.
+  A ``meta`` frame holds the same fields as a JSON object; ``user_photo``
+  and ``product_photo`` frames hold image bytes.
+
+JPEGs are validated by walking their marker segments only. One that is
+already within the model's normalization profile is used as sent,
+without being decoded or re-encoded.
+"""
+import json
+import struct
+
+FRAMES_MIMETYPE = 'application/x-musefit-frames'
+FRAMES_MAGIC = b'MFT1'
+FRAME_NAMES = {'meta', 'user_photo', 'product_photo'}
+IMAGE_MIMETYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/gif'}
+BINARY_MIMETYPES = IMAGE_MIMETYPES | {FRAMES_MIMETYPE}
+
+# Start-of-frame markers carrying the image size (not DHT, JPG or DAC)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def sniff_image_type(data):
+    """Image format from the first bytes, or None"""
+    head = bytes(data[:12])
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    return None
+
+
+def jpeg_header(data):
+    """Read a JPEG's size, component count and metadata flag from its markers.
+
+    Returns ``{'size': (w, h), 'components': n, 'has_metadata': bool}`` or
+    None when the markers are not a well-formed JPEG header.
+    """
+    view = memoryview(data)
+    if bytes(view[:2]) != b'\xff\xd8':
+        return None
+    has_metadata = False
+    pos = 2
+    while pos + 4 <= len(view):
+        if view[pos] != 0xFF:
+            return None
+        marker = view[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            pos += 2
+            continue
+        length = struct.unpack_from('>H', view, pos + 2)[0]
+        segment = view[pos + 4:pos + 2 + length]
+        if length < 2 or len(segment) < length - 2:
+            return None
+        if marker in (0xE1, 0xE2, 0xFE):  # Exif/XMP, ICC profile, comment
+            has_metadata = True
+        elif marker in _SOF_MARKERS:
+            if len(segment) < 6:
+                return None
+            height, width = struct.unpack_from('>HH', segment, 1)
+            return {'size': (width, height), 'components': segment[5], 'has_metadata': has_metadata}
+        elif marker == 0xDA:  # start of scan before any frame header
+            return None
+        pos += 2 + length
+    return None
+
+
+def fits_profile(data, profile):
+    """True if ``data`` is a JPEG that normalize_image would pass through unchanged"""
+    header = jpeg_header(data)
+    return bool(header and header['components'] in (1, 3) and not header['has_metadata']
+                and 0 < max(header['size']) <= profile['max_side'])
+
+
+def parse_frames(data):
+    """Split a frames body into ``(meta dict, {name: image bytes})``; raises ValueError.
+
+    Frame headers are read through a memoryview, but each image is copied
+    out of the body once: the Gemini SDK only accepts ``bytes``.
+    """
+    view = memoryview(data)
+    if bytes(view[:4]) != FRAMES_MAGIC:
+        raise ValueError('frames body must start with MFT1')
+    meta = {}
+    images = {}
+    pos = 4
+    while pos < len(view):
+        name_length = view[pos]
+        name = bytes(view[pos + 1:pos + 1 + name_length]).decode('ascii', 'replace')
+        pos += 1 + name_length
+        if pos + 4 > len(view):
+            raise ValueError('truncated frame header')
+        length = struct.unpack_from('>I', view, pos)[0]
+        pos += 4
+        if pos + length > len(view):
+            raise ValueError(f'frame {name!r} is truncated')
+        if name not in FRAME_NAMES or name in images or (name == 'meta' and meta):
+            raise ValueError(f'unexpected frame {name!r}')
+        payload = view[pos:pos + length]
+        pos += length
+        if name == 'meta':
+            try:
+                meta = json.loads(bytes(payload))
+            except ValueError:
+                raise ValueError('meta frame is not valid JSON')
+            if not isinstance(meta, dict):
+                raise ValueError('meta frame must be a JSON object')
+        else:
+            images[name] = payload.tobytes()
+    return meta, images
+
+
+def build_frames(meta=None, **images):
+    """Encode a frames body; the client side of parse_frames (used by tests and benchmarks)"""
+    frames = [FRAMES_MAGIC]
+    for name, payload in ([('meta', json.dumps(meta).encode('utf-8'))] if meta else []) + list(images.items()):
+        encoded = name.encode('ascii')
+        frames += [bytes([len(encoded)]), encoded, struct.pack('>I', len(payload)), payload]
+    return b''.join(frames)
+
+
+def parse_binary_body(mimetype, data, args):
+    """Fields and images from a binary request body.
+
+    ``args`` are the query string values, used as the fields of a raw
+    image body. Returns ``(fields, {name: bytes})``; raises ValueError.
+    """
+    if mimetype == FRAMES_MIMETYPE:
+        return parse_frames(data)
+    if mimetype in IMAGE_MIMETYPES:
+        return args, {'user_photo': data}
+    raise ValueError(f'unsupported content type {mimetype}')
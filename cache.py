@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Content-addressed index of generated try-on results.
+
+    Entries map a hash of the model name, the rendered prompt and the input
+    image bytes to the stored result image and its text. Recently used
+    entries are kept in an in-memory LRU; every entry is also written to
+    the result storage as ``cache/<key>.json``, so it survives restarts and
+    is shared by every worker and node using that storage. Entries expire
+    after ``ttl`` seconds, or as soon as their image is gone from storage.
+
+    Images are not copied into the cache, so it has no size cap of its own
+    (the former ``max_disk_bytes``); the storage's limits apply to them.
+    """
+
+    def __init__(self, storage, max_memory_entries=256, ttl=86400, sweep_interval=300):
+        self.storage = storage
+        self.max_memory_entries = max_memory_entries
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._last_sweep = time.time()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model, prompt, *images):
+        """Hash the model, prompt and image bytes into a cache key"""
+        digest = hashlib.sha256()
+        digest.update(model.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(prompt.encode('utf-8'))
+        for image_bytes in images:
+            digest.update(b'\0')
+            digest.update(hashlib.sha256(image_bytes).digest())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return ``(image_url, text)`` for a cached result, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry and now - entry['created'] < self.ttl and self.storage.stat(entry['name']):
+            with self._lock:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+            return self.storage.url(entry['name']), entry['text']
+
+        entry = self._read_stored_entry(key, now)
+        with self._lock:
+            self._memory.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._remember(key, entry)
+            self.hits += 1
+            self.disk_hits += 1
+        return self.storage.url(entry['name']), entry['text']
+
+    def put(self, key, name, text):
+        """Record a stored result image and its text, returning the image URL"""
+        entry = {'name': name, 'text': text, 'created': time.time()}
+        try:
+            self.storage.put(self._meta_name(key), json.dumps(entry).encode('utf-8'))
+        except Exception as e:
+            logging.warning(f"Could not write result cache entry {key}: {e}")
+
+        with self._lock:
+            self._remember(key, entry)
+            sweep = entry['created'] - self._last_sweep >= self.sweep_interval
+            if sweep:
+                self._last_sweep = entry['created']
+        if sweep:
+            self._expire()
+        return self.storage.url(name)
+
+    def stats(self):
+        """Hit/miss counters and current sizes"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'evictions': self.evictions,
+                'memory_entries': len(self._memory),
+            }
+
+    @staticmethod
+    def _meta_name(key):
+        return f"cache/{key}.json"
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _result_exists(self, meta_name):
+        try:
+            entry = json.loads(self.storage.read(meta_name) or b'null')
+            return bool(entry and 'name' in entry and self.storage.stat(entry['name']))
+        except ValueError:
+            return False
+
+    def _read_stored_entry(self, key, now):
+        try:
+            data = self.storage.read(self._meta_name(key))
+            entry = json.loads(data) if data else None
+        except Exception as e:
+            logging.warning(f"Could not read result cache entry {key}: {e}")
+            return None
+
+        if not entry or 'name' not in entry:
+            return None
+        if now - entry.get('created', 0) >= self.ttl or not self.storage.stat(entry['name']):
+            self.storage.delete(self._meta_name(key))
+            return None
+        return entry
+
+    def prune(self):
+        """Drop stored entries older than the TTL or whose result image is gone"""
+        self._expire(check_results=True)
+
+    def _expire(self, check_results=False):
+        """Drop stored entries older than the TTL, and with ``check_results`` those without an image"""
+        now = time.time()
+        try:
+            for item in list(self.storage.list('cache/')):
+                if now - item.modified < self.ttl and item.name.endswith('.json'):
+                    if not check_results or self._result_exists(item.name):
+                        continue
+                self.storage.delete(item.name)
+                with self._lock:
+                    self._memory.pop(item.name[len('cache/'):].rsplit('.', 1)[0], None)
+                    self.evictions += 1
+        except Exception as e:
+            logging.warning(f"Could not expire result cache entries: {e}")
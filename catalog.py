@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import re
+import time
+
+from fit import fit_engine
+from imaging import normalize_image
+
+SKU_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+
+
+class UnknownProductError(Exception):
+    pass
+
+
+class Product:
+    """A catalog item with its model-ready image and optional size chart"""
+
+    def __init__(self, sku, name, image, garment=None, chart=None):
+        self.sku = sku
+        self.name = name
+        self.image = image
+        self.garment = garment
+        self.chart = chart
+
+    def product_size(self, size, chest='', length=''):
+        """Product size details for the fit engine, using this product's chart"""
+        product_size = {'size': size, 'chest': chest, 'length': length}
+        if self.garment:
+            product_size['garment'] = self.garment
+        if self.chart:
+            product_size['chart'] = self.chart
+        return product_size
+
+    def to_dict(self):
+        return {'sku': self.sku, 'name': self.name, 'garment': self.garment}
+
+
+class ProductCatalog:
+    """Registry of catalog product images, normalized once and kept in memory.
+
+    Products are listed in a JSON manifest::
+
+        {"products": [{"sku": "TEE-001", "name": "Crew tee", "image": "tee-001.jpg",
+                       "garment": "tshirt",
+                       "size_chart": {"sizes": ["S", "M"], "chest": [40, 43], "length": [27, 28]}}]}
+
+    Image paths are relative to the manifest. Call ``load()`` before the
+    server forks its workers (e.g. gunicorn ``--preload``) so they share
+    the preloaded bytes.
+    """
+
+    def __init__(self, manifest_path, model=None):
+        self.manifest_path = manifest_path
+        self.model = model
+        self._products = {}
+
+    def load(self):
+        """Read the manifest and normalize every product image; returns the product count"""
+        if not os.path.exists(self.manifest_path):
+            logging.info(f"No product catalog at {self.manifest_path}")
+            return 0
+
+        started = time.perf_counter()
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        base_dir = os.path.dirname(self.manifest_path)
+
+        products = {}
+        for entry in manifest.get('products', []):
+            try:
+                product = self._load_product(entry, base_dir)
+            except (KeyError, OSError, ValueError) as e:
+                logging.warning(f"Skipping catalog product {entry.get('sku')!r}: {e}")
+                continue
+            products[product.sku] = product
+
+        self._products = products
+        total_bytes = sum(len(product.image) for product in products.values())
+        logging.info(f"Loaded {len(products)} catalog products ({total_bytes} image bytes) "
+                     f"in {time.perf_counter() - started:.2f}s")
+        return len(products)
+
+    def _load_product(self, entry, base_dir):
+        sku = str(entry['sku'])
+        if not SKU_PATTERN.match(sku):
+            raise ValueError('invalid SKU')
+        with open(os.path.join(base_dir, entry['image']), 'rb') as f:
+            image, _ = normalize_image(f.read(), model=self.model)
+
+        chart = None
+        if entry.get('size_chart'):
+            chart = f"sku:{sku}"
+            fit_engine.add_chart(chart, entry['size_chart'])
+        return Product(sku, entry.get('name') or sku, image, entry.get('garment'), chart)
+
+    def get(self, sku):
+        """Return the product for a SKU; raises UnknownProductError"""
+        product = self._products.get(sku)
+        if product is None:
+            raise UnknownProductError(f"Unknown product SKU: {sku}")
+        return product
+
+    def products(self):
+        return list(self._products.values())
+
+    def __len__(self):
+        return len(self._products)
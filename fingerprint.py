@@ -0,0 +1,222 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from results import atomic_write
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends and compaction are only serialized within one process
+    fcntl = None
+
+HASH_SIZE = 8  # 8x8 gradient grid -> 64-bit fingerprint
+THUMBNAIL_SIZE = 8  # 8x8 RGB thumbnail that confirms a fingerprint match
+COLOR_TOLERANCE = 8  # largest channel difference between thumbnails of the same photo
+
+
+def fingerprint_image(data: bytes, hash_size=HASH_SIZE):
+    """Compute a difference hash and a small color thumbnail of image bytes.
+
+    The image is decoded at reduced size. For the hash it is converted to
+    grayscale and shrunk to ``hash_size + 1`` by ``hash_size`` pixels; each
+    bit records whether a pixel is brighter than its left neighbour.
+    Recompressing or resizing a photo changes only a few bits. The hash
+    ignores color and flat images all hash alike, so a match is confirmed
+    against the ``THUMBNAIL_SIZE`` square RGB thumbnail.
+
+    Returns ``(fingerprint, aspect_ratio, thumbnail_bytes)``.
+    Raises ValueError if the bytes are not a readable image.
+    """
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # JPEG decoders can scale by 1/8 while decoding, which is all we need
+            img.draft("RGB", (hash_size * 4, hash_size * 4))
+            image = ImageOps.exif_transpose(img).convert("RGB")
+            aspect_ratio = image.width / image.height
+            thumbnail = image.resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.BOX).tobytes()
+            gray = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Unreadable image: {e}")
+
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big"), aspect_ratio, thumbnail
+
+
+def dhash(data: bytes, hash_size=HASH_SIZE):
+    """Difference hash of image bytes; returns ``(fingerprint, aspect_ratio)``"""
+    fingerprint, aspect_ratio, _ = fingerprint_image(data, hash_size)
+    return fingerprint, aspect_ratio
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def same_colors(a, b, tolerance=COLOR_TOLERANCE):
+    """True if two thumbnails differ by at most ``tolerance`` in every channel of every pixel"""
+    return len(a) == len(b) and all(abs(x - y) <= tolerance for x, y in zip(a, b))
+
+
+class NearDuplicateIndex:
+    """Finds a shopper's previously normalized uploads of the same photo.
+
+    Fingerprints are indexed with multi-index hashing: the 64-bit hash is
+    split into ``max_distance + 1`` blocks, and any hash within the distance
+    must match at least one block exactly, so a lookup only compares the
+    few entries sharing a block instead of every stored fingerprint. A
+    candidate is only reused when its color thumbnail matches too, and only
+    within the same ``scope`` (shopper), so nobody gets another's photo.
+
+    Normalized bytes are stored as ``upload_<hash>.jpg`` in ``directory``
+    (so a ResultJanitor can bound it) and entries are appended to
+    ``index.log``, which every worker process tails to pick up the others'
+    uploads. Once the log grows past ``max_log_bytes`` it is rewritten
+    without the entries whose files the janitor removed, so it stays in
+    step with the uploads actually kept; it is next compacted when it has
+    doubled again. Appends and compaction hold a lock on ``index.lock``,
+    so no process appends to a log that another is replacing.
+    """
+
+    def __init__(self, directory, max_distance=4, max_aspect_delta=0.02, bits=HASH_SIZE * HASH_SIZE,
+                 max_log_bytes=8 * 1024 * 1024):
+        self.directory = directory
+        self.max_distance = max_distance
+        self.max_aspect_delta = max_aspect_delta
+        self.max_log_bytes = max_log_bytes
+        self.log_path = os.path.join(directory, "index.log")
+        self.lock_path = os.path.join(directory, "index.lock")
+        self._lock = threading.Lock()
+
+        blocks = max_distance + 1
+        width, extra = divmod(bits, blocks)
+        self._blocks = []
+        shift = bits
+        for i in range(blocks):
+            size = width + (1 if i < extra else 0)
+            shift -= size
+            self._blocks.append((shift, (1 << size) - 1))
+        self._reset()
+
+    def _reset(self):
+        self._hashes = []
+        self._entries = []
+        self._known = set()
+        self._offset = 0
+        self._inode = None
+        self._compact_at = self.max_log_bytes
+        self._tables = [{} for _ in self._blocks]
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f"upload_{digest}.jpg")
+
+    def _insert(self, fingerprint, model, scope, aspect_ratio, digest, thumbnail):
+        if (model, scope, digest) in self._known:
+            return
+        self._known.add((model, scope, digest))
+        index = len(self._entries)
+        self._hashes.append(fingerprint)
+        self._entries.append((model, scope, aspect_ratio, digest, thumbnail))
+        for (shift, mask), table in zip(self._blocks, self._tables):
+            table.setdefault((fingerprint >> shift) & mask, []).append(index)
+
+    def _refresh(self):
+        """Load entries appended by any process since the last read"""
+        try:
+            with open(self.log_path, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                if inode != self._inode:
+                    # First read, or another process compacted the log: start over
+                    self._reset()
+                    self._inode = inode
+                    self._compact_at = max(self.max_log_bytes, 2 * os.fstat(f.fileno()).st_size)
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Ignore a partially written trailing line until it is complete
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                fingerprint, model, scope, aspect_ratio, digest, thumbnail = line.decode().split(" ")
+                self._insert(int(fingerprint, 16), model, scope, float(aspect_ratio), digest,
+                             bytes.fromhex(thumbnail))
+            except ValueError:
+                logging.warning(f"Skipping malformed near-duplicate index line: {line[:80]!r}")
+        self._offset += end
+
+    @contextmanager
+    def _log_lock(self):
+        """Hold the lock that serializes appends and compaction across processes"""
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.lock_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # releases the lock
+
+    def _compact(self):
+        """Rewrite the log without entries whose files are gone; call with both locks held"""
+        self._refresh()
+        lines = [f"{fingerprint:016x} {model} {scope} {aspect_ratio:.4f} {digest} {thumbnail.hex()}\n"
+                 for fingerprint, (model, scope, aspect_ratio, digest, thumbnail) in zip(self._hashes, self._entries)
+                 if os.path.exists(self._path(digest))]
+        atomic_write(self.log_path, "".join(lines).encode())
+        logging.info(f"Compacted near-duplicate index from {len(self._entries)} to {len(lines)} entries")
+        self._reset()
+        self._refresh()
+
+    def find(self, fingerprint, aspect_ratio, model, scope, thumbnail):
+        """Return normalized bytes of the same photo uploaded earlier in ``scope``, or None"""
+        with self._lock:
+            self._refresh()
+            candidates = set()
+            for (shift, mask), table in zip(self._blocks, self._tables):
+                candidates.update(table.get((fingerprint >> shift) & mask, ()))
+            matches = []
+            for index in candidates:
+                distance = hamming_distance(fingerprint, self._hashes[index])
+                entry_model, entry_scope, entry_aspect, digest, entry_thumbnail = self._entries[index]
+                if (distance <= self.max_distance and entry_model == model and entry_scope == scope
+                        and abs(entry_aspect - aspect_ratio) <= self.max_aspect_delta * aspect_ratio
+                        and same_colors(thumbnail, entry_thumbnail)):
+                    matches.append((distance, digest))
+
+        for distance, digest in sorted(matches):
+            try:
+                with open(self._path(digest), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue  # removed by the janitor
+            logging.debug(f"Near-duplicate upload found at distance {distance}: {digest}")
+            return data
+        return None
+
+    def add(self, fingerprint, aspect_ratio, model, scope, thumbnail, image_bytes):
+        """Store normalized bytes for an upload and index its fingerprint under ``scope``"""
+        digest = hashlib.sha256(image_bytes).hexdigest()[:20]
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(digest)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            atomic_write(path, image_bytes)
+        line = f"{fingerprint:016x} {model} {scope} {aspect_ratio:.4f} {digest} {thumbnail.hex()}\n".encode()
+        with self._lock, self._log_lock():
+            fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            self._refresh()
+            if self._offset > self._compact_at:
+                self._compact()
@@ -0,0 +1,224 @@
+import math
+
+# Garment measurements (inches) per size. Letter sizes follow a typical
+# unisex top chart; numeric sizes are jacket/shirt sizes named by chest.
+SIZE_CHARTS = {
+    'letter': {
+        'sizes': ['XS', 'S', 'M', 'L', 'XL', 'XXL', '3XL'],
+        'chest': [36, 39, 42, 45, 48, 51, 54],
+        'length': [26, 27, 28, 29, 30, 31, 32],
+    },
+    'numeric': {
+        'sizes': ['34', '36', '38', '40', '42', '44', '46', '48', '50'],
+        'chest': [38, 40, 42, 44, 46, 48, 50, 52, 54],
+        'length': [27, 27.5, 28, 28.5, 29, 29.5, 30, 30.5, 31],
+    },
+}
+
+# Comfortable garment-minus-body chest ease (min, max) in inches
+EASE_TOLERANCES = {
+    'fitted': (1.0, 3.0),
+    'shirt': (2.0, 6.0),
+    'tshirt': (2.0, 5.0),
+    'sweater': (3.0, 7.0),
+    'jacket': (4.0, 8.0),
+    'oversized': (6.0, 12.0),
+}
+DEFAULT_GARMENT = 'shirt'
+
+# Typical top length as a fraction of height, and the allowed deviation
+LENGTH_RATIO = 0.40
+LENGTH_TOLERANCE = 1.5
+
+VERDICT_MESSAGES = {
+    'perfect': "Size {size} looks like a great fit, with about {ease:.0f} inches of room across the chest.",
+    'snug': "Size {size} will feel snug across the chest.",
+    'too tight': "Size {size} is likely too tight across the chest.",
+    'loose': "Size {size} will have a relaxed, roomy fit.",
+    'too loose': "Size {size} will probably feel too big on you.",
+}
+
+
+def build_chart(chart):
+    """Validate a size chart and convert its measurements to floats (NaN where missing).
+
+    Raises ValueError if the columns are missing or of different lengths.
+    """
+    try:
+        sizes = [str(size).strip().upper() for size in chart['sizes']]
+        chest = [math.nan if value is None else float(value) for value in chart['chest']]
+        length = [math.nan if value is None else float(value)
+                  for value in chart.get('length', [None] * len(sizes))]
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f"Invalid size chart: {e}")
+    if not sizes or len(chest) != len(sizes) or len(length) != len(sizes):
+        raise ValueError("Invalid size chart: sizes, chest and length must have the same length")
+    return {'sizes': sizes, 'chest': chest, 'length': length}
+
+
+def _to_float(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+class FitEngine:
+    """Deterministic fit scoring against garment size charts.
+
+    Scores are penalties: near 0 means the chest ease sits in the middle of
+    the garment's comfortable range and the length matches the body;
+    larger is worse.
+    """
+
+    def __init__(self, charts=None, ease_tolerances=None):
+        self.charts = {name: build_chart(chart) for name, chart in (charts or SIZE_CHARTS).items()}
+        # Only the general charts are candidates for detecting a chart from a size label
+        self.general_charts = list(self.charts)
+        self.ease_tolerances = ease_tolerances or EASE_TOLERANCES
+
+    def add_chart(self, name, chart):
+        """Register a product-specific size chart, selectable with ``product_size['chart']``"""
+        self.charts[name] = build_chart(chart)
+
+    def detect_chart(self, size):
+        """Return the name of the size chart a size label belongs to, or None"""
+        label = str(size).strip().upper()
+        for name in self.general_charts:
+            if label in self.charts[name]['sizes']:
+                return name
+        return None
+
+    def adjacent_sizes(self, product_size, count=1):
+        """The sizes next to ``product_size`` in its chart, nearest first, larger before smaller.
+
+        Neighbors take the chart's chest and length where the given size
+        filled them in from its chart row, and leave them blank where it
+        left them blank. Returns [] when the size is in no chart or carries
+        its own measurements, since the next request cannot be predicted.
+        """
+        size = str(product_size.get('size', '')).strip().upper()
+        chart = product_size.get('chart')
+        if chart not in self.charts or size not in self.charts[chart]['sizes']:
+            chart = self.detect_chart(size)
+        if not chart:
+            return []
+        table = self.charts[chart]
+        index = table['sizes'].index(size)
+        filled = {}
+        for column in ('chest', 'length'):
+            given = str(product_size.get(column, '')).strip()
+            if given and _to_float(given) != table[column][index]:
+                return []
+            filled[column] = bool(given)
+
+        neighbors = []
+        for distance in range(1, count + 1):
+            for i in (index + distance, index - distance):
+                if 0 <= i < len(table['sizes']):
+                    neighbor = dict(product_size, size=table['sizes'][i])
+                    for column, is_filled in filled.items():
+                        neighbor[column] = f"{table[column][i]:g}" if is_filled else ''
+                    neighbors.append(neighbor)
+        return neighbors
+
+    def score(self, body_chest, body_height, garment_chest, garment_length, garment=DEFAULT_GARMENT):
+        """Vectorized penalty and chest ease for arrays of garment measurements"""
+        import numpy as np
+
+        low, high = self.ease_tolerances.get(garment, self.ease_tolerances[DEFAULT_GARMENT])
+        ease = np.asarray(garment_chest, dtype=float) - body_chest
+        chest_penalty = np.maximum(low - ease, 0) * 2.0 + np.maximum(ease - high, 0)
+        # Small pull towards the middle of the range breaks ties between comfortable sizes
+        chest_penalty += np.abs(ease - (low + high) / 2) * 0.05
+
+        length_penalty = np.zeros_like(ease)
+        if body_height and garment_length is not None:
+            ideal_length = body_height * LENGTH_RATIO
+            length_error = np.abs(np.asarray(garment_length, dtype=float) - ideal_length)
+            length_penalty = np.nan_to_num(np.maximum(length_error - LENGTH_TOLERANCE, 0) * 0.5)
+        return chest_penalty + length_penalty, ease
+
+    def rank_sizes(self, body_measurements, chart='letter', garment=DEFAULT_GARMENT):
+        """Score every size in a chart and return them best first"""
+        import numpy as np
+
+        table = self.charts[chart]
+        scores, ease = self.score(body_measurements.get('chest', 0), body_measurements.get('height', 0),
+                                  table['chest'], table['length'], garment)
+        order = np.argsort(scores, kind='stable')
+        return [
+            {'size': table['sizes'][i], 'score': float(scores[i]), 'chest_ease': float(ease[i]),
+             'verdict': self.verdict(ease[i], garment)}
+            for i in order
+        ]
+
+    def verdict(self, ease, garment=DEFAULT_GARMENT):
+        """Describe a chest ease; raises ValueError unless it is a finite number"""
+        if not math.isfinite(ease):
+            raise ValueError(f"Chest ease must be a finite number, got {ease!r}")
+        low, high = self.ease_tolerances.get(garment, self.ease_tolerances[DEFAULT_GARMENT])
+        if ease < low - 2:
+            return 'too tight'
+        if ease < low:
+            return 'snug'
+        if ease > high + 3:
+            return 'too loose'
+        if ease > high:
+            return 'loose'
+        return 'perfect'
+
+    def assess(self, body_measurements, product_size, garment=None):
+        """Assess a product size for a body and suggest the best size from its chart.
+
+        Uses the product's own chest/length when given, otherwise the chart
+        measurements for its size label. ``product_size['chart']`` names a
+        registered chart to use instead of detecting one from the label.
+        """
+        garment = garment or product_size.get('garment') or DEFAULT_GARMENT
+        label = str(product_size.get('size', '')).strip()
+        size = label.upper()
+        chart = product_size.get('chart')
+        if chart not in self.charts or size not in self.charts[chart]['sizes']:
+            chart = self.detect_chart(size)
+
+        chest = _to_float(product_size.get('chest'))
+        length = _to_float(product_size.get('length'))
+        if chart and (chest is None or length is None):
+            index = self.charts[chart]['sizes'].index(size)
+            chest = self.charts[chart]['chest'][index] if chest is None else chest
+            length = self.charts[chart]['length'][index] if length is None else length
+
+        assessment = {'size': label or 'this size', 'garment': garment, 'verdict': None,
+                      'chest_ease': None, 'best_size': None}
+        if chest is None:
+            return assessment
+
+        scores, ease = self.score(body_measurements.get('chest', 0), body_measurements.get('height', 0),
+                                  [chest], [math.nan if length is None else length], garment)
+        if not math.isfinite(ease[0]):
+            return assessment
+        assessment['score'] = float(scores[0])
+        assessment['chest_ease'] = float(ease[0])
+        assessment['verdict'] = self.verdict(ease[0], garment)
+        if chart:
+            assessment['best_size'] = self.rank_sizes(body_measurements, chart, garment)[0]['size']
+        return assessment
+
+    def recommend(self, body_measurements, product_size, garment=None):
+        """Friendly one or two sentence fit recommendation"""
+        assessment = self.assess(body_measurements, product_size, garment)
+        if assessment['verdict'] is None:
+            return (f"We couldn't compare size {assessment['size']} with your measurements. "
+                    "Add the product's chest measurement for a personalized fit check.")
+
+        text = VERDICT_MESSAGES[assessment['verdict']].format(size=assessment['size'],
+                                                              ease=assessment['chest_ease'])
+        best_size = assessment['best_size']
+        if best_size and best_size != assessment['size'].upper() and assessment['verdict'] != 'perfect':
+            text += f" We'd suggest trying size {best_size} for the best fit."
+        return text
+
+
+fit_engine = FitEngine()
@@ -1,235 +1,594 @@
+import asyncio
+import contextvars
+import functools
 import json
 import logging
 import os
 import base64
-from google import genai
-from google.genai import types
-from pydantic import BaseModel
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from archive import note_generation
+from cache import ResultCache
+from fit import fit_engine
+from gemini_client import GeminiClient
+from imaging import read_image
+from metrics import observe_stage
+from prompts import ANALYZE_IMAGE, DESCRIPTION_TRYON, ENHANCED_TRYON, FIT_POLISH, TRYON, measurement_values
+from results import save_result
+from routing import LoadShedError, ModelRouter
+from singleflight import SingleFlight
+from storage import create_storage
+
+
+
+IMAGE_MODEL = "gemini-2.0-flash-preview-image-generation"
+FIT_MODEL = "gemini-2.5-flash"
+ANALYSIS_MODEL = "gemini-2.5-pro"
+
+# Fallbacks, tried in order when the preferred model is rate limited, failing or slow
+IMAGE_FALLBACK_MODELS = [m for m in os.environ.get("GEMINI_IMAGE_FALLBACK_MODELS", "gemini-2.5-flash-image").split(",") if m]
+FIT_FALLBACK_MODELS = [m for m in os.environ.get("GEMINI_FIT_FALLBACK_MODELS", "gemini-2.5-flash-lite").split(",") if m]
+ANALYSIS_FALLBACK_MODELS = [m for m in os.environ.get("GEMINI_ANALYSIS_FALLBACK_MODELS", "gemini-2.5-flash").split(",") if m]
+
+# Image models that must be asked for text along with the image
+TEXT_REQUIRED_IMAGE_MODELS = {"gemini-2.0-flash-preview-image-generation"}
+
+# Routes each task to a model from rolling latency and error rates; polishing
+# fit text and image analysis are optional and shed under pressure
+model_router = ModelRouter(
+    {
+        "tryon_image": [IMAGE_MODEL] + IMAGE_FALLBACK_MODELS,
+        "fit_polish": [FIT_MODEL] + FIT_FALLBACK_MODELS,
+        "analyze_image": [ANALYSIS_MODEL] + ANALYSIS_FALLBACK_MODELS,
+    },
+    optional={"fit_polish", "analyze_image"},
+    slow_after={
+        IMAGE_MODEL: float(os.environ.get("ROUTER_IMAGE_SLOW_AFTER", 45)),
+        FIT_MODEL: float(os.environ.get("ROUTER_FIT_SLOW_AFTER", 8)),
+        ANALYSIS_MODEL: float(os.environ.get("ROUTER_ANALYSIS_SLOW_AFTER", 30)),
+    },
+    window=int(os.environ.get("ROUTER_WINDOW", 60)),
+    cooldown=int(os.environ.get("ROUTER_COOLDOWN", 30)),
+    reduce_pressure=float(os.environ.get("ROUTER_REDUCE_PRESSURE", 0.6)),
+    shed_pressure=float(os.environ.get("ROUTER_SHED_PRESSURE", 0.85)),
+)
+
+# Image calls in flight relative to what the image model is expected to sustain
+IMAGE_CAPACITY = int(os.environ.get("ROUTER_IMAGE_CAPACITY", os.environ.get("GEMINI_IMAGE_CONCURRENCY", 8)))
+model_router.add_pressure_source(
+    "image_calls", lambda: sum(model_router.in_flight(m) for m in model_router.routes["tryon_image"]) / IMAGE_CAPACITY)
+
+# Pooled connections, per-model concurrency limits, deadlines and retries
+client = GeminiClient(api_key=os.environ.get("GEMINI_API_KEY"), router=model_router)
+
+# Shared pool for running independent Gemini calls side by side
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get("GEMINI_PARALLEL_CALLS", 16)),
+                              thread_name_prefix="gemini")
+
+IMAGE_TIMEOUT = float(os.environ.get("GEMINI_IMAGE_TIMEOUT", 120))
+FIT_TIMEOUT = float(os.environ.get("GEMINI_FIT_TIMEOUT", 30))
+FIT_LLM_POLISH = os.environ.get("FIT_LLM_POLISH", "").lower() in ("1", "true", "yes")
+
+RESULTS_DIR = os.path.join("static", "results")
+
+# Where generated images live: local disk, an in-process LRU or an S3-compatible bucket
+result_storage = create_storage(os.environ.get("RESULTS_STORAGE", "local"), RESULTS_DIR)
+
+# Generated results keyed by model, prompt and input images. The cache only
+# holds small metadata entries pointing at results, so there is no separate
+# cache size cap any more: cached images are results, bounded by the results
+# janitor (RESULTS_MAX_BYTES), RESULTS_MEMORY_MAX_BYTES or the bucket's own rules.
+if os.environ.get("RESULT_CACHE_MAX_BYTES"):
+    logging.warning("RESULT_CACHE_MAX_BYTES is no longer used; set RESULTS_MAX_BYTES to bound stored results")
+result_cache = ResultCache(result_storage,
+                           max_memory_entries=int(os.environ.get("RESULT_CACHE_ENTRIES", 256)),
+                           ttl=int(os.environ.get("RESULT_CACHE_TTL", 86400)))
+
+# Identical generations in flight together share one Gemini call. Set
+# GENERATION_LOCK_DIR to a local directory to share them across worker processes too.
+generation_flights = SingleFlight(os.environ.get("GENERATION_LOCK_DIR"),
+                                  lock_timeout=IMAGE_TIMEOUT + 30)
+
+FIT_FALLBACK = "Unable to analyze fit at this time. Please check the measurements and try again."
+
+
+def warm():
+    """Import the Gemini SDK now rather than on the first call, e.g. in a
+    server process that preloads the app before forking its workers"""
+    from google.genai import errors, types  # noqa: F401
+    import httpx  # noqa: F401
+    _image_config()
+    _image_config(image_only=True)
+
+
+def analyze_image(jpeg_image) -> str:
+    """Analyze an image (JPEG bytes or file path) and return detailed description.
+
+    Raises LoadShedError when the service is too busy for optional analysis.
+    """
+    if model_router.should_shed("analyze_image"):
+        raise LoadShedError("Image analysis is unavailable while the service is busy. Please try again later.")
+    from google.genai import types
+
+    image_bytes = read_image(jpeg_image)
+    response = client.models.generate_content(
+        model=model_router.choose("analyze_image"),
+        contents=[
+            types.Part.from_bytes(
+                data=image_bytes,
+                mime_type="image/jpeg",
+            ),
+            ANALYZE_IMAGE.render(),
+        ],
+    )
 
+    return response.text if response.text else ""
 
 
-client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+@functools.lru_cache(maxsize=None)
+def _image_config(image_only=False):
+    """Image model config; ``image_only`` is the reduced output mode used under
+    pressure: the image alone, without the model's commentary"""
+    from google.genai import types
 
+    return types.GenerateContentConfig(
+        response_modalities=['IMAGE'] if image_only else ['TEXT', 'IMAGE']
+    )
 
-class TryOnResult(BaseModel):
-    success: bool
-    recommendation: str
-    fit_description: str
 
+def _image_route():
+    """Pick the image model and config for the next call.
 
-def analyze_image(jpeg_image_path: str) -> str:
-    """Analyze an image and return detailed description"""
-    with open(jpeg_image_path, "rb") as f:
-        image_bytes = f.read()
-        response = client.models.generate_content(
-            model="gemini-2.5-pro",
-            contents=[
-                types.Part.from_bytes(
-                    data=image_bytes,
-                    mime_type="image/jpeg",
-                ),
-                "Analyze this image in detail and describe its key " +
-                "elements, context, and any notable aspects.",
-            ],
-        )
+    Returns ``(model, config, full_quality)``; results from a fallback model
+    or in reduced output mode are not cached, so the cache refills with
+    full-quality results once the preferred model recovers.
+    """
+    model = model_router.choose("tryon_image")
+    reduced = model_router.reduce_output("tryon_image")
+    image_only = reduced and model not in TEXT_REQUIRED_IMAGE_MODELS
+    return model, _image_config(image_only), model == IMAGE_MODEL and not image_only
 
-    return response.text if response.text else ""
 
+def _response_parts(response):
+    """Return the parts of the first candidate of an image model response"""
+    if not response.candidates:
+        raise Exception("No response candidates generated")
 
-def generate_tryon_image(user_image_path: str, product_image_path: str, 
-                        body_measurements: dict, product_size: dict) -> str:
-    """Generate a try-on visualization using Gemini"""
-    try:
-        # Read user image
-        with open(user_image_path, "rb") as f:
-            user_image_bytes = f.read()
-        
-        # Read product image  
-        with open(product_image_path, "rb") as f:
-            product_image_bytes = f.read()
+    content = response.candidates[0].content
+    if not content or not content.parts:
+        raise Exception("No content parts in response")
+    return content.parts
 
-        # Create detailed prompt for try-on generation
-        prompt = f"""
-        Create a realistic try-on visualization showing the person wearing the clothing item. 
-        
-        User measurements:
-        - Chest: {body_measurements.get('chest', 'N/A')} inches
-        - Waist: {body_measurements.get('waist', 'N/A')} inches  
-        - Height: {body_measurements.get('height', 'N/A')} inches
-        
-        Product size information:
-        - Size: {product_size.get('size', 'N/A')}
-        - Chest: {product_size.get('chest', 'N/A')} inches
-        - Length: {product_size.get('length', 'N/A')} inches
-        
-        Generate a photorealistic image showing the person from the first image wearing the clothing item from the second image. 
-        Ensure proper fit and proportions based on the measurements provided. The result should look natural and realistic.
-        """
 
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-preview-image-generation",
-            contents=[
-                types.Part.from_bytes(
-                    data=user_image_bytes,
-                    mime_type="image/jpeg",
-                ),
-                types.Part.from_bytes(
-                    data=product_image_bytes,
-                    mime_type="image/jpeg",
-                ),
-                prompt
-            ],
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE']
-            )
-        )
+def _note_call(model, started, usage):
+    """Record the model, latency and token usage of an image call for the archive"""
+    note_generation(model=model, latency_ms=(time.perf_counter() - started) * 1000,
+                    prompt_tokens=getattr(usage, 'prompt_token_count', None),
+                    output_tokens=getattr(usage, 'candidates_token_count', None),
+                    total_tokens=getattr(usage, 'total_token_count', None))
 
-        if not response.candidates:
-            raise Exception("No response candidates generated")
 
-        content = response.candidates[0].content
-        if not content or not content.parts:
-            raise Exception("No content parts in response")
+def _generate_image_parts(contents, on_event=None):
+    """Call the routed image model; returns the parts of the first candidate and
+    whether they are full quality (see _image_route).
 
-        # Save the generated image
-        output_path = None
-        recommendation_text = "Try-on generated successfully!"
-        
-        for part in content.parts:
+    With ``on_event`` the response is streamed: text is reported as
+    ``text`` events as soon as it arrives and merged into a single part.
+    """
+    from google.genai import types
+
+    model, config, full_quality = _image_route()
+    started = time.perf_counter()
+
+    if on_event is None:
+        response = client.models.generate_content(
+            model=model,
+            contents=contents,
+            config=config
+        )
+        _note_call(model, started, response.usage_metadata)
+        return _response_parts(response), full_quality
+
+    text_chunks = []
+    parts = []
+    usage = None
+    for chunk in client.models.generate_content_stream(model=model, contents=contents, config=config):
+        usage = chunk.usage_metadata or usage
+        if not chunk.candidates or not chunk.candidates[0].content:
+            continue
+        for part in chunk.candidates[0].content.parts or []:
             if part.text:
-                recommendation_text = part.text
-                logging.info(f"Generated recommendation: {part.text}")
+                text_chunks.append(part.text)
+                on_event('text', text=part.text)
             elif part.inline_data and part.inline_data.data:
-                output_path = "static/results/tryon_result.jpg"
-                with open(output_path, 'wb') as f:
-                    f.write(part.inline_data.data)
-                logging.info(f"Try-on image saved as {output_path}")
+                parts.append(part)
+
+    _note_call(model, started, usage)
+    if text_chunks:
+        parts.insert(0, types.Part(text=''.join(text_chunks)))
+    if not parts:
+        raise Exception("No content parts in response")
+    return parts, full_quality
+
+
+def _render(template, **values):
+    """Render a prompt template; returns ``(prompt, prompt_key)`` for the result cache"""
+    prompt_started = time.perf_counter()
+    prompt = template.render(**values)
+    observe_stage('build_prompt', time.perf_counter() - prompt_started)
+    return prompt, template.key(**values)
+
+
+def _tryon_prompt(body_measurements, product_size):
+    """Build the image model prompt for a try-on; returns ``(prompt, prompt_key)``"""
+    return _render(TRYON, **measurement_values(body_measurements, product_size))
+
+
+def _tryon_contents(user_image_bytes, product_image_bytes, prompt):
+    from google.genai import types
+
+    return [
+        types.Part.from_bytes(
+            data=user_image_bytes,
+            mime_type="image/jpeg",
+        ),
+        types.Part.from_bytes(
+            data=product_image_bytes,
+            mime_type="image/jpeg",
+        ),
+        prompt
+    ]
+
+
+def _store_tryon(parts, cache_key):
+    """Save the generated image from response parts; returns (path, recommendation text).
+
+    The result is cached under ``cache_key`` unless it is None.
+    """
+    output_path = None
+    recommendation_text = "Try-on generated successfully!"
+
+    for part in parts:
+        if part.text:
+            recommendation_text = part.text
+            logging.info(f"Generated recommendation: {part.text}")
+        elif part.inline_data and part.inline_data.data:
+            result_name = save_result(part.inline_data.data, "tryon", result_storage)
+            output_path = result_storage.url(result_name)
+            logging.info(f"Try-on image saved as {output_path}")
+
+    if output_path and cache_key:
+        result_cache.put(cache_key, result_name, recommendation_text)
+    return output_path, recommendation_text
+
+
+def _tryon_error(e):
+    """User-facing exception for a failed try-on generation"""
+    logging.error(f"Failed to generate try-on image: {e}")
+    if "INVALID_ARGUMENT" in str(e) and "Unable to process input image" in str(e):
+        return Exception("The uploaded images couldn't be processed. Please make sure you uploaded clear, valid image files (JPEG, PNG, etc.)")
+    elif "INVALID_ARGUMENT" in str(e):
+        return Exception("Invalid input provided. Please check your images and try again.")
+    else:
+        return Exception(f"Failed to generate try-on visualization: {e}")
+
+
+def generate_tryon_image(user_image, product_image, 
+                        body_measurements: dict, product_size: dict, on_event=None) -> str:
+    """Generate a try-on visualization using Gemini.
+
+    Images may be given as JPEG bytes or as file paths. If ``on_event`` is
+    given, the response is streamed and progress is reported through it as
+    ``on_event(stage, **data)``.
+    """
+    try:
+        user_image_bytes = read_image(user_image)
+        product_image_bytes = read_image(product_image)
+
+        # Create detailed prompt for try-on generation
+        prompt, prompt_key = _tryon_prompt(body_measurements, product_size)
+
+        cache_key = result_cache.make_key(IMAGE_MODEL, prompt_key, user_image_bytes, product_image_bytes)
+        note_generation(inputs_hash=cache_key, prompt_hash=prompt_key)
+        cached = result_cache.get(cache_key)
+        if cached:
+            note_generation(cached=True)
+            logging.info(f"Try-on served from cache: {cached[0]}")
+            if on_event:
+                on_event('image_ready', result_image=cached[0], recommendation=cached[1])
+            return cached
+
+        def generate():
+            if on_event:
+                on_event('image_started')
+            parts, full_quality = _generate_image_parts(_tryon_contents(user_image_bytes, product_image_bytes, prompt),
+                                                        on_event)
+            # Save the generated image
+            return _store_tryon(parts, cache_key if full_quality else None)
+
+        output_path, recommendation_text = generation_flights.do(cache_key, generate,
+                                                                 lambda: result_cache.get(cache_key))
+        if output_path and on_event:
+            on_event('image_ready', result_image=output_path, recommendation=recommendation_text)
 
         return output_path, recommendation_text
 
     except Exception as e:
-        logging.error(f"Failed to generate try-on image: {e}")
-        if "INVALID_ARGUMENT" in str(e) and "Unable to process input image" in str(e):
-            raise Exception("The uploaded images couldn't be processed. Please make sure you uploaded clear, valid image files (JPEG, PNG, etc.)")
-        elif "INVALID_ARGUMENT" in str(e):
-            raise Exception("Invalid input provided. Please check your images and try again.")
-        else:
-            raise Exception(f"Failed to generate try-on visualization: {e}")
+        raise _tryon_error(e)
+
+
+def tryon_cache_key(user_image_bytes, product_image_bytes, body_measurements, product_size):
+    """Result cache key of a try-on with these inputs"""
+    _, prompt_key = _tryon_prompt(body_measurements, product_size)
+    return result_cache.make_key(IMAGE_MODEL, prompt_key, user_image_bytes, product_image_bytes)
+
 
+def pregenerate_tryon(user_image, product_image, body_measurements, product_size):
+    """Generate and cache a try-on image ahead of a likely request.
 
-def analyze_fit_recommendation(body_measurements: dict, product_size: dict) -> str:
-    """Generate fit recommendation based on measurements"""
+    Returns False without calling the model when the result is already
+    cached or would not be cached (fallback model or reduced output).
+    """
+    user_image_bytes = read_image(user_image)
+    product_image_bytes = read_image(product_image)
+    if result_cache.get(tryon_cache_key(user_image_bytes, product_image_bytes, body_measurements, product_size)):
+        return False
+    if not _image_route()[2]:
+        return False
+    output_path, _ = generate_tryon_image(user_image_bytes, product_image_bytes, body_measurements, product_size)
+    logging.info(f"Pre-generated size {product_size.get('size')} as {output_path}")
+    return True
+
+
+async def generate_tryon_image_async(user_image_bytes: bytes, product_image_bytes: bytes,
+                                     body_measurements: dict, product_size: dict):
+    """Coroutine version of generate_tryon_image for JPEG bytes.
+
+    The Gemini call goes through the async client; cache lookups and result
+    writes run in worker threads so the event loop never blocks on disk.
+    """
     try:
-        prompt = f"""
-        Analyze the fit between user body measurements and product size information.
-        
-        User measurements:
-        - Chest: {body_measurements.get('chest', 'N/A')} inches
-        - Waist: {body_measurements.get('waist', 'N/A')} inches
-        - Height: {body_measurements.get('height', 'N/A')} inches
-        
-        Product size:
-        - Size: {product_size.get('size', 'N/A')}
-        - Chest: {product_size.get('chest', 'N/A')} inches
-        - Length: {product_size.get('length', 'N/A')} inches
-        
-        Provide a brief, helpful recommendation about the fit. Be specific about whether this size 
-        would be comfortable, tight, loose, or perfect. Suggest alternatives if needed.
-        Keep the response under 50 words and friendly in tone.
-        """
+        prompt, prompt_key = _tryon_prompt(body_measurements, product_size)
+        cache_key = result_cache.make_key(IMAGE_MODEL, prompt_key, user_image_bytes, product_image_bytes)
+        note_generation(inputs_hash=cache_key, prompt_hash=prompt_key)
+        cached = await asyncio.to_thread(result_cache.get, cache_key)
+        if cached:
+            note_generation(cached=True)
+            logging.info(f"Try-on served from cache: {cached[0]}")
+            return cached
+
+        async def generate():
+            model, config, full_quality = _image_route()
+            started = time.perf_counter()
+            response = await client.aio.models.generate_content(
+                model=model,
+                contents=_tryon_contents(user_image_bytes, product_image_bytes, prompt),
+                config=config
+            )
+            _note_call(model, started, response.usage_metadata)
+            return await asyncio.to_thread(_store_tryon, _response_parts(response),
+                                           cache_key if full_quality else None)
+
+        return await generation_flights.do_async(cache_key, generate,
+                                                 lambda: asyncio.to_thread(result_cache.get, cache_key))
+
+    except Exception as e:
+        raise _tryon_error(e)
+
+
+def analyze_fit_recommendation(body_measurements: dict, product_size: dict, polish: bool = None) -> str:
+    """Generate fit recommendation based on measurements.
 
+    The recommendation comes from the local fit engine; with ``polish``
+    (default: FIT_LLM_POLISH) a Gemini model rewrites it in a friendlier
+    tone, falling back to the local text if that call fails or is shed
+    under load.
+    """
+    try:
+        recommendation = fit_engine.recommend(body_measurements, product_size)
+    except Exception as e:
+        logging.error(f"Failed to analyze fit: {e}")
+        return FIT_FALLBACK
+
+    if polish is None:
+        polish = FIT_LLM_POLISH
+    if not polish or model_router.should_shed("fit_polish"):
+        return recommendation
+
+    try:
         response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt
+            model=model_router.choose("fit_polish"),
+            contents=_fit_polish_prompt(body_measurements, product_size, recommendation)
+        )
+
+        return response.text if response.text else recommendation
+
+    except Exception as e:
+        logging.error(f"Failed to polish fit recommendation: {e}")
+        return recommendation
+
+
+async def analyze_fit_recommendation_async(body_measurements: dict, product_size: dict,
+                                           polish: bool = None) -> str:
+    """Coroutine version of analyze_fit_recommendation"""
+    try:
+        recommendation = fit_engine.recommend(body_measurements, product_size)
+    except Exception as e:
+        logging.error(f"Failed to analyze fit: {e}")
+        return FIT_FALLBACK
+
+    if not (FIT_LLM_POLISH if polish is None else polish) or model_router.should_shed("fit_polish"):
+        return recommendation
+
+    try:
+        response = await client.aio.models.generate_content(
+            model=model_router.choose("fit_polish"),
+            contents=_fit_polish_prompt(body_measurements, product_size, recommendation)
         )
+        return response.text if response.text else recommendation
 
-        return response.text if response.text else "This size should work well for you!"
+    except Exception as e:
+        logging.error(f"Failed to polish fit recommendation: {e}")
+        return recommendation
+
+
+def _fit_polish_prompt(body_measurements, product_size, recommendation):
+    prompt, _ = _render(FIT_POLISH, recommendation=recommendation,
+                        **measurement_values(body_measurements, product_size))
+    return prompt
+
+
+def generate_tryon_with_fit(user_image, product_image,
+                            body_measurements: dict, product_size: dict,
+                            image_timeout: float = IMAGE_TIMEOUT, fit_timeout: float = FIT_TIMEOUT,
+                            on_event=None):
+    """Generate the try-on image and the fit recommendation concurrently.
+
+    Both calls start together, so latency is roughly the slower of the two.
+    A failed or slow fit analysis falls back to a generic message, while a
+    failed or slow image generation raises. Timeouts are measured from the
+    start of both calls; a timed out call is abandoned, not interrupted.
+    Progress, including the fit recommendation as soon as it is ready, is
+    reported through ``on_event`` if given.
+    """
+    started = time.monotonic()
+    # Run in a copy of the caller's context so the call details reach its archive record
+    image_future = executor.submit(contextvars.copy_context().run, generate_tryon_image, user_image, product_image,
+                                   body_measurements, product_size, on_event)
+    fit_future = executor.submit(analyze_fit_recommendation, body_measurements, product_size)
+    if on_event:
+        def report_fit(future):
+            if not future.cancelled() and future.exception() is None:
+                on_event('fit_ready', fit_recommendation=future.result())
+        fit_future.add_done_callback(report_fit)
+
+    try:
+        output_path, recommendation_text = image_future.result(timeout=image_timeout)
+    except FutureTimeoutError:
+        fit_future.cancel()
+        logging.error(f"Try-on image generation timed out after {image_timeout}s")
+        raise Exception("Try-on generation took too long. Please try again.")
+    except Exception:
+        fit_future.cancel()
+        raise
 
+    try:
+        remaining = max(0.0, fit_timeout - (time.monotonic() - started))
+        fit_recommendation = fit_future.result(timeout=remaining)
+    except FutureTimeoutError:
+        logging.warning(f"Fit analysis timed out after {fit_timeout}s")
+        fit_recommendation = FIT_FALLBACK
     except Exception as e:
         logging.error(f"Failed to analyze fit: {e}")
-        return "Unable to analyze fit at this time. Please check the measurements and try again."
+        fit_recommendation = FIT_FALLBACK
+
+    logging.info(f"Try-on and fit analysis finished in {time.monotonic() - started:.2f}s")
+    return output_path, recommendation_text, fit_recommendation
+
+
+async def generate_tryon_with_fit_async(user_image_bytes: bytes, product_image_bytes: bytes,
+                                        body_measurements: dict, product_size: dict,
+                                        image_timeout: float = IMAGE_TIMEOUT, fit_timeout: float = FIT_TIMEOUT):
+    """Coroutine version of generate_tryon_with_fit.
+
+    Unlike the threaded version, a call that exceeds its timeout is cancelled.
+    """
+    started = time.monotonic()
+    image_task = asyncio.ensure_future(asyncio.wait_for(
+        generate_tryon_image_async(user_image_bytes, product_image_bytes, body_measurements, product_size),
+        image_timeout))
+    fit_task = asyncio.ensure_future(asyncio.wait_for(
+        analyze_fit_recommendation_async(body_measurements, product_size), fit_timeout))
+
+    try:
+        output_path, recommendation_text = await image_task
+    except asyncio.TimeoutError:
+        fit_task.cancel()
+        logging.error(f"Try-on image generation timed out after {image_timeout}s")
+        raise Exception("Try-on generation took too long. Please try again.")
+    except BaseException:
+        fit_task.cancel()
+        raise
+
+    try:
+        fit_recommendation = await fit_task
+    except asyncio.TimeoutError:
+        logging.warning(f"Fit analysis timed out after {fit_timeout}s")
+        fit_recommendation = FIT_FALLBACK
+    except Exception as e:
+        logging.error(f"Failed to analyze fit: {e}")
+        fit_recommendation = FIT_FALLBACK
+
+    logging.info(f"Try-on and fit analysis finished in {time.monotonic() - started:.2f}s")
+    return output_path, recommendation_text, fit_recommendation
 
 
 def generate_tryon_from_description(user_description: str, product_description: str):
     """Generate a try-on visualization from text descriptions"""
     try:
-        prompt = f"""
-        Create a realistic try-on visualization based on these descriptions:
-        
-        Person: {user_description}
-        
-        Clothing Item: {product_description}
-        
-        Generate a photorealistic image showing the described person wearing the described clothing item. 
-        The image should be high quality, well-lit, and show how the clothing fits on the person. 
-        Make it look natural and realistic as if it's an actual photo of someone wearing the item.
-        """
+        prompt, prompt_key = _render(DESCRIPTION_TRYON, user_description=user_description,
+                                     product_description=product_description)
 
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-preview-image-generation",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE']
-            )
-        )
+        cache_key = result_cache.make_key(IMAGE_MODEL, prompt_key)
+        note_generation(inputs_hash=cache_key, prompt_hash=prompt_key)
+        cached = result_cache.get(cache_key)
+        if cached:
+            note_generation(cached=True)
+            logging.info(f"Prompt-based try-on served from cache: {cached[0]}")
+            return cached
 
-        if not response.candidates:
-            raise Exception("No response candidates generated")
+        def generate():
+            parts, full_quality = _generate_image_parts(prompt)
 
-        content = response.candidates[0].content
-        if not content or not content.parts:
-            raise Exception("No content parts in response")
+            # Save the generated image
+            output_path = None
+            recommendation_text = "Try-on generated successfully from description!"
 
-        # Save the generated image
-        output_path = None
-        recommendation_text = "Try-on generated successfully from description!"
-        
-        for part in content.parts:
-            if part.text:
-                recommendation_text = part.text
-                logging.info(f"Generated recommendation: {part.text}")
-            elif part.inline_data and part.inline_data.data:
-                output_path = "static/results/tryon_prompt_result.jpg"
-                with open(output_path, 'wb') as f:
-                    f.write(part.inline_data.data)
-                logging.info(f"Prompt-based try-on image saved as {output_path}")
+            for part in parts:
+                if part.text:
+                    recommendation_text = part.text
+                    logging.info(f"Generated recommendation: {part.text}")
+                elif part.inline_data and part.inline_data.data:
+                    result_name = save_result(part.inline_data.data, "tryon_prompt", result_storage)
+                    output_path = result_storage.url(result_name)
+                    logging.info(f"Prompt-based try-on image saved as {output_path}")
 
-        return output_path, recommendation_text
+            if output_path and full_quality:
+                result_cache.put(cache_key, result_name, recommendation_text)
+
+            return output_path, recommendation_text
+
+        return generation_flights.do(cache_key, generate, lambda: result_cache.get(cache_key))
 
     except Exception as e:
         logging.error(f"Failed to generate try-on from description: {e}")
         raise Exception(f"Failed to generate try-on from description: {e}")
 
 
-def generate_enhanced_tryon(user_image_path: str, product_image_path: str, 
+def generate_enhanced_tryon(user_image, product_image, 
                            person_measurements: str, product_details: str):
-    """Generate enhanced try-on with uploaded images and detailed prompts"""
+    """Generate enhanced try-on with uploaded images (JPEG bytes or file paths) and detailed prompts"""
     try:
-        # Read user image
-        with open(user_image_path, "rb") as f:
-            user_image_bytes = f.read()
-        
-        # Read product image  
-        with open(product_image_path, "rb") as f:
-            product_image_bytes = f.read()
+        user_image_bytes = read_image(user_image)
+        product_image_bytes = read_image(product_image)
 
         # Create enhanced prompt combining images and descriptions
-        prompt = f"""
-        Create a realistic try-on visualization using the uploaded images and these details:
-        
-        Person measurements and details: {person_measurements}
-        
-        Product size and details: {product_details}
-        
-        Using the person's photo and the product photo provided, generate a photorealistic image showing 
-        this person wearing the clothing item. Pay careful attention to the measurements provided to ensure 
-        proper fit and proportions. The result should look natural and realistic, taking into account both 
-        the visual information from the photos and the specific measurements and details provided.
-        """
+        prompt, prompt_key = _render(ENHANCED_TRYON, person_measurements=person_measurements,
+                                     product_details=product_details)
 
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-preview-image-generation",
-            contents=[
+        cache_key = result_cache.make_key(IMAGE_MODEL, prompt_key, user_image_bytes, product_image_bytes)
+        note_generation(inputs_hash=cache_key, prompt_hash=prompt_key)
+        cached = result_cache.get(cache_key)
+        if cached:
+            note_generation(cached=True)
+            logging.info(f"Enhanced try-on served from cache: {cached[0]}")
+            return cached
+
+        def generate():
+            from google.genai import types
+
+            parts, full_quality = _generate_image_parts([
                 types.Part.from_bytes(
                     data=user_image_bytes,
                     mime_type="image/jpeg",
@@ -239,34 +598,27 @@ def generate_enhanced_tryon(user_image_path: str, product_image_path: str,
                     mime_type="image/jpeg",
                 ),
                 prompt
-            ],
-            config=types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE']
-            )
-        )
+            ])
 
-        if not response.candidates:
-            raise Exception("No response candidates generated")
+            # Save the generated image
+            output_path = None
+            recommendation_text = "Enhanced try-on generated successfully!"
 
-        content = response.candidates[0].content
-        if not content or not content.parts:
-            raise Exception("No content parts in response")
+            for part in parts:
+                if part.text:
+                    recommendation_text = part.text
+                    logging.info(f"Generated enhanced recommendation: {part.text}")
+                elif part.inline_data and part.inline_data.data:
+                    result_name = save_result(part.inline_data.data, "tryon_enhanced", result_storage)
+                    output_path = result_storage.url(result_name)
+                    logging.info(f"Enhanced try-on image saved as {output_path}")
 
-        # Save the generated image
-        output_path = None
-        recommendation_text = "Enhanced try-on generated successfully!"
-        
-        for part in content.parts:
-            if part.text:
-                recommendation_text = part.text
-                logging.info(f"Generated enhanced recommendation: {part.text}")
-            elif part.inline_data and part.inline_data.data:
-                output_path = "static/results/tryon_enhanced_result.jpg"
-                with open(output_path, 'wb') as f:
-                    f.write(part.inline_data.data)
-                logging.info(f"Enhanced try-on image saved as {output_path}")
+            if output_path and full_quality:
+                result_cache.put(cache_key, result_name, recommendation_text)
 
-        return output_path, recommendation_text
+            return output_path, recommendation_text
+
+        return generation_flights.do(cache_key, generate, lambda: result_cache.get(cache_key))
 
     except Exception as e:
         logging.error(f"Failed to generate enhanced try-on: {e}")
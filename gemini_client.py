@@ -0,0 +1,449 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import (GEMINI_BYTES_RECEIVED, GEMINI_BYTES_SENT, GEMINI_CALL_SECONDS, GEMINI_ERRORS,
+                     GEMINI_IN_FLIGHT, GEMINI_RETRIES)
+
+# HTTP status codes worth retrying: timeouts, rate limits and transient server errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Maximum concurrent calls per model in this process
+DEFAULT_MODEL_CONCURRENCY = {
+    "gemini-2.0-flash-preview-image-generation": int(os.environ.get("GEMINI_IMAGE_CONCURRENCY", 8)),
+    "gemini-2.5-flash": int(os.environ.get("GEMINI_FLASH_CONCURRENCY", 32)),
+    "gemini-2.5-pro": int(os.environ.get("GEMINI_PRO_CONCURRENCY", 8)),
+}
+
+# Deadline per call in seconds, covering queueing, retries and backoff
+DEFAULT_MODEL_DEADLINES = {
+    "gemini-2.0-flash-preview-image-generation": float(os.environ.get("GEMINI_IMAGE_TIMEOUT", 120)),
+    "gemini-2.5-flash": float(os.environ.get("GEMINI_FIT_TIMEOUT", 30)),
+    "gemini-2.5-pro": float(os.environ.get("GEMINI_PRO_TIMEOUT", 60)),
+}
+DEFAULT_CONCURRENCY = 16
+DEFAULT_DEADLINE = 60.0
+
+# Calls waiting on the network cost no threads in async mode, so the async
+# client allows far more of them to models without a limit of their own
+DEFAULT_ASYNC_CONCURRENCY = int(os.environ.get("GEMINI_ASYNC_CONCURRENCY", 256))
+
+
+class GeminiUnavailableError(Exception):
+    """Raised when a call cannot be made or completed before its deadline"""
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter for retryable Gemini errors"""
+
+    def __init__(self, attempts=4, base_delay=0.5, max_delay=8.0):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_retryable(self, error):
+        import httpx
+        from google.genai import errors
+
+        if isinstance(error, errors.APIError):
+            return error.code in RETRYABLE_STATUS_CODES
+        return isinstance(error, (httpx.TimeoutException, httpx.NetworkError))
+
+    def delay(self, attempt):
+        """Sleep time before retry number ``attempt`` (1-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class ModelLimiter:
+    """Process-wide cap on concurrent calls per model"""
+
+    def __init__(self, limits=None, default=DEFAULT_CONCURRENCY):
+        self.limits = dict(DEFAULT_MODEL_CONCURRENCY if limits is None else limits)
+        self.default = default
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, model):
+        with self._lock:
+            if model not in self._semaphores:
+                self._semaphores[model] = threading.BoundedSemaphore(self.limits.get(model, self.default))
+            return self._semaphores[model]
+
+    @contextmanager
+    def slot(self, model, timeout):
+        """Hold one of the model's call slots, waiting at most ``timeout`` seconds"""
+        semaphore = self._semaphore(model)
+        if not semaphore.acquire(timeout=max(0.0, timeout)):
+            raise GeminiUnavailableError(f"Too many concurrent requests to {model}. Please try again.")
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+class AsyncModelLimiter:
+    """Per-model cap on concurrent calls from async code, with the same per-model limits as ModelLimiter"""
+
+    def __init__(self, limits=None, default=DEFAULT_ASYNC_CONCURRENCY):
+        self.limits = dict(DEFAULT_MODEL_CONCURRENCY if limits is None else limits)
+        self.default = default
+        self._semaphores = {}
+
+    @asynccontextmanager
+    async def slot(self, model, timeout):
+        """Hold one of the model's call slots, waiting at most ``timeout`` seconds"""
+        semaphore = self._semaphores.get(model)
+        if semaphore is None:
+            semaphore = self._semaphores[model] = asyncio.Semaphore(self.limits.get(model, self.default))
+        try:
+            await asyncio.wait_for(semaphore.acquire(), max(0.0, timeout))
+        except asyncio.TimeoutError:
+            raise GeminiUnavailableError(f"Too many concurrent requests to {model}. Please try again.")
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+@contextmanager
+def _instrumented(model, contents, router=None):
+    """Record metrics for one call, and report it to the model router if there is one"""
+    GEMINI_BYTES_SENT.inc(_request_bytes(contents), model=model)
+    GEMINI_IN_FLIGHT.inc(model=model)
+    if router:
+        router.begin(model)
+    started = time.perf_counter()
+    outcome = 'error'
+    error = None
+    try:
+        yield
+        outcome = 'ok'
+    except Exception as e:
+        error = e
+        GEMINI_ERRORS.inc(model=model, code=getattr(e, 'code', None) or type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        GEMINI_IN_FLIGHT.dec(model=model)
+        GEMINI_CALL_SECONDS.observe(elapsed, model=model, outcome=outcome)
+        if router:
+            router.end(model, elapsed, error)
+
+
+class ResilientModels:
+    """Wraps ``client.models`` with concurrency limits, deadlines, retries and metrics.
+
+    Attributes other than ``generate_content`` and ``generate_content_stream``
+    are passed through to the wrapped models object unchanged.
+    """
+
+    def __init__(self, models, limiter, retry_policy, deadlines=None, router=None):
+        self._models = models
+        self.limiter = limiter
+        self.retry_policy = retry_policy
+        self.deadlines = dict(DEFAULT_MODEL_DEADLINES if deadlines is None else deadlines)
+        self.router = router
+
+    def __getattr__(self, name):
+        return getattr(self._models, name)
+
+    def _call_with_retries(self, model, deadline, timeout, call):
+        """Run ``call(remaining_seconds)`` until it succeeds, fails permanently or the deadline passes"""
+        attempt = 0
+        while True:
+            attempt += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise GeminiUnavailableError(f"{model} did not respond within {timeout:.0f}s")
+            try:
+                return call(remaining)
+            except Exception as e:
+                if attempt >= self.retry_policy.attempts or not self.retry_policy.is_retryable(e):
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                GEMINI_RETRIES.inc(model=model)
+                logging.warning(f"{model} call failed ({e}); retry {attempt} in {delay:.2f}s")
+                time.sleep(delay)
+
+    def generate_content(self, *, model, contents, config=None, timeout=None, **kwargs):
+        timeout = timeout or self.deadlines.get(model, DEFAULT_DEADLINE)
+        deadline = time.monotonic() + timeout
+
+        def call(remaining):
+            return self._models.generate_content(
+                model=model,
+                contents=contents,
+                config=_with_timeout(config, remaining),
+                **kwargs
+            )
+
+        # Waiting for a local slot is back-pressure, not a model failure: keep it out of the metrics and router
+        with self.limiter.slot(model, deadline - time.monotonic()):
+            with _instrumented(model, contents, self.router):
+                response = self._call_with_retries(model, deadline, timeout, call)
+        GEMINI_BYTES_RECEIVED.inc(_response_bytes(response), model=model)
+        return response
+
+    def generate_content_stream(self, *, model, contents, config=None, timeout=None, **kwargs):
+        """Streaming variant of generate_content.
+
+        Retries only happen before the first chunk arrives; the model's call
+        slot is held until the stream is exhausted or closed.
+        """
+        timeout = timeout or self.deadlines.get(model, DEFAULT_DEADLINE)
+        deadline = time.monotonic() + timeout
+
+        def start_stream(remaining):
+            stream = iter(self._models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=_with_timeout(config, remaining),
+                **kwargs
+            ))
+            return next(stream, None), stream
+
+        with self.limiter.slot(model, deadline - time.monotonic()):
+            with _instrumented(model, contents, self.router):
+                chunk, stream = self._call_with_retries(model, deadline, timeout, start_stream)
+                while chunk is not None:
+                    GEMINI_BYTES_RECEIVED.inc(_response_bytes(chunk), model=model)
+                    yield chunk
+                    chunk = next(stream, None)
+
+
+class AsyncResilientModels:
+    """Async counterpart of ResilientModels for ``client.aio.models``"""
+
+    def __init__(self, models, limiter, retry_policy, deadlines=None, router=None):
+        self._models = models
+        self.limiter = limiter
+        self.retry_policy = retry_policy
+        self.deadlines = dict(DEFAULT_MODEL_DEADLINES if deadlines is None else deadlines)
+        self.router = router
+
+    def __getattr__(self, name):
+        return getattr(self._models, name)
+
+    async def _call_with_retries(self, model, deadline, timeout, call):
+        attempt = 0
+        while True:
+            attempt += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise GeminiUnavailableError(f"{model} did not respond within {timeout:.0f}s")
+            try:
+                return await asyncio.wait_for(call(remaining), remaining)
+            except asyncio.TimeoutError:
+                raise GeminiUnavailableError(f"{model} did not respond within {timeout:.0f}s")
+            except Exception as e:
+                if attempt >= self.retry_policy.attempts or not self.retry_policy.is_retryable(e):
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                GEMINI_RETRIES.inc(model=model)
+                logging.warning(f"{model} call failed ({e}); retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def generate_content(self, *, model, contents, config=None, timeout=None, **kwargs):
+        timeout = timeout or self.deadlines.get(model, DEFAULT_DEADLINE)
+        deadline = time.monotonic() + timeout
+
+        def call(remaining):
+            return self._models.generate_content(
+                model=model,
+                contents=contents,
+                config=_with_timeout(config, remaining),
+                **kwargs
+            )
+
+        async with self.limiter.slot(model, deadline - time.monotonic()):
+            with _instrumented(model, contents, self.router):
+                response = await self._call_with_retries(model, deadline, timeout, call)
+        GEMINI_BYTES_RECEIVED.inc(_response_bytes(response), model=model)
+        return response
+
+
+class ThreadedAsyncModels:
+    """Async facade over a sync ``models`` object, for transports without ``aio``"""
+
+    def __init__(self, models):
+        self._models = models
+
+    async def generate_content(self, **kwargs):
+        return await asyncio.to_thread(self._models.generate_content, **kwargs)
+
+
+class AsyncGeminiClient:
+    """Async view of GeminiClient, available as ``client.aio`` like in ``genai.Client``"""
+
+    def __init__(self, transport, models):
+        self._client = transport
+        self.models = models
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class GeminiClient:
+    """Drop-in replacement for ``genai.Client`` with pooled connections and resilient calls.
+
+    ``transport`` may be any object exposing ``models.generate_content``
+    (for example a fake used in tests); by default a ``genai.Client`` is
+    built with a pooled, keep-alive HTTP client. ``aio`` offers the same
+    calls as coroutines, using the transport's own async client when it has
+    one and worker threads otherwise. Calls are reported to ``router`` (a
+    routing.ModelRouter) if given.
+
+    Nothing is built until ``models`` or ``aio`` is first used. A client
+    that built its own transport drops it in a forked child, so a server
+    that preloads the app before forking never shares connections between
+    workers.
+    """
+
+    def __init__(self, api_key=None, transport=None, retry_policy=None, limiter=None, deadlines=None,
+                 max_connections=None, max_keepalive=None, keepalive_expiry=None, router=None):
+        self._api_key = api_key
+        self._client = transport
+        self._owns_transport = transport is None
+        self._retry_policy = retry_policy
+        self._limiter = limiter
+        self._deadlines = deadlines
+        self._router = router
+        self._pool_options = (max_connections, max_keepalive, keepalive_expiry)
+        self._models = None
+        self._aio = None
+        self._lock = threading.Lock()
+        _clients.add(self)
+
+    def _build_transport(self):
+        import httpx
+        from google import genai
+        from google.genai import types
+
+        max_connections, max_keepalive, keepalive_expiry = self._pool_options
+        limits = httpx.Limits(
+            max_connections=max_connections or int(os.environ.get("GEMINI_MAX_CONNECTIONS", 64)),
+            max_keepalive_connections=max_keepalive or int(os.environ.get("GEMINI_MAX_KEEPALIVE", 16)),
+            keepalive_expiry=keepalive_expiry or float(os.environ.get("GEMINI_KEEPALIVE_EXPIRY", 60)),
+        )
+        async_limits = httpx.Limits(
+            max_connections=int(os.environ.get("GEMINI_ASYNC_MAX_CONNECTIONS", DEFAULT_ASYNC_CONCURRENCY)),
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+        )
+        return genai.Client(
+            api_key=self._api_key,
+            http_options=types.HttpOptions(client_args={"limits": limits},
+                                           async_client_args={"limits": async_limits})
+        )
+
+    def _build(self):
+        with self._lock:
+            if self._models is not None:
+                return
+            started = time.perf_counter()
+            transport = self._client or self._build_transport()
+            retry_policy = self._retry_policy or RetryPolicy(attempts=int(os.environ.get("GEMINI_RETRY_ATTEMPTS", 4)))
+            aio = getattr(transport, "aio", None)
+            self._aio = AsyncGeminiClient(aio, AsyncResilientModels(
+                aio.models if aio is not None else ThreadedAsyncModels(transport.models),
+                AsyncModelLimiter(self._limiter.limits if self._limiter else None),
+                retry_policy,
+                self._deadlines,
+                self._router
+            ))
+            self._client = transport
+            self._models = ResilientModels(transport.models, self._limiter or ModelLimiter(), retry_policy,
+                                           self._deadlines, self._router)
+            if self._owns_transport:
+                logging.info(f"Gemini client ready in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    @property
+    def models(self):
+        if self._models is None:
+            self._build()
+        return self._models
+
+    @property
+    def aio(self):
+        if self._models is None:
+            self._build()
+        return self._aio
+
+    def reset(self):
+        """Forget a self-built transport so the next call builds a fresh one"""
+        self._lock = threading.Lock()
+        if self._owns_transport:
+            self._client = None
+            self._models = None
+            self._aio = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._models is None:
+            self._build()
+        return getattr(self._client, name)
+
+
+# Every GeminiClient, so a forked child can drop connections inherited from its parent
+_clients = weakref.WeakSet()
+
+
+def _reset_clients_after_fork():
+    for gemini_client in list(_clients):
+        gemini_client.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_clients_after_fork)
+
+
+def _with_timeout(config, seconds):
+    """Return a copy of ``config`` whose HTTP timeout ends at the call deadline"""
+    from google.genai import types
+
+    timeout_ms = max(1, int(seconds * 1000))
+    if config is None:
+        return types.GenerateContentConfig(http_options=types.HttpOptions(timeout=timeout_ms))
+    if isinstance(config, dict):
+        config = types.GenerateContentConfig(**config)
+    http_options = config.http_options.model_copy() if config.http_options else types.HttpOptions()
+    http_options.timeout = timeout_ms
+    return config.model_copy(update={"http_options": http_options})
+
+
+def _request_bytes(contents):
+    """Approximate payload size of prompt text and inline images"""
+    total = 0
+    for item in contents if isinstance(contents, list) else [contents]:
+        if isinstance(item, str):
+            total += len(item.encode('utf-8'))
+        elif getattr(item, 'inline_data', None) and item.inline_data.data:
+            total += len(item.inline_data.data)
+        elif getattr(item, 'text', None):
+            total += len(item.text.encode('utf-8'))
+    return total
+
+
+def _response_bytes(response):
+    """Approximate payload size of text and inline data in a response"""
+    total = 0
+    for candidate in getattr(response, 'candidates', None) or []:
+        content = getattr(candidate, 'content', None)
+        for part in getattr(content, 'parts', None) or []:
+            if part.text:
+                total += len(part.text.encode('utf-8'))
+            elif part.inline_data and part.inline_data.data:
+                total += len(part.inline_data.data)
+    if total == 0 and isinstance(getattr(response, 'text', None), str):
+        total = len(response.text.encode('utf-8'))
+    return total
@@ -0,0 +1,40 @@
+"""Gunicorn settings, read automatically when gunicorn starts from the repository root.
+
+Set GUNICORN_PRELOAD=1 to import the app once in the master process and
+fork workers from it: a new worker then starts with every module, the
+product catalog and the Gemini SDK already loaded. Anything holding
+connections or threads is rebuilt per worker after the fork (the Gemini
+client, job queue, image pool and janitors all check for this).
+Workers are threaded (gthread) by default: admission control (ADMISSION_*)
+and event streams need a worker that serves several requests at once.
+GUNICORN_WORKER_CLASS and GUNICORN_THREADS change this; with sync workers
+the number of workers is the only limit on concurrent generations.
+Command line flags still take precedence over these defaults.
+"""
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '').lower() in ('1', 'true', 'yes')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+
+def when_ready(server):
+    if server.cfg.worker_class_str == 'sync':
+        server.log.info("Sync workers serve one request at a time, so admission limits (ADMISSION_*) "
+                        "do not apply; use --worker-class gthread or the ASGI app to enforce them")
+    if preload_app:
+        # Load what the app otherwise imports lazily on first use, once for all workers
+        import gemini
+        gemini.warm()
+        server.log.info("Preloaded app and Gemini SDK in the master process")
+
+
+def post_fork(server, worker):
+    # A sync worker is killed once one request outlasts the timeout, and an event
+    # stream holds it for as long as it is open: offer streams only to threaded
+    # workers unless SSE_ENABLED says otherwise, and end them well before the timeout.
+    from app import app
+    if 'SSE_ENABLED' not in os.environ:
+        app.config['SSE_ENABLED'] = server.cfg.worker_class_str != 'sync'
+    if server.cfg.timeout:
+        app.config['SSE_MAX_STREAM'] = min(app.config['SSE_MAX_STREAM'], max(1, server.cfg.timeout // 2))
@@ -0,0 +1,168 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+
+class ImagePoolBusyError(Exception):
+    """Raised when too many images are already waiting to be processed"""
+
+
+def _warm():
+    """Worker initializer: load the PIL codecs before the first real task"""
+    from PIL import Image
+    Image.init()
+
+
+def _noop():
+    return os.getpid()
+
+
+def _share(data):
+    """Copy bytes into a new shared memory block; the receiver unlinks it"""
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[:len(data)] = data
+    shm.close()
+    return shm.name, len(data)
+
+
+def _unlink(name):
+    shm = shared_memory.SharedMemory(name=name)
+    shm.close()
+    shm.unlink()
+
+
+def _read_shared(name, size, unlink=False):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _run_task(func, name, size, args):
+    """Worker side: read the input from shared memory and share a bytes output back"""
+    result = func(_read_shared(name, size), *args)
+    if isinstance(result, tuple) and result and isinstance(result[0], bytes):
+        return _share(result[0]), result[1:]
+    return None, result
+
+
+def _discard_output(future):
+    """Unlink the output of a task whose caller stopped waiting for it"""
+    if not future.cancelled() and future.exception() is None:
+        shared, _ = future.result()
+        if shared:
+            _read_shared(*shared, unlink=True)
+
+
+class ImagePool:
+    """Runs PIL decode/resize/encode work in warm worker processes.
+
+    Image bytes travel to and from the workers through shared memory
+    instead of the executor's pipe. At most ``max_pending`` tasks may be
+    queued or running; beyond that ``run`` raises ImagePoolBusyError at
+    once so callers can answer 503 rather than queue without bound.
+    With ``processes=0`` work runs inline in the calling thread.
+
+    Tasks are module-level functions taking the image bytes first; when
+    they return a tuple starting with bytes, those bytes come back through
+    shared memory too.
+    """
+
+    def __init__(self, processes=2, max_pending=16, timeout=30):
+        self.processes = processes
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._starting = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Worker processes do not survive a fork, so each server process starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Children start from a clean process rather than a fork of this
+                    # threaded one; like any spawned child they re-import __main__,
+                    # which must therefore be safe to import
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                    if context.get_start_method() == 'forkserver':
+                        context.set_forkserver_preload(['imaging', 'fingerprint'])
+                    self._executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=context,
+                                                         initializer=_warm)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def ensure_started(self, wait=True):
+        """Start all worker processes now instead of on the first uploads.
+
+        With ``wait=False`` they start in a background thread, so a new
+        server process can answer requests that need no images right away.
+        """
+        if self.processes <= 0 or self._pid == os.getpid():
+            return
+        if wait:
+            self._start()
+            return
+        with self._lock:
+            if self._starting == os.getpid():
+                return
+            self._starting = os.getpid()
+        threading.Thread(target=self._start, name='image-pool-start', daemon=True).start()
+
+    def _start(self):
+        started = time.perf_counter()
+        executor = self._get_executor()
+        for future in [executor.submit(_noop) for _ in range(self.processes)]:
+            future.result()
+        logging.info(f"Image pool started with {self.processes} processes in "
+                     f"{(time.perf_counter() - started) * 1000:.0f}ms")
+
+    def depth(self):
+        return self._pending
+
+    def run(self, func, data, *args):
+        """Run ``func(data, *args)`` in a worker process and return its result"""
+        if self.processes <= 0:
+            return func(data, *args)
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ImagePoolBusyError("Image processing is busy right now. Please try again in a moment.")
+            self._pending += 1
+
+        name, size = _share(data)
+        try:
+            executor = self._get_executor()
+            future = executor.submit(_run_task, func, name, size, args)
+            try:
+                shared, result = future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                future.add_done_callback(_discard_output)
+                raise ImagePoolBusyError(f"Image processing took longer than {self.timeout}s. Please try again.")
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory); start a fresh pool for the next task
+                logging.error("Image pool worker died; restarting the pool")
+                with self._lock:
+                    if self._executor is executor:
+                        self._pid = None
+                executor.shutdown(wait=False)
+                raise ValueError("Image could not be processed")
+        finally:
+            _unlink(name)
+            with self._lock:
+                self._pending -= 1
+
+        if shared:
+            return (_read_shared(*shared, unlink=True),) + result
+        return result
@@ -0,0 +1,123 @@
+import io
+import logging
+import os
+import time
+
+JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", 85))
+MAX_SIDE = int(os.environ.get("IMAGE_MAX_SIDE", 1024))
+
+# Input resolution per model. Gemini tiles images internally, so pixels
+# beyond these sizes only add upload time and tokens.
+NORMALIZATION_PROFILES = {
+    "gemini-2.0-flash-preview-image-generation": {"max_side": MAX_SIDE, "quality": JPEG_QUALITY},
+    "gemini-2.5-flash": {"max_side": MAX_SIDE, "quality": JPEG_QUALITY},
+    "gemini-2.5-pro": {"max_side": max(MAX_SIDE, 1536), "quality": JPEG_QUALITY},
+}
+DEFAULT_PROFILE = {"max_side": MAX_SIDE, "quality": JPEG_QUALITY}
+
+
+def normalization_profile(model=None):
+    """Return the normalization settings for a model"""
+    return NORMALIZATION_PROFILES.get(model, DEFAULT_PROFILE)
+
+
+def normalize_image(data: bytes, model=None, use_draft=True):
+    """Validate uploaded image bytes and return them as a model-ready JPEG.
+
+    The image is decoded once, rotated according to its EXIF orientation,
+    scaled so its longest side fits the model's profile, and re-encoded
+    without metadata. JPEGs that already fit the profile and carry no
+    metadata are passed through untouched. For large JPEGs ``draft()`` lets
+    the decoder scale down by a power of two while decoding.
+
+    Returns ``(jpeg_bytes, stats)`` where stats reports sizes and timing.
+    Raises ValueError if the bytes are not a readable image.
+    """
+    from PIL import Image, ImageOps
+
+    profile = normalization_profile(model)
+    max_side = profile["max_side"]
+    started = time.perf_counter()
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            original_size = img.size
+            fits = max(img.size) <= max_side
+            has_metadata = any(key in img.info for key in ("exif", "icc_profile", "xmp", "comment"))
+            if img.format == "JPEG" and img.mode in ("RGB", "L") and fits and not has_metadata:
+                output = data
+            else:
+                if use_draft and img.format == "JPEG" and not fits:
+                    scale = max_side / max(img.size)
+                    img.draft("RGB", (int(img.width * scale), int(img.height * scale)))
+
+                image = ImageOps.exif_transpose(img)
+                if image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                if max(image.size) > max_side:
+                    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+                buffer = io.BytesIO()
+                image.save(buffer, "JPEG", quality=profile["quality"], optimize=True)
+                output = buffer.getvalue()
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Unreadable image: {e}")
+
+    stats = {
+        "original_bytes": len(data),
+        "normalized_bytes": len(output),
+        "bytes_saved": len(data) - len(output),
+        "original_size": original_size,
+        "passthrough": output is data,
+        "elapsed_ms": (time.perf_counter() - started) * 1000,
+    }
+    logging.debug(f"Normalized image {original_size}: {len(data)} -> {len(output)} bytes "
+                  f"in {stats['elapsed_ms']:.1f}ms")
+    return output, stats
+
+
+# Thumbnail formats and the file extension used for each
+THUMBNAIL_FORMATS = {"webp": "webp", "jpeg": "jpg"}
+
+
+def transcode_image(data: bytes, width: int, fmt="webp", quality=80):
+    """Scale an image down to at most ``width`` pixels wide and re-encode it.
+
+    ``fmt`` is "webp" or "jpeg" (progressive, so it renders while loading).
+    Returns ``(bytes, stats)``; raises ValueError if the bytes are not a
+    readable image.
+    """
+    from PIL import Image, ImageOps
+
+    started = time.perf_counter()
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if img.format == "JPEG" and img.width > width:
+                img.draft("RGB", (width, img.height * width // img.width))
+            image = ImageOps.exif_transpose(img)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            if image.width > width:
+                image.thumbnail((width, image.height), Image.LANCZOS)
+
+            buffer = io.BytesIO()
+            if fmt == "webp":
+                image.save(buffer, "WEBP", quality=quality, method=4)
+            else:
+                image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+            output = buffer.getvalue()
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Unreadable image: {e}")
+
+    return output, {"size": image.size, "bytes": len(output),
+                    "elapsed_ms": (time.perf_counter() - started) * 1000}
+
+
+def read_image(image) -> bytes:
+    """Return image bytes from either raw bytes or a file path"""
+    if isinstance(image, bytes):
+        return image
+    if isinstance(image, (bytearray, memoryview)):
+        return bytes(image)
+    with open(image, "rb") as f:
+        return f.read()
@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+import uuid
+
+from results import atomic_write
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+class QueueFullError(Exception):
+    """Raised when the job queue cannot accept another job"""
+
+
+_local = threading.local()
+
+
+def current_job():
+    """Return the Job being run by the calling worker thread, if any"""
+    return getattr(_local, 'job', None)
+
+
+def process_alive(pid):
+    """Whether a process with this pid exists on this host"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Job:
+    """A unit of background work and its outcome"""
+
+    def __init__(self, func, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.events = []
+        self.store = None
+        self._changed = threading.Condition()
+        self._saving = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def emit(self, stage, **data):
+        """Record a progress event and wake up anyone waiting for it"""
+        with self._changed:
+            self.events.append(dict(data, stage=stage))
+            self._changed.notify_all()
+        if self.store:
+            # Events come from several threads; saves in order so an older snapshot never overwrites a newer one
+            with self._saving:
+                self.store.save(self)
+
+    def wait_for_events(self, start, timeout):
+        """Return events after index ``start``, waiting up to ``timeout`` seconds for new ones"""
+        with self._changed:
+            if len(self.events) <= start:
+                self._changed.wait(timeout)
+            return self.events[start:]
+
+    def to_dict(self):
+        """Public view of the job state (without the result payload)"""
+        return {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+    def snapshot(self):
+        """Full JSON-serializable state, including result and events"""
+        with self._changed:
+            return dict(self.to_dict(), result=self.result, events=list(self.events))
+
+
+class JobSnapshot:
+    """Read-only view of a job that is running in another worker process"""
+
+    def __init__(self, store, data):
+        self.store = store
+        self.owner_pid = data.get('owner_pid')
+        self.id = data['id']
+        self.status = data['status']
+        self.result = data['result']
+        self.error = data['error']
+        self.created_at = data['created_at']
+        self.started_at = data['started_at']
+        self.finished_at = data['finished_at']
+        self.events = data['events']
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def abandon(self):
+        """Mark the job failed because the process that owned it is gone"""
+        self.status = 'failed'
+        self.error = 'The server restarted while this try-on was running. Please try again.'
+        self.finished_at = time.time()
+        self.events = self.events + [{'stage': 'failed', 'error': self.error}]
+
+    def wait_for_events(self, start, timeout):
+        """Poll the shared state for events after index ``start``"""
+        deadline = time.time() + timeout
+        while len(self.events) <= start and time.time() < deadline:
+            time.sleep(self.store.poll_interval)
+            latest = self.store.load(self.id)
+            if latest:
+                self.__dict__.update(latest.__dict__)
+        return self.events[start:]
+
+    def to_dict(self):
+        return Job.to_dict(self)
+
+
+class JobStore:
+    """Shares job state between worker processes through JSON files in a directory.
+
+    Each job is owned and run by the process that accepted it; other
+    processes (for example a different gunicorn worker answering a status
+    poll) read its latest snapshot from here. Snapshots record the owner's
+    pid, and an unfinished job whose owner has exited (a worker killed on
+    timeout or restarted) loads as failed.
+    """
+
+    def __init__(self, directory, ttl=3600, poll_interval=0.25):
+        self.directory = directory
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def save(self, job):
+        try:
+            data = dict(job.snapshot(), owner_pid=os.getpid())
+            atomic_write(self._path(job.id), json.dumps(data).encode('utf-8'))
+        except (OSError, TypeError, ValueError) as e:
+            logging.warning(f"Could not save state of job {job.id}: {e}")
+
+    def delete(self, job_id):
+        try:
+            os.remove(self._path(job_id))
+        except OSError:
+            pass
+
+    def load(self, job_id):
+        """Return a JobSnapshot for the job, or None if unknown"""
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                job = JobSnapshot(self, json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+        if not job.finished and job.owner_pid and not process_alive(job.owner_pid):
+            job.abandon()
+        return job
+
+    def prune(self):
+        """Delete state files older than the TTL"""
+        cutoff = time.time() - self.ttl
+        try:
+            with os.scandir(self.directory) as it:
+                for item in it:
+                    if item.name.endswith('.json') and item.stat().st_mtime < cutoff:
+                        os.remove(item.path)
+        except OSError:
+            pass
+
+
+class JobQueue:
+    """Bounded in-process job queue served by a pool of worker threads.
+
+    Workers are started lazily on the first submit so that a gunicorn
+    master process never owns threads that would be lost on fork.
+    """
+
+    def __init__(self, workers=4, max_queue=64, result_ttl=3600, store=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self.store = store
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+
+    def submit(self, func, *args, **kwargs):
+        """Enqueue ``func(*args, **kwargs)`` and return its Job"""
+        return self.enqueue(Job(func, args, kwargs))
+
+    def enqueue(self, job):
+        """Hand a Job to the workers and return it"""
+        self._ensure_workers()
+        self._prune()
+
+        with self._lock:
+            self._jobs[job.id] = job
+        if self.store:
+            job.store = self.store
+            self.store.save(job)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            if self.store:
+                self.store.delete(job.id)
+            raise QueueFullError("The server is busy. Please try again in a moment.")
+
+        logging.info(f"Queued job {job.id} (queue depth {self._queue.qsize()})")
+        return job
+
+    def get(self, job_id):
+        """Return the job with the given id, or None if unknown or expired.
+
+        Jobs accepted by other processes are returned as read-only
+        snapshots when a shared store is configured.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store:
+            job = self.store.load(job_id)
+        return job
+
+    def depth(self):
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize()
+
+    def _ensure_workers(self):
+        # After a fork the parent's threads do not exist in the child
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"tryon-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            job.status = 'running'
+            job.started_at = time.time()
+            job.emit('started')
+            _local.job = job
+            try:
+                job.result = job.func(*job.args, **job.kwargs)
+                job.status = 'done'
+            except Exception as e:
+                logging.error(f"Job {job.id} failed: {e}")
+                logging.error(traceback.format_exc())
+                job.error = str(e)
+                job.status = 'failed'
+            finally:
+                _local.job = None
+                job.finished_at = time.time()
+                self._queue.task_done()
+            if job.status == 'done':
+                job.emit('done', result=job.result)
+            else:
+                job.emit('failed', error=job.error)
+            logging.info(f"Job {job.id} {job.status} in {job.finished_at - job.started_at:.2f}s")
+
+    def _prune(self):
+        """Forget finished jobs older than the result TTL"""
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+        if self.store:
+            self.store.prune()
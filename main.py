@@ -1,9 +1,17 @@
 import os
 import logging
 import uuid
-from flask import render_template, request, flash, redirect, url_for, jsonify
+import json
+import base64
+import functools
+import hashlib
+import re
+import binascii
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import render_template, request, flash, redirect, url_for, jsonify, g, Response, stream_with_context, abort
+from flask import before_render_template, template_rendered
 from werkzeug.utils import secure_filename
-from PIL import Image
 import traceback
 
 # Load environment variables from .env file if it exists (for local development)
@@ -14,8 +22,141 @@ except ImportError:
     # dotenv not installed, that's okay for Replit deployment
     pass
 
+from admission import AdmissionController, AdmissionRejectedError, RouteClass
 from app import app
-from gemini import generate_tryon_image, analyze_fit_recommendation, generate_tryon_from_description, generate_enhanced_tryon
+from archive import GenerationArchive
+from binary_upload import BINARY_MIMETYPES, fits_profile, parse_binary_body, sniff_image_type
+from gemini import IMAGE_MODEL, pregenerate_tryon, tryon_cache_key, generate_tryon_with_fit, generate_tryon_from_description, generate_enhanced_tryon, result_cache, result_storage, generation_flights, model_router
+from catalog import ProductCatalog, UnknownProductError
+from fingerprint import NearDuplicateIndex, fingerprint_image
+from fit import fit_engine
+from imagepool import ImagePool, ImagePoolBusyError
+from imaging import THUMBNAIL_FORMATS, normalization_profile, normalize_image, transcode_image
+from jobs import Job, JobQueue, JobStore, QueueFullError, current_job
+from metrics import REQUEST_SECONDS, REQUESTS_IN_FLIGHT, current_route, observe_stage, registry, stage
+from results import THUMBNAILS_DIR, ResultJanitor
+from speculation import Speculator
+from storage import LocalStorage, check_name
+from werkzeug.datastructures import ContentRange
+
+job_queue = JobQueue(workers=app.config['JOB_WORKERS'],
+                     max_queue=app.config['JOB_QUEUE_SIZE'],
+                     result_ttl=app.config['JOB_RESULT_TTL'],
+                     store=JobStore(app.config['JOB_STATE_DIR'], ttl=app.config['JOB_RESULT_TTL']))
+
+# Bounded pool for fanning out batch try-on items
+batch_executor = ThreadPoolExecutor(max_workers=app.config['BATCH_WORKERS'], thread_name_prefix='batch')
+
+# Upload decoding and re-encoding run in worker processes, off the request threads
+image_pool = ImagePool(processes=app.config['IMAGE_PROCESSES'],
+                       max_pending=app.config['IMAGE_QUEUE_SIZE'],
+                       timeout=app.config['IMAGE_TIMEOUT'])
+
+# Per-route concurrency limits and priority queues for the generation routes
+admission = AdmissionController(app.config['ADMISSION_CAPACITY'],
+                                [RouteClass(name, **settings) for name, settings in app.config['ADMISSION_ROUTES'].items()])
+
+# Every finished generation, for the shopper history API
+generation_archive = GenerationArchive(app.config['ARCHIVE_PATH'],
+                                       batch_size=app.config['ARCHIVE_BATCH_SIZE'],
+                                       flush_interval=app.config['ARCHIVE_FLUSH_INTERVAL'])
+SHOPPER_COOKIE = 'musefit_shopper'
+SHOPPER_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Catalog product images are normalized once at startup and selected by SKU
+product_catalog = ProductCatalog(app.config['PRODUCT_CATALOG'], model=IMAGE_MODEL)
+product_catalog.load()
+
+# Shoppers' normalized uploads indexed by perceptual hash, so a shopper who
+# re-uploads the same photo gets the same bytes (and therefore hits the result cache)
+upload_index = NearDuplicateIndex(app.config['UPLOAD_INDEX_DIR'],
+                                  max_distance=app.config['UPLOAD_DEDUP_DISTANCE'],
+                                  max_log_bytes=app.config['UPLOAD_INDEX_LOG_MAX_BYTES'])
+upload_index_janitor = ResultJanitor(app.config['UPLOAD_INDEX_DIR'],
+                                     max_bytes=app.config['UPLOAD_INDEX_MAX_BYTES'],
+                                     max_age=app.config['RESULTS_MAX_AGE'],
+                                     interval=app.config['RESULTS_JANITOR_INTERVAL'])
+
+# Metrics mirrored from other components at scrape time
+CACHE_LOOKUPS = registry.counter('musefit_result_cache_lookups_total', 'Result cache lookups', ['result', 'tier'])
+CACHE_EVICTIONS = registry.counter('musefit_result_cache_evictions_total', 'Result cache entries evicted')
+JOB_QUEUE_DEPTH = registry.gauge('musefit_job_queue_depth', 'Try-on jobs waiting for a worker')
+IMAGE_POOL_DEPTH = registry.gauge('musefit_image_pool_pending', 'Images queued or being processed by the image pool')
+COALESCED_GENERATIONS = registry.counter('musefit_generations_coalesced_total',
+                                         'Image generations by whether they ran (leader) or joined one in flight (follower)',
+                                         ['role'])
+LOAD_PRESSURE = registry.gauge('musefit_load_pressure', 'Highest load relative to capacity seen by the model router')
+MODEL_ROUTE = registry.gauge('musefit_model_route', 'Model each task is currently routed to (1 = selected)', ['task', 'model'])
+MODEL_HEALTH = registry.gauge('musefit_model_health', 'Rolling model health (0 healthy, 1 slow, 2 unavailable)', ['model'])
+MODEL_P90_SECONDS = registry.gauge('musefit_model_p90_seconds', 'Rolling p90 latency of successful calls', ['model'])
+MODEL_ERROR_RATE = registry.gauge('musefit_model_error_rate', 'Rolling share of failed calls', ['model'])
+SHED_TASKS = registry.counter('musefit_shed_tasks_total', 'Optional tasks skipped under load', ['task'])
+ADMISSION_RUNNING = registry.gauge('musefit_admission_running', 'Admitted requests running per route class', ['route_class'])
+ADMISSION_WAITING = registry.gauge('musefit_admission_waiting', 'Requests queued for admission per route class', ['route_class'])
+ADMISSION_REJECTED = registry.counter('musefit_admission_rejected_total', 'Requests turned away by admission control',
+                                      ['route_class', 'reason'])
+ADMISSION_EXPECTED_SECONDS = registry.gauge('musefit_admission_expected_seconds',
+                                            'Moving average service time used for deadline checks', ['route_class'])
+ARCHIVE_RECORDS = registry.counter('musefit_archive_records_total', 'Generation archive records by outcome', ['result'])
+ARCHIVE_PENDING = registry.gauge('musefit_archive_pending', 'Generation records waiting to be written')
+SPECULATIVE_TASKS = registry.counter('musefit_speculative_tasks_total',
+                                     'Speculative neighbor-size try-ons by outcome', ['result'])
+HEALTH_LEVELS = {'healthy': 0, 'slow': 1, 'unavailable': 2}
+
+def collect_component_metrics():
+    stats = result_cache.stats()
+    CACHE_LOOKUPS.set(stats['memory_hits'], result='hit', tier='memory')
+    CACHE_LOOKUPS.set(stats['disk_hits'], result='hit', tier='disk')
+    CACHE_LOOKUPS.set(stats['misses'], result='miss', tier='')
+    CACHE_EVICTIONS.set(stats['evictions'])
+    JOB_QUEUE_DEPTH.set(job_queue.depth())
+    IMAGE_POOL_DEPTH.set(image_pool.depth())
+    flights = generation_flights.stats()
+    COALESCED_GENERATIONS.set(flights['leaders'], role='leader')
+    COALESCED_GENERATIONS.set(flights['followers'], role='follower')
+    COALESCED_GENERATIONS.set(flights['lock_waits'], role='cross_process_wait')
+    routing = model_router.stats()
+    LOAD_PRESSURE.set(routing['pressure'])
+    for task, models in model_router.routes.items():
+        for model in models:
+            MODEL_ROUTE.set(1 if routing['routes'][task] == model else 0, task=task, model=model)
+    for model, model_stats in routing['models'].items():
+        MODEL_HEALTH.set(HEALTH_LEVELS[model_stats['health']], model=model)
+        MODEL_P90_SECONDS.set(model_stats['p90_seconds'], model=model)
+        MODEL_ERROR_RATE.set(model_stats['error_rate'], model=model)
+    for task, count in routing['shed'].items():
+        SHED_TASKS.set(count, task=task)
+    for result, count in speculator.stats().items():
+        if result not in ('pending', 'budget_left'):
+            SPECULATIVE_TASKS.set(count, result=result)
+    archive_stats = generation_archive.stats()
+    ARCHIVE_RECORDS.set(archive_stats['written'], result='written')
+    ARCHIVE_RECORDS.set(archive_stats['dropped'], result='dropped')
+    ARCHIVE_PENDING.set(archive_stats['pending'])
+    for name, route in admission.stats()['routes'].items():
+        ADMISSION_RUNNING.set(route['running'], route_class=name)
+        ADMISSION_WAITING.set(route['waiting'], route_class=name)
+        ADMISSION_EXPECTED_SECONDS.set(route['expected_seconds'], route_class=name)
+        for reason, count in route['rejected'].items():
+            ADMISSION_REJECTED.set(count, route_class=name, reason=reason)
+
+registry.register_callback(collect_component_metrics)
+
+# A backed-up job queue is load the model router should react to as well
+model_router.add_pressure_source('job_queue', lambda: job_queue.depth() / job_queue.max_queue)
+model_router.add_pressure_source('admission', admission.pressure)
+
+# Background try-ons of neighboring sizes, only while the service is otherwise idle
+speculator = Speculator(app.config['SPECULATIVE_BUDGET'],
+                        max_pressure=app.config['SPECULATIVE_MAX_PRESSURE'],
+                        pressure=model_router.pressure)
+
+# Cache entries are pruned along with the results they point to
+results_janitor = ResultJanitor(app.config['RESULTS_FOLDER'],
+                                max_bytes=app.config['RESULTS_MAX_BYTES'],
+                                max_age=app.config['RESULTS_MAX_AGE'],
+                                interval=app.config['RESULTS_JANITOR_INTERVAL'],
+                                on_sweep=result_cache.prune)
 
 # Configure allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
@@ -25,8 +166,44 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def process_uploaded_image(file, upload_type):
-    """Process and save uploaded image"""
+def normalize_upload(data, model=IMAGE_MODEL, scope=None):
+    """Normalize image bytes, reusing the stored result when ``scope`` uploaded the same photo before.
+
+    ``scope`` is the shopper id for shopper photos; with None (product
+    photos) nothing is looked up or stored. Returns ``(jpeg_bytes, stats)``
+    like normalize_image; ``stats['near_duplicate']`` is True when earlier
+    bytes were reused.
+    """
+    started = time.perf_counter()
+    if scope is None:
+        image_bytes, stats = image_pool.run(normalize_image, data, model)
+        stats['near_duplicate'] = False
+        stats['elapsed_ms'] = (time.perf_counter() - started) * 1000
+        return image_bytes, stats
+
+    with stage('fingerprint_upload'):
+        fingerprint, aspect_ratio, thumbnail = image_pool.run(fingerprint_image, data)
+    image_bytes = upload_index.find(fingerprint, aspect_ratio, model, scope, thumbnail)
+    if image_bytes is not None:
+        return image_bytes, {
+            'original_bytes': len(data),
+            'normalized_bytes': len(image_bytes),
+            'bytes_saved': len(data) - len(image_bytes),
+            'near_duplicate': True,
+            'elapsed_ms': (time.perf_counter() - started) * 1000,
+        }
+
+    image_bytes, stats = image_pool.run(normalize_image, data, model)
+    try:
+        upload_index.add(fingerprint, aspect_ratio, model, scope, thumbnail, image_bytes)
+    except OSError as e:
+        logging.warning(f"Could not index upload: {e}")
+    stats['near_duplicate'] = False
+    stats['elapsed_ms'] = (time.perf_counter() - started) * 1000
+    return image_bytes, stats
+
+def process_uploaded_image(file, upload_type, model=IMAGE_MODEL):
+    """Read an uploaded image into memory and normalize it to JPEG bytes for the given model"""
     if not file or file.filename == '':
         return None
     
@@ -34,58 +211,322 @@ def process_uploaded_image(file, upload_type):
         flash(f'Invalid file type for {upload_type}. Please upload PNG, JPG, JPEG, GIF, or WEBP files.')
         return None
     
-    # Generate unique filename
-    filename = secure_filename(file.filename)
-    unique_filename = f"{upload_type}_{uuid.uuid4().hex}_{filename}"
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-    
     try:
-        # Save and convert to JPEG for consistency
-        file.save(filepath)
-        
-        # Convert to JPEG if needed
-        if not filepath.lower().endswith('.jpg') and not filepath.lower().endswith('.jpeg'):
-            try:
-                with Image.open(filepath) as img:
-                    # Convert to RGB if necessary (for PNG with transparency)
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        img = img.convert('RGB')
-                    
-                    jpeg_filepath = filepath.rsplit('.', 1)[0] + '.jpg'
-                    img.save(jpeg_filepath, 'JPEG', quality=90)
-                    
-                    # Remove original non-JPEG file
-                    os.remove(filepath)
-                    filepath = jpeg_filepath
-            except Exception as e:
-                logging.error(f"Error converting image to JPEG: {e}")
-                flash(f'Error processing image. Please make sure you uploaded a valid image file.')
-                return None
-        
-        return filepath
+        scope = shopper_id() if upload_type == 'user' else None
+        with stage('normalize_upload'):
+            image_bytes, stats = normalize_upload(file.stream.read(), model=model, scope=scope)
+    except ImagePoolBusyError:
+        raise
+    except ValueError as e:
+        logging.error(f"Error converting image to JPEG: {e}")
+        flash(f'Error processing image. Please make sure you uploaded a valid image file.')
+        return None
     except Exception as e:
         logging.error(f"Error processing image {upload_type}: {e}")
         flash(f'Error processing {upload_type} image. Please try again.')
         return None
+    
+    reused = ' (near-duplicate of an earlier upload)' if stats['near_duplicate'] else ''
+    logging.info(f"Normalized {upload_type} image: {stats['original_bytes']} -> "
+                 f"{stats['normalized_bytes']} bytes in {stats['elapsed_ms']:.1f}ms{reused}")
+    g.upload_bytes_saved = g.get('upload_bytes_saved', 0) + stats['bytes_saved']
+    
+    # Optionally keep a copy of the normalized upload
+    if app.config['PERSIST_UPLOADS']:
+        filename = secure_filename(file.filename).rsplit('.', 1)[0]
+        unique_filename = f"{upload_type}_{uuid.uuid4().hex}_{filename}.jpg"
+        try:
+            with open(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename), 'wb') as f:
+                f.write(image_bytes)
+        except OSError as e:
+            logging.warning(f"Could not persist {upload_type} upload: {e}")
+    
+    return image_bytes
+
+def binary_upload_image(data, upload_type, model=IMAGE_MODEL):
+    """Model-ready JPEG bytes for an image sent as raw bytes.
+
+    A JPEG already within the model's profile is checked from its header
+    alone and returned without being decoded or re-encoded; anything else
+    goes through normalize_upload. Raises ValueError for bytes that are
+    not an image.
+    """
+    started = time.perf_counter()
+    if fits_profile(data, normalization_profile(model)):
+        observe_stage('sniff_upload', time.perf_counter() - started)
+        logging.info(f"Passed {upload_type} image through unchanged ({len(data)} bytes)")
+        return data
+    if sniff_image_type(data) is None:
+        raise ValueError(f'{upload_type} photo is not a JPEG, PNG, WEBP or GIF image')
+
+    scope = shopper_id() if upload_type == 'user' else None
+    with stage('normalize_upload'):
+        image_bytes, stats = normalize_upload(data, model=model, scope=scope)
+    logging.info(f"Normalized {upload_type} image: {stats['original_bytes']} -> "
+                 f"{stats['normalized_bytes']} bytes in {stats['elapsed_ms']:.1f}ms")
+    g.upload_bytes_saved = g.get('upload_bytes_saved', 0) + stats['bytes_saved']
+    return image_bytes
+
+def job_accepted(job):
+    """202 response pointing a JSON client at a queued try-on job"""
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('job_status', job_id=job.id),
+        'events_url': url_for('job_events', job_id=job.id),
+        'result_url': url_for('job_result', job_id=job.id)
+    }), 202
+
+def binary_tryon():
+    """Queue a try-on sent with the binary upload protocol (see binary_upload)"""
+    try:
+        with stage('parse_upload'):
+            fields, images = parse_binary_body(request.mimetype, request.get_data(cache=False), request.args)
+        body_measurements = parse_body_measurements(fields)
+        product_size = {
+            'size': str(fields.get('product_size', '')),
+            'chest': str(fields.get('product_chest', '')),
+            'length': str(fields.get('product_length', ''))
+        }
+        if not product_size['size']:
+            raise ValueError('product_size is required')
+        if 'user_photo' not in images:
+            raise ValueError('user_photo is required')
+
+        user_image = binary_upload_image(images['user_photo'], 'user')
+        if fields.get('product_sku'):
+            product = product_catalog.get(str(fields['product_sku']).strip())
+            product_image = product.image
+            product_size = product.product_size(**product_size)
+        elif 'product_photo' in images:
+            product_image = binary_upload_image(images['product_photo'], 'product')
+        else:
+            raise ValueError('product_photo or product_sku is required')
+    except (ValueError, UnknownProductError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    archive_fields = {'session_id': shopper_id(),
+                      'product': product_key(str(fields.get('product_sku') or '').strip(), product_image)}
+    job = Job(run_tryon_job, (user_image, product_image, body_measurements, product_size),
+              {'archive_fields': archive_fields})
+    job.emit('normalized', bytes_saved=g.get('upload_bytes_saved', 0))
+    try:
+        job_queue.enqueue(job)
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503
+    return job_accepted(job)
+
+def wants_json():
+    """Check if the client prefers a JSON response over HTML"""
+    return request.accept_mimetypes.best == 'application/json'
+
+def request_timeout(headers):
+    """The shorter deadline a client asked for with ``X-Request-Timeout`` (seconds), or None"""
+    try:
+        return float(headers['X-Request-Timeout'])
+    except (KeyError, ValueError):
+        return None
+
+def admitted(route_class):
+    """Run POSTs to the decorated view under admission control for ``route_class``.
+
+    Clients can ask for a shorter deadline with ``X-Request-Timeout`` (seconds).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'POST':
+                return view(*args, **kwargs)
+            with admission.admit(route_class, timeout=request_timeout(request.headers)) as waited:
+                observe_stage('admission_wait', waited)
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def shopper_id():
+    """The shopper's archive session id from its cookie, issuing a new one if there is none"""
+    value = request.cookies.get(SHOPPER_COOKIE, '')
+    if SHOPPER_ID_PATTERN.match(value):
+        return value
+    if 'new_shopper_id' not in g:
+        g.new_shopper_id = uuid.uuid4().hex
+    return g.new_shopper_id
+
+def product_key(product_sku=None, product_image=None, description=None):
+    """Archive key of a try-on's product: the catalog SKU, else a hash of the upload or description"""
+    if product_sku:
+        return product_sku
+    if product_image:
+        return 'upload:' + hashlib.sha256(product_image).hexdigest()[:16]
+    return 'text:' + hashlib.sha256(description.encode('utf-8')).hexdigest()[:16]
+
+def run_speculative_tryon(user_image, product_image, body_measurements, product_size, product):
+    """Speculator task: pre-generate one neighboring size, archived without a shopper if it was generated"""
+    with generation_archive.collecting('speculative', product=product) as record:
+        generated = pregenerate_tryon(user_image, product_image, body_measurements, product_size)
+    if generated and not record['cached']:
+        generation_archive.add(record)
+    return generated
+
+def speculate_adjacent_sizes(user_image, product_image, body_measurements, product_size, product=None,
+                             shopper=None):
+    """Queue try-ons of the sizes next to ``product_size`` so a size switch hits the result cache"""
+    for neighbor in fit_engine.adjacent_sizes(product_size, app.config['SPECULATIVE_NEIGHBORS']):
+        key = tryon_cache_key(user_image, product_image, body_measurements, neighbor)
+        if result_cache.get(key):
+            continue
+        if not speculator.submit(key, run_speculative_tryon, user_image, product_image, body_measurements,
+                                 neighbor, product, group=shopper):
+            break
+
+def run_tryon_job(user_image, product_image, body_measurements, product_size, archive_fields=None):
+    """Background job: generate try-on visualization and fit recommendation"""
+    logging.info("Starting try-on generation...")
+    job = current_job()
+    archive_fields = archive_fields or {}
+    if app.config['SPECULATIVE_SIZES']:
+        # The shopper picked something: guesses queued from their last try-on are stale
+        speculator.discard(archive_fields.get('session_id'))
+    # Image generation and fit recommendation run concurrently
+    with generation_archive.recording('tryon', **archive_fields) as record:
+        result_image_path, recommendation, fit_recommendation = generate_tryon_with_fit(
+            user_image, 
+            product_image, 
+            body_measurements, 
+            product_size,
+            on_event=job.emit if job else None
+        )
+        record.update(result_url=result_image_path, recommendation=recommendation,
+                      fit_recommendation=fit_recommendation)
+
+    if app.config['SPECULATIVE_SIZES']:
+        speculate_adjacent_sizes(user_image, product_image, body_measurements, product_size,
+                                 archive_fields.get('product'), archive_fields.get('session_id'))
+
+    return {
+        'result_image': result_image_path,
+        'recommendation': recommendation,
+        'fit_recommendation': fit_recommendation,
+        'body_measurements': body_measurements,
+        'product_size': product_size
+    }
+
+@app.before_request
+def start_background_tasks():
+    """Start per-process background threads on the first request"""
+    if isinstance(result_storage, LocalStorage):
+        results_janitor.ensure_started()
+    upload_index_janitor.ensure_started()
+    image_pool.ensure_started(wait=False)
+
+@app.before_request
+def start_request_timer():
+    """Assign a correlation id and start timing the request"""
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+    g.request_started = time.perf_counter()
+    g.route = g.in_flight_route = current_route()
+    REQUESTS_IN_FLIGHT.inc(route=g.route)
+
+@app.after_request
+def record_request_timing(response):
+    """Record request latency and log per-stage timings with the correlation id"""
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    REQUEST_SECONDS.observe(elapsed, route=g.route, method=request.method, status=response.status_code)
+    timings = g.get('stage_timings', {})
+    response.headers['X-Request-ID'] = g.request_id
+    response.headers['Server-Timing'] = ', '.join(
+        [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items()] +
+        [f'total;dur={elapsed * 1000:.1f}'])
+    if g.route not in ('/metrics', '/static/<path:filename>'):
+        stages = ' '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in timings.items())
+        logging.info(f"[{g.request_id}] {request.method} {request.path} {response.status_code} "
+                     f"{elapsed * 1000:.1f}ms {stages}".rstrip())
+    return response
+
+@app.teardown_request
+def finish_request(error=None):
+    # Streamed responses can tear down more than once; only count the first
+    route = g.pop('in_flight_route', None)
+    if route is not None:
+        REQUESTS_IN_FLIGHT.dec(route=route)
+
+def start_render_timer(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+def stop_render_timer(sender, template, context, **extra):
+    if 'render_started' in g:
+        observe_stage('render_template', time.perf_counter() - g.pop('render_started'))
+
+before_render_template.connect(start_render_timer, app)
+template_rendered.connect(stop_render_timer, app)
+
+@app.after_request
+def add_result_cache_headers(response):
+    """Let browsers and CDNs cache generated results, whose names never change content"""
+    if request.path.startswith(('/static/results/', '/results/')) and response.status_code in (200, 206, 304):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['RESULTS_CACHE_MAX_AGE']
+        response.cache_control.immutable = True
+    return response
+
+@app.after_request
+def set_shopper_cookie(response):
+    """Remember a newly issued shopper id so the history API can find its try-ons"""
+    if 'new_shopper_id' in g:
+        response.set_cookie(SHOPPER_COOKIE, g.new_shopper_id, max_age=app.config['SHOPPER_COOKIE_MAX_AGE'],
+                            httponly=True, samesite='Lax')
+    return response
+
+@app.after_request
+def report_upload_savings(response):
+    """Report how many upload bytes normalization kept out of the API request"""
+    if 'upload_bytes_saved' in g:
+        response.headers['X-Upload-Bytes-Saved'] = str(g.upload_bytes_saved)
+    return response
+
+@app.context_processor
+def inject_catalog():
+    return {'catalog_products': product_catalog.products()}
 
 @app.route('/', methods=['GET', 'POST'])
+@admitted('tryon')
 def index():
-    """Main page with upload form and try-on generation"""
+    """Main page with upload form and try-on generation.
+
+    Besides the multipart form, POST accepts the binary upload protocol
+    (raw image or frames body, see binary_upload) and answers it with JSON.
+    """
+    if request.method == 'POST' and request.mimetype in BINARY_MIMETYPES:
+        return binary_tryon()
     if request.method == 'POST':
         try:
             # Validate form data
-            if 'user_photo' not in request.files or 'product_photo' not in request.files:
+            with stage('parse_upload'):
+                files = request.files
+            product_sku = request.form.get('product_sku', '').strip()
+            if 'user_photo' not in files or ('product_photo' not in files and not product_sku):
                 flash('Please upload both user photo and product photo.')
                 return redirect(request.url)
             
             user_file = request.files['user_photo']
-            product_file = request.files['product_photo']
             
-            # Process uploaded images
-            user_image_path = process_uploaded_image(user_file, 'user')
-            product_image_path = process_uploaded_image(product_file, 'product')
+            # Process uploaded images; catalog products are already normalized
+            user_image = process_uploaded_image(user_file, 'user')
+            product = None
+            if product_sku:
+                try:
+                    product = product_catalog.get(product_sku)
+                except UnknownProductError as e:
+                    flash(str(e))
+                    return redirect(request.url)
+                product_image = product.image
+            else:
+                product_image = process_uploaded_image(request.files['product_photo'], 'product')
             
-            if not user_image_path or not product_image_path:
+            if not user_image or not product_image:
                 return redirect(request.url)
             
             # Extract body measurements
@@ -105,6 +546,8 @@ def index():
                 'chest': request.form.get('product_chest', ''),
                 'length': request.form.get('product_length', '')
             }
+            if product:
+                product_size = product.product_size(**product_size)
             
             # Validate required fields
             if not all([body_measurements['chest'], body_measurements['waist'], body_measurements['height']]):
@@ -115,40 +558,25 @@ def index():
                 flash('Please enter the product size.')
                 return redirect(request.url)
             
-            # Generate try-on visualization
-            logging.info("Starting try-on generation...")
+            # Queue try-on generation so the request returns immediately
+            archive_fields = {'session_id': shopper_id(), 'product': product_key(product_sku, product_image)}
+            job = Job(run_tryon_job, (user_image, product_image, body_measurements, product_size),
+                      {'archive_fields': archive_fields})
+            job.emit('normalized', bytes_saved=g.get('upload_bytes_saved', 0))
             try:
-                result_image_path, recommendation = generate_tryon_image(
-                    user_image_path, 
-                    product_image_path, 
-                    body_measurements, 
-                    product_size
-                )
-                
-                # Generate fit recommendation
-                fit_recommendation = analyze_fit_recommendation(body_measurements, product_size)
-                
-                # Clean up uploaded files
-                try:
-                    os.remove(user_image_path)
-                    os.remove(product_image_path)
-                except OSError:
-                    pass  # Files might already be deleted
-                
-                return render_template('index.html', 
-                                     success=True,
-                                     result_image=result_image_path,
-                                     recommendation=recommendation,
-                                     fit_recommendation=fit_recommendation,
-                                     body_measurements=body_measurements,
-                                     product_size=product_size)
-                
-            except Exception as e:
-                logging.error(f"Try-on generation failed: {e}")
-                logging.error(traceback.format_exc())
-                flash(f'Failed to generate try-on visualization: {str(e)}')
+                job_queue.enqueue(job)
+            except QueueFullError as e:
+                if wants_json():
+                    return jsonify({'error': str(e)}), 503
+                flash(str(e))
                 return redirect(request.url)
+
+            if wants_json():
+                return job_accepted(job)
+            return redirect(url_for('job_result', job_id=job.id))
                 
+        except ImagePoolBusyError:
+            raise
         except Exception as e:
             logging.error(f"Form processing error: {e}")
             logging.error(traceback.format_exc())
@@ -158,6 +586,7 @@ def index():
     return render_template('index.html')
 
 @app.route('/generate-prompt', methods=['POST'])
+@admitted('prompt')
 def generate_prompt():
     """Generate try-on from text descriptions"""
     try:
@@ -172,13 +601,17 @@ def generate_prompt():
         # Generate try-on from descriptions
         logging.info("Starting prompt-based try-on generation...")
         try:
-            result_image_path, recommendation = generate_tryon_from_description(
-                user_description, 
-                product_description
-            )
-            
-            # Create a simple fit analysis from the descriptions
-            fit_recommendation = f"Based on your description, this should look great! The AI has created a visualization showing how the {product_description.lower()} would look on {user_description.lower()}."
+            with generation_archive.recording('prompt', session_id=shopper_id(),
+                                              product=product_key(description=product_description)) as record:
+                result_image_path, recommendation = generate_tryon_from_description(
+                    user_description, 
+                    product_description
+                )
+                
+                # Create a simple fit analysis from the descriptions
+                fit_recommendation = f"Based on your description, this should look great! The AI has created a visualization showing how the {product_description.lower()} would look on {user_description.lower()}."
+                record.update(result_url=result_image_path, recommendation=recommendation,
+                              fit_recommendation=fit_recommendation)
             
             return render_template('index.html', 
                                  success=True,
@@ -202,22 +635,32 @@ def generate_prompt():
         return redirect(url_for('index'))
 
 @app.route('/generate-enhanced', methods=['POST'])
+@admitted('enhanced')
 def generate_enhanced():
     """Generate enhanced try-on with uploaded images and detailed prompts"""
     try:
         # Get uploaded files first
-        if 'user_photo' not in request.files or 'product_photo' not in request.files:
+        with stage('parse_upload'):
+            files = request.files
+        product_sku = request.form.get('product_sku', '').strip()
+        if 'user_photo' not in files or ('product_photo' not in files and not product_sku):
             flash('Please upload both user photo and product photo first.')
             return redirect(url_for('index'))
         
         user_file = request.files['user_photo']
-        product_file = request.files['product_photo']
         
-        # Process uploaded images
-        user_image_path = process_uploaded_image(user_file, 'user')
-        product_image_path = process_uploaded_image(product_file, 'product')
+        # Process uploaded images; catalog products are already normalized
+        user_image = process_uploaded_image(user_file, 'user')
+        if product_sku:
+            try:
+                product_image = product_catalog.get(product_sku).image
+            except UnknownProductError as e:
+                flash(str(e))
+                return redirect(url_for('index'))
+        else:
+            product_image = process_uploaded_image(request.files['product_photo'], 'product')
         
-        if not user_image_path or not product_image_path:
+        if not user_image or not product_image:
             return redirect(url_for('index'))
         
         # Get prompt descriptions
@@ -231,22 +674,19 @@ def generate_enhanced():
         # Generate enhanced try-on
         logging.info("Starting enhanced try-on generation...")
         try:
-            result_image_path, recommendation = generate_enhanced_tryon(
-                user_image_path, 
-                product_image_path,
-                person_measurements,
-                product_details
-            )
-            
-            # Create fit recommendation from the provided measurements
-            fit_recommendation = f"Based on your measurements and the product details provided, the AI has created a personalized try-on showing how this item would fit you."
-            
-            # Clean up uploaded files
-            try:
-                os.remove(user_image_path)
-                os.remove(product_image_path)
-            except OSError:
-                pass  # Files might already be deleted
+            with generation_archive.recording('enhanced', session_id=shopper_id(),
+                                              product=product_key(product_sku, product_image)) as record:
+                result_image_path, recommendation = generate_enhanced_tryon(
+                    user_image, 
+                    product_image,
+                    person_measurements,
+                    product_details
+                )
+                
+                # Create fit recommendation from the provided measurements
+                fit_recommendation = f"Based on your measurements and the product details provided, the AI has created a personalized try-on showing how this item would fit you."
+                record.update(result_url=result_image_path, recommendation=recommendation,
+                              fit_recommendation=fit_recommendation)
             
             return render_template('index.html', 
                                  success=True,
@@ -263,12 +703,322 @@ def generate_enhanced():
             flash(f'Failed to generate enhanced try-on: {str(e)}')
             return redirect(url_for('index'))
             
+    except ImagePoolBusyError:
+        raise
     except Exception as e:
         logging.error(f"Enhanced form processing error: {e}")
         logging.error(traceback.format_exc())
         flash('An error occurred while processing your request. Please try again.')
         return redirect(url_for('index'))
 
+def decode_image_field(value, model=IMAGE_MODEL, scope=None):
+    """Decode a base64 image from a JSON payload and normalize it to JPEG bytes (see normalize_upload)"""
+    if not isinstance(value, str) or not value:
+        raise ValueError('missing image')
+    if value.startswith('data:'):
+        value = value.split(',', 1)[-1]
+    try:
+        data = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError('image is not valid base64')
+    image_bytes, _ = normalize_upload(data, model=model, scope=scope)
+    return image_bytes
+
+def catalog_product(sku):
+    """Look up a catalog product by a SKU from a JSON payload; raises UnknownProductError"""
+    if not isinstance(sku, str):
+        raise ValueError('product_sku must be a string')
+    return product_catalog.get(sku.strip())
+
+def parse_body_measurements(values):
+    """Validate body measurements from a JSON payload"""
+    try:
+        body_measurements = {key: float(values.get(key, 0)) for key in ('chest', 'waist', 'height')}
+    except (AttributeError, ValueError, TypeError):
+        raise ValueError('body measurements must be numeric')
+    if not all(body_measurements.values()):
+        raise ValueError('chest, waist and height are required')
+    return body_measurements
+
+@app.route('/api/batch-tryon', methods=['POST'])
+def batch_tryon():
+    """Try one user photo against many products or sizes.
+
+    Expects JSON with a base64 ``user_image``, ``body_measurements`` and a
+    list of ``items``, each with a ``product_size`` and an optional base64
+    ``product_image`` or catalog ``product_sku`` (defaulting to a top-level
+    ``product_image`` or ``product_sku``).
+    Results are streamed as newline-delimited JSON, one line per item in
+    completion order; a failed item reports its own error. Each item is a
+    try-on generation and is admitted as one (see admitted); an item that
+    is turned away reports a ``retry_after`` too.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    
+    items = payload.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items must be a non-empty list'}), 400
+    if len(items) > app.config['BATCH_MAX_ITEMS']:
+        return jsonify({'error': f"At most {app.config['BATCH_MAX_ITEMS']} items per batch"}), 400
+    
+    # The user image and shared product image are normalized once for all items
+    try:
+        user_image = decode_image_field(payload.get('user_image'), scope=shopper_id())
+        body_measurements = parse_body_measurements(payload.get('body_measurements') or {})
+        shared_product_image = None
+        shared_product = None
+        if payload.get('product_sku'):
+            shared_product = catalog_product(payload['product_sku'])
+        elif payload.get('product_image'):
+            shared_product_image = decode_image_field(payload['product_image'])
+    except (ValueError, UnknownProductError) as e:
+        return jsonify({'error': str(e)}), 400
+    session_id = shopper_id()
+    timeout = request_timeout(request.headers)
+    
+    def run_item(item):
+        if not isinstance(item, dict):
+            raise ValueError('item must be an object')
+        product_size = item.get('product_size') or {}
+        if not isinstance(product_size, dict) or not product_size.get('size'):
+            raise ValueError('product_size.size is required')
+        product_size = {key: str(product_size.get(key, '')) for key in ('size', 'chest', 'length')}
+        product_image = shared_product_image
+        product = shared_product
+        if item.get('product_sku'):
+            product = catalog_product(item['product_sku'])
+        elif item.get('product_image'):
+            product_image = decode_image_field(item['product_image'])
+            product = None
+        if product:
+            product_image = product.image
+        if not product_image:
+            raise ValueError('product_image or product_sku is required')
+        
+        with admission.admit('tryon', timeout=timeout):
+            with generation_archive.recording('batch', session_id=session_id,
+                                              product=product_key(product.sku if product else None, product_image)) as record:
+                result_image_path, recommendation, fit_recommendation = generate_tryon_with_fit(
+                    user_image, product_image, body_measurements,
+                    product.product_size(**product_size) if product else product_size
+                )
+                record.update(result_url=result_image_path, recommendation=recommendation,
+                              fit_recommendation=fit_recommendation)
+        return {
+            'result_image': result_image_path,
+            'recommendation': recommendation,
+            'fit_recommendation': fit_recommendation,
+            'product_size': product_size
+        }
+    
+    futures = {batch_executor.submit(run_item, item): index for index, item in enumerate(items)}
+    
+    def stream():
+        for future in as_completed(futures):
+            index = futures[future]
+            item = items[index]
+            line = {'index': index, 'id': item.get('id') if isinstance(item, dict) else None}
+            try:
+                line.update(future.result(), status='done')
+            except AdmissionRejectedError as e:
+                line.update(status='failed', error='The service is busy right now. Please try again shortly.',
+                            retry_after=e.retry_after)
+            except Exception as e:
+                logging.error(f"Batch item {index} failed: {e}")
+                line.update(status='failed', error=str(e))
+            yield json.dumps(line) + '\n'
+    
+    logging.info(f"Starting batch try-on with {len(items)} items...")
+    return Response(stream(), mimetype='application/x-ndjson')
+
+def result_thumbnail(name, width, fmt):
+    """Return the storage name of a result's thumbnail, transcoding it on first use.
+
+    A result that cannot be decoded as an image is served as it is.
+    """
+    thumb_name = f"{THUMBNAILS_DIR}/{name.rsplit('.', 1)[0]}_w{width}.{THUMBNAIL_FORMATS[fmt]}"
+    if result_storage.stat(thumb_name):
+        return thumb_name
+    data = result_storage.read(name)
+    if data is None:
+        return None
+    try:
+        with stage('transcode_result'):
+            thumbnail, _ = image_pool.run(transcode_image, data, width, fmt)
+    except ValueError as e:
+        logging.warning(f"Could not make a thumbnail of {name}, serving the original: {e}")
+        return name
+    result_storage.put(thumb_name, thumbnail)
+    return thumb_name
+
+@app.route('/results/<path:name>')
+def serve_result(name):
+    """Serve a generated result from the result storage.
+
+    Supports ETag / If-None-Match and single byte ranges. ``?w=<width>``
+    returns a thumbnail, WebP by default or progressive JPEG with
+    ``format=jpeg``, transcoded once and kept in the storage.
+    """
+    try:
+        check_name(name)
+    except ValueError:
+        abort(404)
+
+    width = request.args.get('w', type=int)
+    if width:
+        fmt = request.args.get('format', 'webp')
+        if width not in app.config['THUMBNAIL_WIDTHS'] or fmt not in THUMBNAIL_FORMATS:
+            return jsonify({'error': f"w must be one of {app.config['THUMBNAIL_WIDTHS']} and format one of "
+                                     f"{sorted(THUMBNAIL_FORMATS)}"}), 400
+        if name.startswith(THUMBNAILS_DIR + '/'):
+            abort(404)
+        name = result_thumbnail(name, width, fmt)
+        if name is None:
+            abort(404)
+
+    info = result_storage.stat(name)
+    if info is None:
+        abort(404)
+
+    response = Response(mimetype=info.content_type)
+    response.set_etag(info.etag)
+    response.last_modified = info.modified
+    response.accept_ranges = 'bytes'
+    if request.if_none_match.contains(info.etag):
+        response.status_code = 304
+        return response
+
+    # A range only applies if the client's copy (If-Range) is still current
+    byte_range = request.range
+    if byte_range and request.if_range.etag not in (None, info.etag):
+        byte_range = None
+    if byte_range and len(byte_range.ranges) == 1:
+        span = byte_range.range_for_length(info.size)
+        if span is None:
+            response.status_code = 416
+            response.content_range = ContentRange('bytes', None, None, info.size)
+            return response
+        start, stop = span
+        data = result_storage.read(name, start, stop)
+        response.status_code = 206
+        response.content_range = ContentRange('bytes', start, stop, info.size)
+    else:
+        data = result_storage.read(name)
+    if data is None:
+        abort(404)
+    response.set_data(data)
+    return response
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the progress of a background try-on job"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    status = job.to_dict()
+    status['queue_depth'] = job_queue.depth()
+    if job.status == 'done':
+        status['result'] = job.result
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream the progress of a background try-on job as Server-Sent Events.
+
+    Each stream ends after SSE_MAX_STREAM seconds so it never outlives a
+    sync worker's timeout; EventSource then reconnects with the
+    ``Last-Event-ID`` of the last event it saw and the stream resumes after it.
+    """
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    try:
+        start = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        start = 0
+    if start and job.status in ('done', 'failed') and len(job.events) <= start:
+        return '', 204  # tells EventSource to stop reconnecting
+    
+    def stream():
+        sent = start
+        closes_at = time.monotonic() + app.config['SSE_MAX_STREAM']
+        yield 'retry: 1000\n\n'
+        while True:
+            remaining = closes_at - time.monotonic()
+            if remaining <= 0:
+                return
+            events = job.wait_for_events(sent, timeout=min(app.config['SSE_KEEPALIVE'], remaining))
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for offset, event in enumerate(events):
+                yield f"id: {sent + offset}\nevent: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+                if event['stage'] in ('done', 'failed'):
+                    return
+            sent += len(events)
+    
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Render the result of a background try-on job"""
+    job = job_queue.get(job_id)
+    if not job:
+        flash('This try-on request has expired. Please try again.')
+        return redirect(url_for('index'))
+    
+    if job.status == 'failed':
+        flash(f'Failed to generate try-on visualization: {job.error}')
+        return redirect(url_for('index'))
+    
+    if job.status != 'done':
+        return render_template('index.html', 
+                             pending=True,
+                             job_id=job.id,
+                             job_status=job.status)
+    
+    return render_template('index.html', success=True, **job.result)
+
+@app.route('/api/history')
+def history():
+    """The shopper's past try-ons from the archive, newest first, without regenerating anything.
+
+    Query parameters: ``limit`` (page size), ``before`` (the ``next_before``
+    of the previous page) and ``product`` (a catalog SKU, to filter).
+    """
+    try:
+        limit = int(request.args.get('limit', 20))
+        before = int(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({'error': 'limit and before must be integers'}), 400
+    if not 1 <= limit <= app.config['HISTORY_MAX_PAGE']:
+        return jsonify({'error': f"limit must be between 1 and {app.config['HISTORY_MAX_PAGE']}"}), 400
+
+    rows = generation_archive.history(shopper_id(), limit=limit + 1, before=before,
+                                      product=request.args.get('product'))
+    items = [{
+        'id': row['id'],
+        'created_at': row['created_at'],
+        'kind': row['kind'],
+        'product': row['product'],
+        'result_image': row['result_url'],
+        'thumbnail': f"{row['result_url']}?w=320" if row['result_url'] else None,
+        'recommendation': row['recommendation'],
+        'fit_recommendation': row['fit_recommendation'],
+    } for row in rows[:limit]]
+    return jsonify({'items': items, 'next_before': items[-1]['id'] if len(rows) > limit else None})
+
+@app.route('/metrics')
+def metrics():
+    """Expose metrics for this worker process in the Prometheus text format"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/test-images')
 def test_images():
     """Provide test images for users who don't have their own"""
@@ -280,6 +1030,28 @@ def too_large(e):
     flash('File is too large. Please upload files smaller than 16MB.')
     return redirect(url_for('index'))
 
+def overloaded(message, retry_after):
+    """503 with a Retry-After hint, as JSON for API clients and the form page otherwise"""
+    if wants_json() or request.path.startswith('/api/') or request.mimetype in BINARY_MIMETYPES:
+        response = jsonify({'error': message, 'retry_after': retry_after})
+    else:
+        flash(message)
+        response = app.make_response(render_template('index.html'))
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.errorhandler(ImagePoolBusyError)
+def image_pool_busy(e):
+    """Shed load quickly when image processing is saturated"""
+    logging.warning(f"Rejecting request: {e}")
+    return overloaded(str(e), 1)
+
+@app.errorhandler(AdmissionRejectedError)
+def admission_rejected(e):
+    """Turn away requests that would queue too long or miss their deadline"""
+    return overloaded('The service is busy right now. Please try again shortly.', e.retry_after)
+
 @app.errorhandler(500)
 def internal_error(error):
     """Handle internal server errors"""
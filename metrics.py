@@ -0,0 +1,194 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+# Latency buckets in seconds, from template rendering up to image generation
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        """Set the total directly, for counts maintained by another component"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {total!r}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format.
+
+    Callbacks registered with ``register_callback`` are run at scrape time
+    to refresh gauges derived from other components (cache, queues).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._callbacks = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def register_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def render(self):
+        for callback in self._callbacks:
+            callback()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    'musefit_request_seconds', 'HTTP request latency', ['route', 'method', 'status'])
+REQUESTS_IN_FLIGHT = registry.gauge(
+    'musefit_requests_in_flight', 'HTTP requests currently being handled', ['route'])
+STAGE_SECONDS = registry.histogram(
+    'musefit_stage_seconds', 'Time spent in each hot-path stage', ['stage', 'route'])
+GEMINI_CALL_SECONDS = registry.histogram(
+    'musefit_gemini_call_seconds', 'Gemini API call latency including retries', ['model', 'outcome'])
+GEMINI_RETRIES = registry.counter(
+    'musefit_gemini_retries_total', 'Gemini API calls retried', ['model'])
+GEMINI_ERRORS = registry.counter(
+    'musefit_gemini_errors_total', 'Gemini API calls that failed', ['model', 'code'])
+GEMINI_IN_FLIGHT = registry.gauge(
+    'musefit_gemini_calls_in_flight', 'Gemini API calls in progress', ['model'])
+GEMINI_BYTES_SENT = registry.counter(
+    'musefit_gemini_sent_bytes_total', 'Approximate request payload bytes sent to Gemini', ['model'])
+GEMINI_BYTES_RECEIVED = registry.counter(
+    'musefit_gemini_received_bytes_total', 'Approximate response payload bytes received from Gemini', ['model'])
+
+
+def current_route():
+    """Route label for the current request, or 'background' outside one"""
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+    return 'background'
+
+
+def observe_stage(name, seconds):
+    """Record a stage duration, also keeping it on the request for Server-Timing"""
+    STAGE_SECONDS.observe(seconds, stage=name, route=current_route())
+    if has_request_context():
+        timings = g.setdefault('stage_timings', {})
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    """Time a block of code as a hot-path stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import re
+import textwrap
+from string import Formatter
+
+
+def normalize_whitespace(text):
+    """Dedent, strip trailing spaces and collapse runs of blank lines"""
+    lines = [line.rstrip() for line in textwrap.dedent(text).strip().splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
+
+
+class PromptTemplate:
+    """A named, versioned prompt, whitespace-normalized once when it is defined.
+
+    ``hash`` identifies the exact template text and version; ``key`` adds
+    the values it is rendered with, giving a stable cache key that does
+    not depend on re-hashing the rendered prompt. Bump ``version`` when the
+    wording changes on purpose.
+    """
+
+    def __init__(self, name, version, text):
+        self.name = name
+        self.version = version
+        self.source = text
+        self.text = normalize_whitespace(text)
+        self.fields = sorted({field for _, field, _, _ in Formatter().parse(self.text) if field})
+        self.hash = hashlib.sha256(f"{name}\0{version}\0{self.text}".encode('utf-8')).hexdigest()[:16]
+
+    def render(self, **values):
+        """Fill in the template; raises KeyError for a missing field"""
+        return self.text.format(**values)
+
+    def key(self, **values):
+        """Stable hash of this template version and the values it is rendered with"""
+        canonical = json.dumps({field: values.get(field) for field in self.fields}, sort_keys=True, default=str)
+        return f"{self.name}:{self.version}:{self.hash}:" + hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:24]
+
+    def __repr__(self):
+        return f"<PromptTemplate {self.name} v{self.version} {self.hash}>"
+
+
+class PromptRegistry:
+    """All prompt templates by name; the highest registered version is current"""
+
+    def __init__(self):
+        self._templates = {}
+
+    def register(self, name, version, text):
+        template = PromptTemplate(name, version, text)
+        self._templates.setdefault(name, {})[version] = template
+        return template
+
+    def get(self, name, version=None):
+        versions = self._templates[name]
+        return versions[max(versions) if version is None else version]
+
+    def current(self):
+        return [self.get(name) for name in sorted(self._templates)]
+
+    def count_tokens(self, models, model, samples):
+        """Input tokens per current template rendered with ``samples[name]``.
+
+        ``models`` is anything with ``count_tokens(model=, contents=)``, e.g.
+        ``gemini.client.models`` or the benchmark fake. Returns
+        ``{name: (tokens of the raw source text, tokens of the normalized prompt)}``.
+        """
+        counts = {}
+        for template in self.current():
+            values = samples.get(template.name, {})
+            raw = template.source.format(**values)
+            normalized = template.render(**values)
+            counts[template.name] = (models.count_tokens(model=model, contents=raw).total_tokens,
+                                     models.count_tokens(model=model, contents=normalized).total_tokens)
+        return counts
+
+
+prompts = PromptRegistry()
+
+TRYON = prompts.register('tryon', 1, """
+    Create a realistic try-on visualization showing the person wearing the clothing item.
+
+    User measurements:
+    - Chest: {chest} inches
+    - Waist: {waist} inches
+    - Height: {height} inches
+
+    Product size information:
+    - Size: {size}
+    - Chest: {product_chest} inches
+    - Length: {product_length} inches
+
+    Generate a photorealistic image showing the person from the first image wearing the clothing item from the second image.
+    Ensure proper fit and proportions based on the measurements provided. The result should look natural and realistic.
+    """)
+
+FIT_POLISH = prompts.register('fit_polish', 1, """
+    Analyze the fit between user body measurements and product size information.
+
+    User measurements:
+    - Chest: {chest} inches
+    - Waist: {waist} inches
+    - Height: {height} inches
+
+    Product size:
+    - Size: {size}
+    - Chest: {product_chest} inches
+    - Length: {product_length} inches
+
+    Our size calculator says: {recommendation}
+
+    Rewrite this as a brief, helpful recommendation about the fit without changing its conclusion.
+    Keep the response under 50 words and friendly in tone.
+    """)
+
+DESCRIPTION_TRYON = prompts.register('description_tryon', 1, """
+    Create a realistic try-on visualization based on these descriptions:
+
+    Person: {user_description}
+
+    Clothing Item: {product_description}
+
+    Generate a photorealistic image showing the described person wearing the described clothing item.
+    The image should be high quality, well-lit, and show how the clothing fits on the person.
+    Make it look natural and realistic as if it's an actual photo of someone wearing the item.
+    """)
+
+ENHANCED_TRYON = prompts.register('enhanced_tryon', 1, """
+    Create a realistic try-on visualization using the uploaded images and these details:
+
+    Person measurements and details: {person_measurements}
+
+    Product size and details: {product_details}
+
+    Using the person's photo and the product photo provided, generate a photorealistic image showing
+    this person wearing the clothing item. Pay careful attention to the measurements provided to ensure
+    proper fit and proportions. The result should look natural and realistic, taking into account both
+    the visual information from the photos and the specific measurements and details provided.
+    """)
+
+ANALYZE_IMAGE = prompts.register('analyze_image', 1, """
+    Analyze this image in detail and describe its key elements, context, and any notable aspects.
+    """)
+
+
+def measurement_values(body_measurements, product_size):
+    """Template values for the measurement fields shared by the try-on and fit prompts"""
+    return {
+        'chest': body_measurements.get('chest', 'N/A'),
+        'waist': body_measurements.get('waist', 'N/A'),
+        'height': body_measurements.get('height', 'N/A'),
+        'size': product_size.get('size', 'N/A'),
+        'product_chest': product_size.get('chest', 'N/A'),
+        'product_length': product_size.get('length', 'N/A'),
+    }
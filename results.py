@@ -0,0 +1,114 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from metrics import stage
+
+# Files written by save_result: <prefix>_<content hash>.jpg, plus their
+# thumbnails: thumbs/<prefix>_<content hash>_w<width>.<ext>
+RESULT_NAME_PATTERN = re.compile(r'^[a-z_]+_[0-9a-f]{20}(_w[0-9]+)?\.(jpg|webp)$')
+THUMBNAILS_DIR = 'thumbs'
+
+
+def atomic_write(path, data):
+    """Write bytes to a temporary file and rename it into place"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_result(image_bytes, prefix, storage):
+    """Store a generated image under a unique content-hashed name and return the name"""
+    digest = hashlib.sha256(image_bytes).hexdigest()[:20]
+    name = f"{prefix}_{digest}.jpg"
+    with stage('write_result'):
+        storage.put(name, image_bytes)
+    return name
+
+
+class ResultJanitor:
+    """Background thread that keeps the results folder within an age limit and disk quota.
+
+    Only files written by save_result are considered, oldest first.
+    ``on_sweep`` is called after every sweep, e.g. to drop cache entries
+    that pointed at removed results.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, max_age=7 * 86400, interval=300, on_sweep=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.on_sweep = on_sweep
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the janitor thread in the current process if not already running"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(target=self._run, name='results-janitor', daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def sweep(self):
+        """Remove expired results, then the oldest ones until under the quota"""
+        now = time.time()
+        entries = []
+        total = 0
+        for directory in (self.directory, os.path.join(self.directory, THUMBNAILS_DIR)):
+            try:
+                with os.scandir(directory) as it:
+                    for item in it:
+                        if not item.is_file() or not RESULT_NAME_PATTERN.match(item.name):
+                            continue
+                        stat = item.stat()
+                        entries.append((stat.st_mtime, stat.st_size, item.path))
+                        total += stat.st_size
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logging.warning(f"Results janitor could not scan {directory}: {e}")
+                return 0
+
+        removed = 0
+        entries.sort()
+        for mtime, size, path in entries:
+            if now - mtime < self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+
+        if removed:
+            logging.info(f"Results janitor removed {removed} files from {self.directory}")
+        return removed
+
+    def _run(self):
+        while True:
+            self.sweep()
+            if self.on_sweep:
+                try:
+                    self.on_sweep()
+                except Exception as e:
+                    logging.warning(f"Results janitor follow-up failed: {e}")
+            time.sleep(self.interval)
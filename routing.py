@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from collections import deque
+
+HEALTHY = 'healthy'
+SLOW = 'slow'
+UNAVAILABLE = 'unavailable'
+
+# Upstream error codes that say nothing about the model's health (bad input, auth)
+CLIENT_ERROR_CODES = range(400, 429)
+
+
+class LoadShedError(Exception):
+    """Raised when optional work is skipped because the service is under pressure"""
+
+
+class _ModelWindow:
+    def __init__(self, size):
+        self.calls = deque(maxlen=size)  # (finished_at, seconds, failed)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+
+
+class ModelRouter:
+    """Picks a model per task from rolling latency and error rates, and sheds optional work.
+
+    ``routes`` maps a task name to its models, preferred first. A model is
+    ``unavailable`` while it is rate limited (for ``cooldown`` seconds after
+    a 429) or when more than ``max_error_rate`` of its recent calls failed,
+    and ``slow`` when its p90 latency over the last ``window`` seconds
+    exceeds its ``slow_after`` budget. ``choose`` returns the first healthy
+    model of a task, else the first slow one, else the preferred one.
+
+    Pressure is the highest value reported by the registered pressure
+    sources (1.0 = at capacity). Tasks listed in ``optional`` are shed at
+    ``shed_pressure`` or when none of their models is usable; at
+    ``reduce_pressure`` callers should ask for reduced output.
+    """
+
+    def __init__(self, routes, optional=(), slow_after=None, window=60, max_samples=200, min_samples=5,
+                 max_error_rate=0.5, cooldown=30, reduce_pressure=0.6, shed_pressure=0.85):
+        self.routes = {task: list(models) for task, models in routes.items()}
+        self.optional = set(optional)
+        self.slow_after = dict(slow_after or {})
+        self.window = window
+        self.max_samples = max_samples
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.reduce_pressure = reduce_pressure
+        self.shed_pressure = shed_pressure
+        self.shed_counts = {task: 0 for task in self.routes}
+        self._models = {}
+        self._decisions = {}
+        self._pressure_sources = {}
+        self._lock = threading.Lock()
+
+    def _window(self, model):
+        window = self._models.get(model)
+        if window is None:
+            window = self._models[model] = _ModelWindow(self.max_samples)
+        return window
+
+    def begin(self, model):
+        with self._lock:
+            self._window(model).in_flight += 1
+
+    def end(self, model, seconds, error=None):
+        """Record a finished call; ``error`` is the exception it raised, if any"""
+        code = getattr(error, 'code', None) if error is not None else None
+        failed = error is not None and code not in CLIENT_ERROR_CODES
+        now = time.time()
+        with self._lock:
+            window = self._window(model)
+            window.in_flight -= 1
+            window.calls.append((now, seconds, failed))
+            if code == 429 or 'RESOURCE_EXHAUSTED' in str(error or ''):
+                window.cooldown_until = now + self.cooldown
+
+    def in_flight(self, model):
+        with self._lock:
+            return self._window(model).in_flight
+
+    def add_pressure_source(self, name, func):
+        """Register ``func() -> float``, the load of one component relative to its capacity"""
+        self._pressure_sources[name] = func
+
+    def pressure(self):
+        values = []
+        for name, func in list(self._pressure_sources.items()):
+            try:
+                values.append(float(func()))
+            except Exception as e:
+                logging.warning(f"Pressure source {name} failed: {e}")
+        return max(values, default=0.0)
+
+    def model_stats(self, model):
+        """Rolling p90 latency, error rate and health of a model"""
+        now = time.time()
+        with self._lock:
+            window = self._window(model)
+            recent = [call for call in window.calls if now - call[0] <= self.window]
+            cooling = window.cooldown_until > now
+            in_flight = window.in_flight
+
+        latencies = sorted(seconds for _, seconds, failed in recent if not failed)
+        p90 = latencies[int(len(latencies) * 0.9)] if latencies else 0.0
+        error_rate = sum(1 for call in recent if call[2]) / len(recent) if recent else 0.0
+
+        health = HEALTHY
+        if cooling or (len(recent) >= self.min_samples and error_rate > self.max_error_rate):
+            health = UNAVAILABLE
+        elif len(latencies) >= self.min_samples and p90 > self.slow_after.get(model, float('inf')):
+            health = SLOW
+        return {'health': health, 'p90_seconds': p90, 'error_rate': error_rate,
+                'calls': len(recent), 'in_flight': in_flight}
+
+    def choose(self, task):
+        """The model to use for ``task`` right now"""
+        models = self.routes[task]
+        health = {model: self.model_stats(model)['health'] for model in models}
+        model = (next((m for m in models if health[m] == HEALTHY), None)
+                 or next((m for m in models if health[m] == SLOW), None)
+                 or models[0])
+
+        previous = self._decisions.get(task)
+        self._decisions[task] = model
+        if previous is not None and previous != model:
+            logging.warning(f"Routing {task} to {model} (was {previous}); model health: {health}")
+        return model
+
+    def reduce_output(self, task):
+        """True when ``task`` should ask for less output, e.g. skip optional text"""
+        return self.pressure() >= self.reduce_pressure or self.choose(task) != self.routes[task][0]
+
+    def should_shed(self, task):
+        """True, and counted, when optional ``task`` should be skipped right now"""
+        if task not in self.optional:
+            return False
+        shed = (self.pressure() >= self.shed_pressure
+                or all(self.model_stats(m)['health'] == UNAVAILABLE for m in self.routes[task]))
+        if shed:
+            with self._lock:
+                self.shed_counts[task] += 1
+        return shed
+
+    def stats(self):
+        """Current routing decisions, per-model health and shed counts"""
+        all_models = {model for models in self.routes.values() for model in models}
+        with self._lock:
+            shed = dict(self.shed_counts)
+        return {
+            'pressure': self.pressure(),
+            'routes': {task: self._decisions.get(task, models[0]) for task, models in self.routes.items()},
+            'models': {model: self.model_stats(model) for model in sorted(all_models)},
+            'shed': shed,
+        }
@@ -24,10 +24,16 @@ def install_dependencies():
     dependencies = [
         'flask',
         'pillow',
+        'numpy',
         'google-genai',
+        'httpx',
         'werkzeug',
         'gunicorn',
-        'pydantic'
+        'pydantic',
+        'starlette',
+        'uvicorn',
+        'a2wsgi',
+        'python-multipart'
     ]
     
     try:
@@ -127,6 +133,8 @@ def main():
     print("\nTo start the application:")
     print("1. python main.py          (simple development server)")
     print("2. gunicorn --bind 0.0.0.0:5000 --reload main:app  (production server)")
+    print("3. uvicorn asgi:app --host 0.0.0.0 --port 5000     (async server)")
+    print("   Set GUNICORN_PRELOAD=1 with option 2 (without --reload) for faster worker start")
     print("\nThen open http://localhost:5000 in your browser")
 
 if __name__ == "__main__":
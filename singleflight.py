@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalescing stays within one process
+    fcntl = None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapses identical in-flight calls into one.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive with the same key while it is running wait and receive the same
+    result or exception. Results are not kept afterwards; that is the
+    result cache's job.
+
+    With ``lock_dir`` the leader also takes an advisory file lock for the
+    key, so leaders in other worker processes on the same host wait for it
+    and then call ``recheck`` (typically a cache lookup) before doing the
+    work themselves. Waiting for another process gives up after
+    ``lock_timeout`` seconds and runs the call anyway.
+    """
+
+    def __init__(self, lock_dir=None, lock_timeout=150):
+        self.lock_dir = lock_dir if lock_dir and fcntl else None
+        self.lock_timeout = lock_timeout
+        self.leaders = 0
+        self.followers = 0
+        self.lock_waits = 0
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        if lock_dir and not fcntl:
+            logging.warning("File locks are unavailable; request coalescing is per process only")
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def do(self, key, func, recheck=None):
+        """Return ``func()``, sharing one execution among concurrent callers with the same key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with self._file_lock(key) as waited:
+                result = recheck() if waited and recheck else None
+                call.result = result or func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def do_async(self, key, func, recheck=None):
+        """Coroutine version of ``do``; ``func`` and ``recheck`` are coroutine functions"""
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        future = calls.get(key)
+        if future is not None:
+            self.followers += 1
+            # shield: a follower giving up must not cancel the leader's call
+            return await asyncio.shield(future)
+
+        future = calls[key] = loop.create_future()
+        self.leaders += 1
+        try:
+            lock = await self._acquire_async(key) if self.lock_dir else None
+            try:
+                result = await recheck() if lock and lock[1] and recheck else None
+                result = result or await func()
+            finally:
+                if lock:
+                    await asyncio.to_thread(self._release, lock[0])
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.set_exception(Exception("Generation was cancelled before it finished"))
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del calls[key]
+            if not calls:
+                self._async_calls.pop(loop, None)
+            if future.done() and future.exception() is not None:
+                future.exception()  # followers may all have gone; don't log it as unretrieved
+
+    async def _acquire_async(self, key):
+        task = asyncio.ensure_future(asyncio.to_thread(self._acquire, key))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # The thread still takes the lock; release it as soon as it does
+            task.add_done_callback(lambda t: t.cancelled() or t.exception() or self._release(t.result()[0]))
+            raise
+
+    def stats(self):
+        return {'leaders': self.leaders, 'followers': self.followers, 'lock_waits': self.lock_waits}
+
+    @contextmanager
+    def _file_lock(self, key):
+        """Hold the cross-process lock for a key; yields whether another process held it first"""
+        if not self.lock_dir:
+            yield False
+            return
+        fd, waited = self._acquire(key)
+        try:
+            yield waited
+        finally:
+            self._release(fd)
+
+    def _acquire(self, key):
+        # Lock files are striped by key prefix so the directory stays bounded
+        fd = os.open(os.path.join(self.lock_dir, f"{key[:4]}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        waited = False
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd, waited
+            except BlockingIOError:
+                if not waited:
+                    waited = True
+                    self.lock_waits += 1
+                if time.monotonic() >= deadline:
+                    logging.warning(f"Gave up waiting {self.lock_timeout}s for another worker's generation of {key[:12]}")
+                    return fd, waited
+                time.sleep(0.05)
+
+    @staticmethod
+    def _release(fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Speculator:
+    """Runs optional work ahead of demand while the service is idle, within a spend budget.
+
+    At most ``budget`` tasks run per ``window`` seconds. A task is queued,
+    and later started, only while ``pressure()`` is below ``max_pressure``;
+    otherwise it is dropped. Tasks run on ``workers`` threads of their own,
+    so they never hold a request or job worker, and a key already queued
+    or running is not queued again. A task returns whether it actually
+    spent anything; one that did not gets its budget back. Tasks submitted
+    with a ``group`` (e.g. a shopper) that have not started yet are dropped
+    by ``discard(group)`` once the guess they were based on is stale.
+    """
+
+    def __init__(self, budget, window=3600, max_pressure=0.25, pressure=None, workers=1, max_pending=16):
+        self.budget = budget
+        self.window = window
+        self.max_pressure = max_pressure
+        self.pressure = pressure
+        self.max_pending = max_pending
+        self.counts = {'spent': 0, 'unspent': 0, 'busy': 0, 'over_budget': 0, 'duplicate': 0, 'failed': 0,
+                       'discarded': 0}
+        self._spent_at = deque()
+        self._pending = {}  # key -> (group, ticket) of tasks queued or running; group is None once started
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='speculate')
+
+    def idle(self):
+        return (self.pressure() if self.pressure else 0.0) < self.max_pressure
+
+    def _remaining(self, now):
+        while self._spent_at and self._spent_at[0] <= now - self.window:
+            self._spent_at.popleft()
+        return self.budget - len(self._spent_at)
+
+    def submit(self, key, func, *args, group=None, **kwargs):
+        """Queue ``func(*args, **kwargs)`` unless busy, over budget or already queued; returns whether it was"""
+        idle = self.idle()
+        ticket = object()
+        with self._lock:
+            if key in self._pending:
+                self.counts['duplicate'] += 1
+                return False
+            if not idle or len(self._pending) >= self.max_pending:
+                self.counts['busy'] += 1
+                return False
+            if self._remaining(time.monotonic()) <= 0:
+                self.counts['over_budget'] += 1
+                return False
+            self._pending[key] = (group, ticket)
+        self._executor.submit(self._run, key, ticket, func, args, kwargs)
+        return True
+
+    def discard(self, group):
+        """Drop the tasks of ``group`` that have not started; returns how many were dropped"""
+        if group is None:
+            return 0
+        with self._lock:
+            keys = [key for key, (task_group, _) in self._pending.items() if task_group == group]
+            for key in keys:
+                del self._pending[key]
+            self.counts['discarded'] += len(keys)
+        return len(keys)
+
+    def _run(self, key, ticket, func, args, kwargs):
+        try:
+            # Conditions may have changed while the task was queued
+            idle = self.idle()
+            with self._lock:
+                if self._pending.get(key, (None, None))[1] is not ticket:
+                    return  # discarded while queued
+                self._pending[key] = (None, ticket)
+                now = time.monotonic()
+                if not idle:
+                    self.counts['busy'] += 1
+                    return
+                if self._remaining(now) <= 0:
+                    self.counts['over_budget'] += 1
+                    return
+                self._spent_at.append(now)
+            spent = func(*args, **kwargs)
+            with self._lock:
+                if spent:
+                    self.counts['spent'] += 1
+                else:
+                    self.counts['unspent'] += 1
+                    if now in self._spent_at:
+                        self._spent_at.remove(now)
+        except Exception as e:
+            logging.warning(f"Speculative task {key[:16]} failed: {e}")
+            with self._lock:
+                self.counts['failed'] += 1
+        finally:
+            with self._lock:
+                if self._pending.get(key, (None, None))[1] is ticket:
+                    del self._pending[key]
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, pending=len(self._pending),
+                        budget_left=self._remaining(time.monotonic()))
@@ -0,0 +1,241 @@
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from results import atomic_write
+
+# Object names are relative paths such as "tryon_<hash>.jpg" or "thumbs/<name>"
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9_.-]*(/[A-Za-z0-9_][A-Za-z0-9_.-]*)*$')
+
+StoredObject = namedtuple('StoredObject', ['name', 'size', 'etag', 'modified', 'content_type'])
+
+
+def check_name(name):
+    """Validate an object name; raises ValueError for anything path-like or unsafe"""
+    if not NAME_PATTERN.match(name) or '..' in name:
+        raise ValueError(f"Invalid result name: {name!r}")
+    return name
+
+
+def _content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def _etag(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class LocalStorage:
+    """Results stored as files in a local directory"""
+
+    def __init__(self, directory, url_prefix='/results/'):
+        self.directory = directory
+        self.url_prefix = url_prefix
+
+    def _path(self, name):
+        return os.path.join(self.directory, *check_name(name).split('/'))
+
+    def _stat(self, name, path):
+        st = os.stat(path)
+        # Names are content hashes, so the name and size identify the bytes even after put() refreshes the mtime
+        etag = _etag(f"{name}:{st.st_size}".encode())
+        return StoredObject(name, st.st_size, etag, st.st_mtime, _content_type(name))
+
+    def put(self, name, data):
+        path = self._path(name)
+        if os.path.exists(path) and os.path.getsize(path) == len(data):
+            # Names are content hashes, so this is the same result; refresh its age for the janitor
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, data)
+        return self._stat(name, path)
+
+    def stat(self, name):
+        try:
+            return self._stat(name, self._path(name))
+        except FileNotFoundError:
+            return None
+
+    def read(self, name, start=0, end=None):
+        """Return bytes ``[start, end)`` of an object, or None if it does not exist"""
+        try:
+            with open(self._path(name), 'rb') as f:
+                f.seek(start)
+                return f.read() if end is None else f.read(end - start)
+        except FileNotFoundError:
+            return None
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix=''):
+        directory = os.path.join(self.directory, *prefix.rstrip('/').split('/')) if prefix else self.directory
+        try:
+            with os.scandir(directory) as it:
+                for item in it:
+                    if item.is_file() and not item.name.startswith('.'):
+                        name = f"{prefix.rstrip('/')}/{item.name}" if prefix else item.name
+                        yield self._stat(name, item.path)
+        except FileNotFoundError:
+            return
+
+    def url(self, name):
+        return self.url_prefix + name
+
+
+class MemoryStorage:
+    """Results kept in an in-process LRU bounded by total size.
+
+    Fast and dependency free, but private to one process: use it for a
+    single worker or as a scratch backend, not to share between nodes.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, url_prefix='/results/'):
+        self.max_bytes = max_bytes
+        self.url_prefix = url_prefix
+        self._objects = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, name, data):
+        check_name(name)
+        data = bytes(data)
+        info = StoredObject(name, len(data), _etag(data), time.time(), _content_type(name))
+        with self._lock:
+            previous = self._objects.pop(name, None)
+            if previous:
+                self._size -= previous[1].size
+            self._objects[name] = (data, info)
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._objects) > 1:
+                _, (_, evicted) = self._objects.popitem(last=False)
+                self._size -= evicted.size
+        return info
+
+    def stat(self, name):
+        with self._lock:
+            entry = self._objects.get(name)
+            if entry is None:
+                return None
+            self._objects.move_to_end(name)
+            return entry[1]
+
+    def read(self, name, start=0, end=None):
+        with self._lock:
+            entry = self._objects.get(name)
+        if entry is None:
+            return None
+        return entry[0][start:end]
+
+    def delete(self, name):
+        with self._lock:
+            entry = self._objects.pop(name, None)
+            if entry:
+                self._size -= entry[1].size
+
+    def list(self, prefix=''):
+        with self._lock:
+            infos = [info for _, info in self._objects.values()]
+        return [info for info in infos if info.name.startswith(prefix)]
+
+    def url(self, name):
+        return self.url_prefix + name
+
+
+class S3Storage:
+    """Results stored in an S3-compatible bucket (AWS S3, MinIO, Ceph, R2...).
+
+    Every app node pointed at the same bucket sees the same results.
+    Requires ``boto3``. ``endpoint_url`` selects a non-AWS service.
+    """
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, url_prefix='/results/'):
+        try:
+            import boto3
+            from botocore.config import Config
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise Exception("S3 result storage requires boto3. Install it with: pip install boto3")
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.url_prefix = url_prefix
+        self._client_error = ClientError
+        self._client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region,
+                                    config=Config(max_pool_connections=int(os.environ.get('S3_MAX_CONNECTIONS', 32)),
+                                                  retries={'max_attempts': 3, 'mode': 'standard'}))
+
+    def _key(self, name):
+        return self.prefix + check_name(name)
+
+    def _not_found(self, error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def put(self, name, data):
+        content_type = _content_type(name)
+        response = self._client.put_object(Bucket=self.bucket, Key=self._key(name), Body=data,
+                                           ContentType=content_type)
+        return StoredObject(name, len(data), response['ETag'].strip('"'), time.time(), content_type)
+
+    def stat(self, name):
+        try:
+            response = self._client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except self._client_error as e:
+            if self._not_found(e):
+                return None
+            raise
+        return StoredObject(name, response['ContentLength'], response['ETag'].strip('"'),
+                            response['LastModified'].timestamp(), response.get('ContentType') or _content_type(name))
+
+    def read(self, name, start=0, end=None):
+        kwargs = {}
+        if start or end is not None:
+            kwargs['Range'] = f"bytes={start}-{'' if end is None else end - 1}"
+        try:
+            response = self._client.get_object(Bucket=self.bucket, Key=self._key(name), **kwargs)
+        except self._client_error as e:
+            if self._not_found(e):
+                return None
+            raise
+        return response['Body'].read()
+
+    def delete(self, name):
+        self._client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def list(self, prefix=''):
+        paginator = self._client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for item in page.get('Contents', []):
+                name = item['Key'][len(self.prefix):]
+                yield StoredObject(name, item['Size'], item['ETag'].strip('"'),
+                                   item['LastModified'].timestamp(), _content_type(name))
+
+    def url(self, name):
+        return self.url_prefix + name
+
+
+def create_storage(backend, directory, url_prefix='/results/'):
+    """Build the result storage selected by ``backend`` (local, memory or s3).
+
+    The S3 backend reads RESULTS_S3_BUCKET, RESULTS_S3_PREFIX,
+    RESULTS_S3_ENDPOINT and RESULTS_S3_REGION from the environment.
+    """
+    if backend == 'local':
+        return LocalStorage(directory, url_prefix)
+    if backend == 'memory':
+        return MemoryStorage(int(os.environ.get('RESULTS_MEMORY_MAX_BYTES', 256 * 1024 * 1024)), url_prefix)
+    if backend == 's3':
+        bucket = os.environ.get('RESULTS_S3_BUCKET')
+        if not bucket:
+            raise Exception("RESULTS_S3_BUCKET must be set when RESULTS_STORAGE=s3")
+        return S3Storage(bucket, os.environ.get('RESULTS_S3_PREFIX', ''), os.environ.get('RESULTS_S3_ENDPOINT'),
+                         os.environ.get('RESULTS_S3_REGION'), url_prefix)
+    raise Exception(f"Unknown result storage backend: {backend}")
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing main needs a key and writable state; keep test runs off the real directories
+_state = tempfile.mkdtemp(prefix='musefit-tests-')
+os.environ.setdefault('GEMINI_API_KEY', 'test')
+os.environ.setdefault('RESULTS_STORAGE', 'memory')
+os.environ.setdefault('IMAGE_PROCESSES', '0')
+os.environ.setdefault('ARCHIVE_PATH', os.path.join(_state, 'archive.sqlite3'))
+os.environ.setdefault('JOB_STATE_DIR', os.path.join(_state, 'jobs'))
+os.environ.setdefault('UPLOAD_INDEX_DIR', os.path.join(_state, 'uploads'))
+
+from bench.fake_gemini import FakeGeminiModels, FakeTransport  # noqa: E402
+
+
+class ControlledModels(FakeGeminiModels):
+    """Fast fake Gemini models whose image calls can be held back or made to fail"""
+
+    def __init__(self):
+        super().__init__(image_latency_ms=5, text_latency_ms=1, sigma=0, image_bytes=1024)
+        self.image_calls = 0
+        self.release = threading.Event()
+        self.release.set()
+        self.error = None
+
+    def generate_content(self, *, model, contents, config=None, **kwargs):
+        if 'image' in model:
+            with self._lock:
+                self.image_calls += 1
+            self.release.wait(5)
+        if self.error:
+            raise self.error
+        return super().generate_content(model=model, contents=contents, config=config)
+
+
+@pytest.fixture
+def gemini_models(monkeypatch):
+    """Route ``gemini.client`` through ControlledModels, keeping the retry/limit wrapper"""
+    import gemini
+    from gemini_client import GeminiClient
+
+    models = ControlledModels()
+    monkeypatch.setattr(gemini, 'client', GeminiClient(transport=FakeTransport(models), router=gemini.model_router))
+    return models
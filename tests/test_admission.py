@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import DEADLINE, QUEUE_FULL, AdmissionController, AdmissionRejectedError, RouteClass
+
+
+def controller(capacity=1, **routes):
+    """Controller with route classes given as name=(priority, limit, queue_size, deadline, expected_seconds)"""
+    return AdmissionController(capacity, [RouteClass(name, *settings) for name, settings in routes.items()])
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+class Holder:
+    """Holds a slot of a route class in a thread until released"""
+
+    def __init__(self, admission, route_class):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(admission, route_class))
+        self.thread.start()
+        self.entered.wait(2)
+
+    def _run(self, admission, route_class):
+        with admission.admit(route_class):
+            self.entered.set()
+            self.release.wait(5)
+
+    def done(self):
+        self.release.set()
+        self.thread.join()
+
+
+def test_free_slots_go_to_the_highest_priority_class_first():
+    admission = controller(high=(0, 1, 4, 10, 0.01), low=(1, 1, 4, 10, 0.01))
+    holder = Holder(admission, 'low')
+    order = []
+
+    def request(route_class):
+        with admission.admit(route_class):
+            order.append(route_class)
+
+    threads = []
+    for route_class in ('low', 'high'):
+        threads.append(threading.Thread(target=request, args=(route_class,)))
+        threads[-1].start()
+        wait_until(lambda: admission.routes[route_class].waiting == 1)
+    holder.done()
+    for thread in threads:
+        thread.join()
+
+    assert order == ['high', 'low']
+
+
+def test_rejects_when_the_queue_is_full():
+    admission = controller(tryon=(0, 1, 1, 60, 10.0))
+    holder = Holder(admission, 'tryon')
+    waiter = threading.Thread(target=lambda: admission.admit('tryon').__enter__())
+    try:
+        waiter.start()
+        wait_until(lambda: admission.routes['tryon'].waiting == 1)
+        with pytest.raises(AdmissionRejectedError) as rejected:
+            with admission.admit('tryon'):
+                pass
+    finally:
+        holder.done()
+        waiter.join()
+
+    assert rejected.value.reason == QUEUE_FULL
+    assert admission.stats()['routes']['tryon']['rejected'] == {QUEUE_FULL: 1, DEADLINE: 0}
+
+
+def test_rejects_up_front_when_the_wait_would_miss_the_deadline():
+    admission = controller(tryon=(0, 1, 4, 60, 10.0))
+    holder = Holder(admission, 'tryon')
+    started = time.monotonic()
+    try:
+        with pytest.raises(AdmissionRejectedError) as rejected:
+            with admission.admit('tryon', timeout=15):
+                pass
+    finally:
+        holder.done()
+
+    assert rejected.value.reason == DEADLINE
+    assert time.monotonic() - started < 0.5
+
+
+def test_drops_a_queued_request_once_it_can_no_longer_finish_in_time():
+    admission = controller(tryon=(0, 1, 4, 0.6, 0.2))
+    holder = Holder(admission, 'tryon')
+    started = time.monotonic()
+    try:
+        with pytest.raises(AdmissionRejectedError) as rejected:
+            with admission.admit('tryon'):
+                pass
+    finally:
+        holder.done()
+
+    assert rejected.value.reason == DEADLINE
+    assert 0.3 <= time.monotonic() - started < 1
+    assert admission.routes['tryon'].waiting == 0
+
+
+def test_retry_after_estimates_the_wait_in_whole_seconds():
+    admission = controller(capacity=2, tryon=(0, 1, 0, 600, 7.5), slow=(1, 1, 0, 600, 100.0))
+    holders = [Holder(admission, 'tryon'), Holder(admission, 'slow')]
+    try:
+        for route_class, expected in (('tryon', 8), ('slow', 60)):
+            with pytest.raises(AdmissionRejectedError) as rejected:
+                with admission.admit(route_class):
+                    pass
+            assert rejected.value.retry_after == expected
+    finally:
+        for holder in holders:
+            holder.done()
+
+
+def test_async_requests_share_the_limits_and_give_back_their_place_when_cancelled():
+    admission = controller(tryon=(0, 1, 4, 10, 0.01))
+    holder = Holder(admission, 'tryon')
+
+    async def main():
+        waiting = asyncio.create_task(admission.admit_async('tryon').__aenter__())
+        await asyncio.sleep(0.05)
+        assert admission.routes['tryon'].waiting == 1
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert admission.routes['tryon'].waiting == 0
+
+        entered = asyncio.Event()
+
+        async def request():
+            async with admission.admit_async('tryon'):
+                entered.set()
+
+        task = asyncio.create_task(request())
+        await asyncio.sleep(0.05)
+        assert not entered.is_set()
+        holder.done()
+        await asyncio.wait_for(task, 2)
+
+    asyncio.run(main())
+    assert admission.stats()['running'] == 0
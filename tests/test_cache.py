@@ -0,0 +1,60 @@
+import os
+import time
+
+from cache import ResultCache
+from results import ResultJanitor
+from storage import LocalStorage, MemoryStorage
+
+
+def test_hit_after_put():
+    storage = MemoryStorage()
+    cache = ResultCache(storage)
+    storage.put('tryon_a.jpg', b'image')
+    cache.put('key', 'tryon_a.jpg', 'looks good')
+
+    assert cache.get('key') == ('/results/tryon_a.jpg', 'looks good')
+    assert ResultCache(storage).get('key') == ('/results/tryon_a.jpg', 'looks good')
+
+
+def test_prune_drops_entries_whose_result_is_gone():
+    storage = MemoryStorage()
+    cache = ResultCache(storage)
+    for name in ('tryon_a.jpg', 'tryon_b.jpg'):
+        storage.put(name, b'image')
+        cache.put(name, name, '')
+    storage.delete('tryon_a.jpg')
+
+    cache.prune()
+
+    assert [o.name for o in storage.list('cache/')] == ['cache/tryon_b.jpg.json']
+    assert cache.get('tryon_a.jpg') is None
+    assert cache.get('tryon_b.jpg') is not None
+
+
+def test_janitor_prunes_cache_entries_with_the_results(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    cache = ResultCache(storage)
+    name = 'tryon_0123456789abcdef0123.jpg'
+    storage.put(name, b'image')
+    cache.put('key', name, '')
+    janitor = ResultJanitor(str(tmp_path), max_age=60, interval=0.01, on_sweep=cache.prune)
+    old = time.time() - 120
+    os.utime(tmp_path / name, (old, old))
+
+    janitor.ensure_started()
+    deadline = time.time() + 5
+    while list(storage.list('cache/')) and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert storage.stat(name) is None
+    assert list(storage.list('cache/')) == []
+
+
+def test_memory_lru_evictions_are_counted():
+    storage = MemoryStorage()
+    cache = ResultCache(storage, max_memory_entries=2)
+    for key in 'abc':
+        cache.put(key, f'tryon_{key}.jpg', '')
+
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['memory_entries'] == 2
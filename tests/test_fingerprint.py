@@ -0,0 +1,148 @@
+import hashlib
+import io
+import os
+import random
+import threading
+
+import pytest
+
+from fingerprint import THUMBNAIL_SIZE, NearDuplicateIndex, fingerprint_image, hamming_distance
+
+MODEL = 'gemini-test'
+GREY = bytes([128]) * (THUMBNAIL_SIZE * THUMBNAIL_SIZE * 3)
+
+
+def flip(fingerprint, *bits):
+    for bit in bits:
+        fingerprint ^= 1 << bit
+    return fingerprint
+
+
+def add(index, fingerprint, scope='shopper', thumbnail=GREY, data=None):
+    index.add(fingerprint, 1.0, MODEL, scope, thumbnail, data or f'{fingerprint:x} {scope}'.encode())
+
+
+def test_multi_index_lookup_matches_a_linear_scan(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path), max_distance=4)
+    rng = random.Random(7)
+    stored = [rng.getrandbits(64) for _ in range(300)]
+    for fingerprint in stored:
+        add(index, fingerprint)
+
+    for fingerprint in rng.sample(stored, 40):
+        for flips in (0, 1, 4, 5, 12):
+            query = flip(fingerprint, *rng.sample(range(64), flips))
+            expected = {f'{f:x} shopper'.encode() for f in stored if hamming_distance(f, query) <= 4}
+            found = index.find(query, 1.0, MODEL, 'shopper', GREY)
+            if expected:
+                assert found in expected
+            else:
+                assert found is None
+
+
+def test_returns_the_closest_match(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path), max_distance=4)
+    add(index, flip(0, 1, 2, 3), data=b'far')
+    add(index, flip(0, 1), data=b'near')
+
+    assert index.find(0, 1.0, MODEL, 'shopper', GREY) == b'near'
+
+
+def test_bits_spread_over_every_block_are_found(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path), max_distance=4)
+    add(index, 0, data=b'photo')
+
+    # One differing bit in each of four of the five blocks
+    assert index.find(flip(0, 63, 50, 37, 24), 1.0, MODEL, 'shopper', GREY) == b'photo'
+    assert index.find(flip(0, 63, 50, 37, 24, 11), 1.0, MODEL, 'shopper', GREY) is None
+
+
+def test_scopes_and_models_are_isolated(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path))
+    add(index, 0x1234, scope='alice', data=b'alice photo')
+
+    assert index.find(0x1234, 1.0, MODEL, 'alice', GREY) == b'alice photo'
+    assert index.find(0x1234, 1.0, MODEL, 'bob', GREY) is None
+    assert index.find(0x1234, 1.0, 'other-model', 'alice', GREY) is None
+
+
+def test_a_different_thumbnail_or_aspect_ratio_is_not_a_match(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path))
+    add(index, 0, data=b'grey photo')
+
+    red = bytes([200, 60, 60]) * (THUMBNAIL_SIZE * THUMBNAIL_SIZE)
+    almost_grey = bytes([133]) * len(GREY)
+    assert index.find(0, 1.0, MODEL, 'shopper', red) is None
+    assert index.find(0, 1.0, MODEL, 'shopper', almost_grey) == b'grey photo'
+    assert index.find(0, 1.5, MODEL, 'shopper', GREY) is None
+
+
+def test_other_processes_see_new_uploads(tmp_path):
+    writer = NearDuplicateIndex(str(tmp_path))
+    reader = NearDuplicateIndex(str(tmp_path))
+    assert reader.find(0xabc, 1.0, MODEL, 'shopper', GREY) is None
+
+    add(writer, 0xabc, data=b'photo')
+    assert reader.find(0xabc, 1.0, MODEL, 'shopper', GREY) == b'photo'
+
+
+def test_compaction_drops_only_entries_whose_files_were_removed(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path), max_log_bytes=4096)
+    other = NearDuplicateIndex(str(tmp_path), max_log_bytes=4096)
+    rng = random.Random(3)
+    photos = {rng.getrandbits(64): b'photo %d' % number for number in range(40)}
+    first = list(photos)[:5]
+    for fingerprint in first:
+        add(index, fingerprint, data=photos[fingerprint])
+    assert other.find(first[0], 1.0, MODEL, 'shopper', GREY) == photos[first[0]]
+    removed = {first[0], first[1]}
+    for fingerprint in removed:
+        os.remove(index._path(hashlib.sha256(photos[fingerprint]).hexdigest()[:20]))
+
+    for fingerprint in list(photos)[5:]:
+        add(index, fingerprint, data=photos[fingerprint])
+
+    with open(tmp_path / 'index.log') as f:
+        assert len(f.readlines()) == 38
+    # A process that read the log before it was rewritten picks up the new one
+    for fingerprint, data in photos.items():
+        expected = None if fingerprint in removed else data
+        assert other.find(fingerprint, 1.0, MODEL, 'shopper', GREY) == expected
+
+
+def test_concurrent_appends_survive_compaction(tmp_path):
+    indexes = [NearDuplicateIndex(str(tmp_path), max_log_bytes=2048) for _ in range(4)]
+
+    def upload(number, index):
+        for i in range(50):
+            add(index, (number << 56) | (i << 16), data=b'%d-%d' % (number, i))
+
+    threads = [threading.Thread(target=upload, args=(number, index)) for number, index in enumerate(indexes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    fresh = NearDuplicateIndex(str(tmp_path))
+    for number in range(4):
+        for i in range(50):
+            assert fresh.find((number << 56) | (i << 16), 1.0, MODEL, 'shopper', GREY) == b'%d-%d' % (number, i)
+
+
+def test_fingerprint_survives_recompression():
+    Image = pytest.importorskip('PIL.Image')
+    pixels = Image.effect_mandelbrot((300, 200), (-2.0, -1.0, 1.0, 1.0), 64).convert('RGB')
+
+    def jpeg(image, quality, size=None):
+        out = io.BytesIO()
+        (image.resize(size) if size else image).save(out, 'JPEG', quality=quality)
+        return out.getvalue()
+
+    original, aspect_ratio, thumbnail = fingerprint_image(jpeg(pixels, 95))
+    smaller, _, smaller_thumbnail = fingerprint_image(jpeg(pixels, 60, (150, 100)))
+    flipped, _, _ = fingerprint_image(jpeg(pixels.transpose(Image.FLIP_LEFT_RIGHT), 95))
+
+    assert aspect_ratio == pytest.approx(1.5)
+    assert hamming_distance(original, smaller) <= 4
+    assert hamming_distance(original, flipped) > 4
+    assert len(thumbnail) == len(smaller_thumbnail) == THUMBNAIL_SIZE * THUMBNAIL_SIZE * 3
@@ -0,0 +1,44 @@
+import math
+
+import pytest
+
+from fit import FitEngine
+
+# Shirts are comfortable with 2 to 6 inches of chest ease
+SHIRT_VERDICTS = [
+    (-0.5, 'too tight'),
+    (0.0, 'snug'),
+    (1.9, 'snug'),
+    (2.0, 'perfect'),
+    (6.0, 'perfect'),
+    (6.1, 'loose'),
+    (9.0, 'loose'),
+    (9.1, 'too loose'),
+]
+
+
+@pytest.mark.parametrize('ease, expected', SHIRT_VERDICTS)
+def test_verdict_boundaries(ease, expected):
+    assert FitEngine().verdict(ease, 'shirt') == expected
+
+
+def test_unknown_garment_uses_the_default_tolerances():
+    engine = FitEngine()
+    for ease, expected in SHIRT_VERDICTS:
+        assert engine.verdict(ease, 'kilt') == expected
+
+
+@pytest.mark.parametrize('ease', [math.nan, math.inf, -math.inf])
+def test_verdict_rejects_non_finite_ease(ease):
+    with pytest.raises(ValueError):
+        FitEngine().verdict(ease)
+
+
+def test_non_finite_measurements_are_not_compared():
+    engine = FitEngine()
+    assessment = engine.assess({'chest': math.nan, 'height': 70}, {'size': 'M'})
+    assert assessment['verdict'] is None
+
+    # A non-numeric product chest falls back to the chart's measurement
+    assessment = engine.assess({'chest': 40, 'height': 70}, {'size': 'M', 'chest': 'nan'})
+    assert (assessment['chest_ease'], assessment['verdict']) == (2.0, 'perfect')
@@ -0,0 +1,207 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from google.genai import errors
+
+import gemini_client
+from gemini_client import (DEFAULT_MODEL_CONCURRENCY, AsyncModelLimiter, GeminiClient, GeminiUnavailableError,
+                           ModelLimiter, RetryPolicy)
+from routing import ModelRouter
+
+MODEL = 'gemini-test'
+
+
+def api_error(code):
+    return errors.APIError(code, {'error': {'message': f'HTTP {code}', 'status': str(code)}})
+
+
+class StubModels:
+    """Transport ``models`` that fails with the queued errors, then answers"""
+
+    def __init__(self, failures=(), delay=0.0):
+        self.failures = list(failures)
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, model, contents, config=None):
+        with self._lock:
+            self.calls.append(config.http_options.timeout)
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            if self.failures:
+                raise self.failures.pop(0)
+            return SimpleNamespace(text=f'{model}: {contents}', candidates=[])
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class FixedDelay(RetryPolicy):
+    def __init__(self, seconds, attempts=4):
+        super().__init__(attempts=attempts)
+        self.seconds = seconds
+
+    def delay(self, attempt):
+        return self.seconds
+
+
+def client_for(models, **kwargs):
+    kwargs.setdefault('retry_policy', FixedDelay(0.0))
+    return GeminiClient(transport=SimpleNamespace(models=models), **kwargs)
+
+
+def test_retries_transient_errors_then_succeeds():
+    models = StubModels(failures=[api_error(503), api_error(429)])
+    response = client_for(models).models.generate_content(model=MODEL, contents='hi', timeout=5)
+
+    assert response.text == f'{MODEL}: hi'
+    assert len(models.calls) == 3
+
+
+def test_does_not_retry_client_errors():
+    models = StubModels(failures=[api_error(400)])
+    with pytest.raises(errors.APIError):
+        client_for(models).models.generate_content(model=MODEL, contents='hi', timeout=5)
+    assert len(models.calls) == 1
+
+
+def test_gives_up_after_the_last_attempt():
+    models = StubModels(failures=[api_error(503)] * 5)
+    with pytest.raises(errors.APIError):
+        client_for(models, retry_policy=FixedDelay(0.0, attempts=3)).models.generate_content(
+            model=MODEL, contents='hi', timeout=5)
+    assert len(models.calls) == 3
+
+
+def test_backoff_is_jittered_below_the_exponential_cap():
+    policy = RetryPolicy(base_delay=0.5, max_delay=3.0)
+    random.seed(7)
+    for attempt, cap in [(1, 0.5), (2, 1.0), (3, 2.0), (4, 3.0), (8, 3.0)]:
+        delays = {policy.delay(attempt) for _ in range(50)}
+        assert all(0 <= delay <= cap for delay in delays)
+        assert len(delays) > 1
+
+
+def test_does_not_sleep_past_the_deadline():
+    models = StubModels(failures=[api_error(503)] * 5)
+    started = time.monotonic()
+    with pytest.raises(errors.APIError):
+        client_for(models, retry_policy=FixedDelay(2.0)).models.generate_content(
+            model=MODEL, contents='hi', timeout=0.5)
+    assert time.monotonic() - started < 0.5
+    assert len(models.calls) == 1
+
+
+def test_http_timeout_is_the_time_left_before_the_deadline():
+    models = StubModels(failures=[api_error(503)])
+    client_for(models, retry_policy=FixedDelay(0.2)).models.generate_content(
+        model=MODEL, contents='hi', timeout=2)
+
+    first, second = models.calls
+    assert 1900 <= first <= 2000
+    assert second <= first - 200
+
+
+def test_limits_concurrent_calls_per_model():
+    models = StubModels(delay=0.05)
+    client = client_for(models, limiter=ModelLimiter({MODEL: 2}))
+    threads = [threading.Thread(target=client.models.generate_content,
+                                kwargs={'model': MODEL, 'contents': 'hi', 'timeout': 5})
+               for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(models.calls) == 6
+    assert models.most_in_flight == 2
+
+
+def test_limits_concurrent_async_calls_per_model():
+    models = StubModels(delay=0.05)
+    client = client_for(models, limiter=ModelLimiter({MODEL: 2}))
+
+    async def main():
+        await asyncio.gather(*(client.aio.models.generate_content(model=MODEL, contents='hi', timeout=5)
+                               for _ in range(6)))
+
+    asyncio.run(main())
+    assert len(models.calls) == 6
+    assert models.most_in_flight == 2
+
+
+def test_async_limits_default_to_the_per_model_limits():
+    limiter = AsyncModelLimiter()
+    image_model = 'gemini-2.0-flash-preview-image-generation'
+
+    assert limiter.limits == DEFAULT_MODEL_CONCURRENCY
+    assert limiter.limits[image_model] < limiter.default
+    assert client_for(StubModels()).aio.models.limiter.limits == DEFAULT_MODEL_CONCURRENCY
+
+
+def test_waiting_for_a_slot_counts_against_the_deadline():
+    limiter = ModelLimiter({MODEL: 1})
+    models = StubModels()
+    with limiter.slot(MODEL, 1):
+        started = time.monotonic()
+        with pytest.raises(GeminiUnavailableError):
+            client_for(models, limiter=limiter).models.generate_content(model=MODEL, contents='hi', timeout=0.2)
+    assert 0.15 <= time.monotonic() - started < 1
+    assert models.calls == []
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_forked_child_drops_a_self_built_transport(monkeypatch):
+    built = []
+    monkeypatch.setattr(GeminiClient, '_build_transport',
+                        lambda self: built.append(os.getpid()) or SimpleNamespace(models=StubModels()))
+    owned = GeminiClient(api_key='test')
+    injected = client_for(StubModels())
+    owned.models.generate_content(model=MODEL, contents='hi', timeout=5)
+    injected.models.generate_content(model=MODEL, contents='hi', timeout=5)
+
+    pid = os.fork()
+    if pid == 0:
+        ok = owned._models is None and owned._client is None and injected._models is not None
+        owned.models.generate_content(model=MODEL, contents='hi', timeout=5)
+        os._exit(0 if ok and built[-1] == os.getpid() else 1)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert built == [os.getpid()]
+    assert owned._models is not None
+
+
+def test_reset_keeps_an_injected_transport():
+    models = StubModels()
+    client = client_for(models)
+    client.models
+    gemini_client._reset_clients_after_fork()
+    client.models.generate_content(model=MODEL, contents='hi', timeout=5)
+    assert len(models.calls) == 1
+
+
+def test_slot_timeout_is_not_reported_to_the_router():
+    router = ModelRouter({'tryon': [MODEL]})
+    limiter = ModelLimiter({MODEL: 1})
+    client = client_for(StubModels(failures=[api_error(503)]), limiter=limiter, router=router,
+                        retry_policy=FixedDelay(0.0, attempts=1))
+    with limiter.slot(MODEL, 1):
+        with pytest.raises(GeminiUnavailableError):
+            client.models.generate_content(model=MODEL, contents='hi', timeout=0.05)
+    assert list(router._window(MODEL).calls) == []
+
+    with pytest.raises(errors.APIError):
+        client.models.generate_content(model=MODEL, contents='hi', timeout=5)
+    assert [failed for _, _, failed in router._window(MODEL).calls] == [True]
+    assert router.in_flight(MODEL) == 0
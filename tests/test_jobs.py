@@ -0,0 +1,132 @@
+import json
+import multiprocessing
+import os
+import subprocess
+
+import pytest
+from google.genai import errors
+
+from jobs import JobQueue, JobStore, QueueFullError
+from main import run_tryon_job
+
+
+MEASUREMENTS = {'chest': 40.0, 'waist': 34.0, 'height': 70.0}
+SIZE = {'size': 'M', 'chest': '', 'length': ''}
+
+
+def submit_tryon(jobs):
+    """Queue the real try-on job with fresh images, so no result is served from the cache"""
+    return jobs.submit(run_tryon_job, os.urandom(2048), os.urandom(2048), MEASUREMENTS, SIZE)
+
+
+def wait_finished(job, timeout=5):
+    events = []
+    while not events or events[-1]['stage'] not in ('done', 'failed'):
+        new = job.wait_for_events(len(events), timeout)
+        assert new, f'job {job.id} did not finish'
+        events += new
+    return events
+
+
+def wait_for_stage(job, stage, timeout=5):
+    events = []
+    while stage not in [event['stage'] for event in events]:
+        new = job.wait_for_events(len(events), timeout)
+        assert new, f'job {job.id} never reached {stage}'
+        events += new
+
+
+def load_in_other_process(directory, job_id, results):
+    job = JobStore(directory, poll_interval=0.01).load(job_id)
+    results.put((job.status, [event['stage'] for event in wait_finished(job)]))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path), poll_interval=0.01)
+
+
+def test_tryon_job_runs_to_done(store, gemini_models):
+    job = submit_tryon(JobQueue(workers=1, store=store))
+
+    events = wait_finished(job)
+    stages = [event['stage'] for event in events]
+    assert stages[:2] == ['started', 'image_started'] and stages[-1] == 'done'
+    assert {'image_ready', 'fit_ready'} <= set(stages)
+    assert job.status == 'done'
+    assert job.result['result_image'].startswith('/results/tryon_')
+    assert job.result['fit_recommendation'].startswith('Size M')
+    assert events[-1]['result'] == job.result
+    assert gemini_models.image_calls == 1
+
+    stored = store.load(job.id)
+    wait_finished(stored)
+    assert (stored.status, stored.result) == ('done', job.result)
+
+
+def test_failed_generation_fails_job(store, gemini_models):
+    gemini_models.error = errors.APIError(400, {'error': {'code': 400, 'status': 'INVALID_ARGUMENT',
+                                                          'message': 'Unable to process input image'}})
+    job = submit_tryon(JobQueue(workers=1, store=store))
+
+    events = wait_finished(job)
+    assert job.status == 'failed'
+    assert job.error.startswith("The uploaded images couldn't be processed")
+    assert events[-1] == {'stage': 'failed', 'error': job.error}
+    stored = store.load(job.id)
+    wait_finished(stored)
+    assert (stored.status, stored.error) == ('failed', job.error)
+
+
+def test_full_queue_rejects_without_leaving_state(store, gemini_models):
+    gemini_models.release.clear()
+    jobs = JobQueue(workers=1, max_queue=1, store=store)
+    running = submit_tryon(jobs)
+    running.wait_for_events(0, 5)  # the worker has taken it off the queue
+    queued = submit_tryon(jobs)
+
+    with pytest.raises(QueueFullError):
+        submit_tryon(jobs)
+    assert sorted(os.listdir(store.directory)) == sorted([f'{running.id}.json', f'{queued.id}.json'])
+
+    gemini_models.release.set()
+    assert wait_finished(running)[-1]['stage'] == 'done'
+    assert wait_finished(queued)[-1]['stage'] == 'done'
+    assert gemini_models.image_calls == 2
+
+
+def test_other_process_follows_snapshot(store, gemini_models):
+    gemini_models.release.clear()
+    job = submit_tryon(JobQueue(workers=1, store=store))
+    job.wait_for_events(0, 5)
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=load_in_other_process, args=(store.directory, job.id, results))
+    process.start()
+    gemini_models.release.set()
+    status, stages = results.get(timeout=30)
+    process.join(10)
+
+    assert status in ('running', 'done')
+    assert stages[0] == 'started' and stages[-1] == 'done'
+    assert 'image_ready' in stages
+
+
+def test_job_of_exited_process_loads_as_failed(store, gemini_models):
+    gemini_models.release.clear()
+    job = submit_tryon(JobQueue(workers=1, store=store))
+    # Once the fit recommendation is saved, nothing more is saved until the image call is released
+    wait_for_stage(store.load(job.id), 'fit_ready')
+    exited = subprocess.Popen(['true'])
+    exited.wait()
+    path = os.path.join(store.directory, f'{job.id}.json')
+    with open(path) as f:
+        state = json.load(f)
+    with open(path, 'w') as f:
+        json.dump(dict(state, owner_pid=exited.pid), f)
+
+    snapshot = store.load(job.id)
+    assert snapshot.status == 'failed'
+    assert wait_finished(snapshot)[-1]['stage'] == 'failed'
+    gemini_models.release.set()
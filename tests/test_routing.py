@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import pytest
+
+import routing
+from routing import HEALTHY, SLOW, UNAVAILABLE, ModelRouter
+
+PRIMARY = 'gemini-primary'
+FALLBACK = 'gemini-fallback'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(routing, 'time', SimpleNamespace(time=clock))
+    return clock
+
+
+def router(**kwargs):
+    kwargs.setdefault('min_samples', 4)
+    return ModelRouter({'tryon': [PRIMARY, FALLBACK], 'analyze': [FALLBACK]}, **kwargs)
+
+
+def record(router, model, count, seconds=1.0, code=None):
+    for _ in range(count):
+        router.begin(model)
+        router.end(model, seconds, SimpleNamespace(code=code) if code else None)
+
+
+def test_prefers_the_first_model_while_it_is_healthy(clock):
+    models = router()
+    record(models, PRIMARY, 10)
+
+    assert models.choose('tryon') == PRIMARY
+    assert models.model_stats(PRIMARY)['health'] == HEALTHY
+
+
+def test_fails_over_once_the_error_rate_passes_the_threshold(clock):
+    models = router(max_error_rate=0.5)
+    record(models, PRIMARY, 5)
+    record(models, PRIMARY, 5, code=503)
+    assert models.choose('tryon') == PRIMARY  # exactly 50% is still within the limit
+
+    record(models, PRIMARY, 1, code=503)
+    assert models.model_stats(PRIMARY)['health'] == UNAVAILABLE
+    assert models.choose('tryon') == FALLBACK
+    assert models.stats()['routes']['tryon'] == FALLBACK
+
+
+def test_client_errors_do_not_count_against_a_model(clock):
+    models = router()
+    record(models, PRIMARY, 10, code=400)
+
+    assert models.model_stats(PRIMARY)['error_rate'] == 0.0
+    assert models.choose('tryon') == PRIMARY
+
+
+def test_recovers_once_the_failures_age_out_of_the_window(clock):
+    models = router(window=60)
+    record(models, PRIMARY, 6, code=500)
+    assert models.choose('tryon') == FALLBACK
+
+    clock.now += 61
+    assert models.model_stats(PRIMARY) == {'health': HEALTHY, 'p90_seconds': 0.0, 'error_rate': 0.0,
+                                           'calls': 0, 'in_flight': 0}
+    assert models.choose('tryon') == PRIMARY
+
+
+def test_rate_limited_model_cools_down(clock):
+    models = router(cooldown=30)
+    record(models, PRIMARY, 1, code=429)
+    assert models.choose('tryon') == FALLBACK
+
+    clock.now += 31
+    assert models.choose('tryon') == PRIMARY
+
+
+def test_slow_model_loses_to_a_healthy_one(clock):
+    models = router(slow_after={PRIMARY: 5.0})
+    record(models, PRIMARY, 10, seconds=8.0)
+    assert models.model_stats(PRIMARY)['health'] == SLOW
+    assert models.choose('tryon') == FALLBACK
+
+    # Unavailable fallback: a slow model still beats none
+    record(models, FALLBACK, 6, code=503)
+    assert models.choose('tryon') == PRIMARY
+
+
+def test_sheds_optional_tasks_under_pressure(clock):
+    models = router(optional=['analyze'], reduce_pressure=0.6, shed_pressure=0.85)
+    load = {'value': 0.5}
+    models.add_pressure_source('queue', lambda: load['value'])
+    models.add_pressure_source('broken', lambda: 1 / 0)
+
+    assert not models.should_shed('analyze') and not models.reduce_output('tryon')
+
+    load['value'] = 0.7
+    assert models.reduce_output('tryon')
+    assert not models.should_shed('analyze')
+
+    load['value'] = 0.9
+    assert models.should_shed('analyze')
+    assert not models.should_shed('tryon')  # required work is never shed
+    assert models.stats()['shed'] == {'tryon': 0, 'analyze': 1}
+
+
+def test_sheds_optional_tasks_when_all_their_models_are_down(clock):
+    models = router(optional=['analyze'])
+    record(models, FALLBACK, 6, code=503)
+
+    assert models.should_shed('analyze')
+    clock.now += 61
+    assert not models.should_shed('analyze')
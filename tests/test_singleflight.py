@@ -0,0 +1,131 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+import singleflight
+from singleflight import SingleFlight
+
+KEY = 'a1b2c3d4e5f6'
+
+
+def wait_until(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+def run_concurrently(flights, callers, func):
+    """Call ``flights.do(KEY, func)`` from ``callers`` threads once they are all waiting on one leader"""
+    release = threading.Event()
+    outcomes = []
+
+    def blocked():
+        release.wait(2)
+        return func()
+
+    def call():
+        try:
+            outcomes.append(('ok', flights.do(KEY, blocked)))
+        except Exception as e:
+            outcomes.append(('error', e))
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: flights.leaders + flights.followers == callers)
+    release.set()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def test_concurrent_callers_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    outcomes = run_concurrently(flights, 8, lambda: calls.append(1) or object())
+
+    assert len(calls) == 1
+    assert len({id(result) for _, result in outcomes}) == 1
+    assert flights.stats() == {'leaders': 1, 'followers': 7, 'lock_waits': 0}
+
+
+def test_an_exception_reaches_every_waiter():
+    flights = SingleFlight()
+    failure = RuntimeError('generation failed')
+
+    def fail():
+        raise failure
+
+    outcomes = run_concurrently(flights, 5, fail)
+
+    assert outcomes == [('error', failure)] * 5
+    # Nothing is remembered: the next call runs again
+    assert flights.do(KEY, lambda: 'fresh') == 'fresh'
+
+
+def test_different_keys_run_separately():
+    flights = SingleFlight()
+    assert [flights.do(key, lambda key=key: key.upper()) for key in ('abcd1', 'abcd2')] == ['ABCD1', 'ABCD2']
+    assert flights.stats()['leaders'] == 2
+
+
+def test_async_callers_share_one_execution_and_its_errors():
+    flights = SingleFlight()
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'result'
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise ValueError('bad image')
+
+    async def main():
+        results = await asyncio.gather(*(flights.do_async(KEY, generate) for _ in range(6)))
+        errors = await asyncio.gather(*(flights.do_async(KEY, fail) for _ in range(3)), return_exceptions=True)
+        return results, errors
+
+    results, errors = asyncio.run(main())
+    assert results == ['result'] * 6 and len(calls) == 1
+    assert [str(e) for e in errors] == ['bad image'] * 3
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork') or singleflight.fcntl is None, reason='needs os.fork and fcntl')
+def test_file_lock_coalesces_across_processes(tmp_path):
+    lock_dir = str(tmp_path / 'locks')
+    cached = tmp_path / 'result'
+    started_read, started_write = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        os.close(started_read)
+
+        def generate():
+            os.write(started_write, b'x')
+            time.sleep(0.3)
+            cached.write_text('from the other worker')
+            return 'from the other worker'
+
+        SingleFlight(lock_dir).do(KEY, generate)
+        os._exit(0)
+
+    os.close(started_write)
+    assert os.read(started_read, 1) == b'x'
+    os.close(started_read)
+    flights = SingleFlight(lock_dir)
+    calls = []
+    result = flights.do(KEY, lambda: calls.append(1) or 'generated here',
+                        recheck=lambda: cached.read_text() if cached.exists() else None)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert result == 'from the other worker'
+    assert calls == []
+    assert flights.stats()['lock_waits'] == 1
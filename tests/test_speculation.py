@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+import pytest
+
+import main
+from app import app
+from gemini import generate_tryon_with_fit, result_cache, tryon_cache_key
+from speculation import Speculator
+
+MEASUREMENTS = {'chest': 40.0, 'waist': 34.0, 'height': 70.0}
+
+
+def size(name):
+    return {'size': name, 'chest': '', 'length': ''}
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+class Blocker:
+    """A speculative task that holds the speculator's only worker until released"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.started.set()
+        self.release.wait(5)
+        return True
+
+
+@pytest.fixture
+def speculator(monkeypatch):
+    speculator = Speculator(10, workers=1)
+    monkeypatch.setattr(main, 'speculator', speculator)
+    monkeypatch.setitem(app.config, 'SPECULATIVE_SIZES', True)
+    monkeypatch.setitem(app.config, 'SPECULATIVE_NEIGHBORS', 1)
+    return speculator
+
+
+def test_runs_each_key_once_within_the_budget():
+    speculator = Speculator(2, workers=1)
+    blocker = Blocker()
+    assert speculator.submit('a', blocker)
+    blocker.started.wait(2)
+    assert not speculator.submit('a', blocker)  # already running
+
+    assert speculator.submit('b', lambda: False)  # spends nothing, so the budget is given back
+    assert speculator.submit('c', lambda: True)
+    blocker.release.set()
+    wait_until(lambda: speculator.stats()['pending'] == 0)
+
+    assert not speculator.submit('d', lambda: True)
+    assert {result: speculator.stats()[result] for result in ('spent', 'unspent', 'duplicate', 'over_budget')} == \
+        {'spent': 2, 'unspent': 1, 'duplicate': 1, 'over_budget': 1}
+
+
+def test_nothing_is_queued_under_pressure():
+    load = {'value': 0.5}
+    speculator = Speculator(10, max_pressure=0.25, pressure=lambda: load['value'])
+    ran = []
+
+    assert not speculator.submit('a', ran.append, 'a')
+    load['value'] = 0.1
+    assert speculator.submit('b', ran.append, 'b')
+    wait_until(lambda: speculator.stats()['pending'] == 0)
+
+    assert ran == ['b'] and speculator.stats()['busy'] == 1
+
+
+def test_discard_drops_only_the_queued_tasks_of_a_group():
+    speculator = Speculator(10, workers=1)
+    blocker = Blocker()
+    ran = []
+    speculator.submit('running', blocker, group='alice')
+    blocker.started.wait(2)
+    speculator.submit('alice-L', ran.append, 'alice-L', group='alice')
+    speculator.submit('bob-L', ran.append, 'bob-L', group='bob')
+
+    assert speculator.discard('alice') == 1
+    assert speculator.discard(None) == 0
+    # A discarded key can be queued again right away
+    assert speculator.submit('alice-L', ran.append, 'alice-L again', group='alice')
+    blocker.release.set()
+    wait_until(lambda: speculator.stats()['pending'] == 0)
+
+    assert ran == ['bob-L', 'alice-L again']
+    assert speculator.stats()['discarded'] == 1
+
+
+def test_a_try_on_pregenerates_the_neighbouring_sizes_for_a_later_switch(gemini_models, speculator):
+    user_image, product_image = os.urandom(2048), os.urandom(2048)
+    result = main.run_tryon_job(user_image, product_image, MEASUREMENTS, size('M'),
+                                {'session_id': 'alice', 'product': 'sku:shirt-1'})
+    wait_until(lambda: speculator.stats()['pending'] == 0)
+
+    assert result['result_image']
+    assert gemini_models.image_calls == 3
+    assert speculator.stats()['spent'] == 2
+    for neighbor in ('S', 'L'):
+        assert result_cache.get(tryon_cache_key(user_image, product_image, MEASUREMENTS, size(neighbor)))
+
+    # The shopper switches to L: served from the speculative result without calling the model
+    result_image, _, _ = generate_tryon_with_fit(user_image, product_image, MEASUREMENTS, size('L'))
+    assert result_image == result_cache.get(tryon_cache_key(user_image, product_image, MEASUREMENTS, size('L')))[0]
+    assert gemini_models.image_calls == 3
+
+
+def test_picking_something_else_discards_the_queued_guesses(gemini_models, speculator):
+    user_image, first_product, second_product = os.urandom(2048), os.urandom(2048), os.urandom(2048)
+    blocker = Blocker()
+    speculator.submit('busy', blocker)
+    blocker.started.wait(2)
+
+    main.run_tryon_job(user_image, first_product, MEASUREMENTS, size('M'), {'session_id': 'alice'})
+    assert speculator.stats()['pending'] == 3
+    main.run_tryon_job(user_image, second_product, MEASUREMENTS, size('M'), {'session_id': 'alice'})
+    blocker.release.set()
+    wait_until(lambda: speculator.stats()['pending'] == 0)
+
+    assert speculator.stats()['discarded'] == 2
+    for neighbor in ('S', 'L'):
+        assert result_cache.get(tryon_cache_key(user_image, first_product, MEASUREMENTS, size(neighbor))) is None
+        assert result_cache.get(tryon_cache_key(user_image, second_product, MEASUREMENTS, size(neighbor)))
+    assert gemini_models.image_calls == 4
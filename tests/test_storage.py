@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+from storage import LocalStorage, MemoryStorage, S3Storage
+
+BUCKET = 'musefit-results'
+
+
+@pytest.fixture
+def s3_storage(monkeypatch):
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN'):
+        monkeypatch.setenv(name, 'testing')
+    with moto.mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+        yield S3Storage(BUCKET, prefix='results', region='us-east-1')
+
+
+@pytest.fixture(params=['local', 'memory', 's3'])
+def storage(request, tmp_path):
+    if request.param == 'local':
+        return LocalStorage(str(tmp_path))
+    if request.param == 'memory':
+        return MemoryStorage()
+    return request.getfixturevalue('s3_storage')
+
+
+def test_put_then_read_and_stat(storage):
+    info = storage.put('tryon_0123456789abcdef0123.jpg', b'jpeg bytes')
+
+    assert info.name == 'tryon_0123456789abcdef0123.jpg'
+    assert info.size == 10
+    assert info.content_type == 'image/jpeg'
+    assert storage.read('tryon_0123456789abcdef0123.jpg') == b'jpeg bytes'
+    assert storage.read('tryon_0123456789abcdef0123.jpg', 5, 8) == b'byt'
+    stat = storage.stat('tryon_0123456789abcdef0123.jpg')
+    assert (stat.size, stat.etag) == (10, info.etag)
+
+
+def test_etag_is_stable_when_the_same_content_is_put_again(storage):
+    first = storage.put('tryon_0123456789abcdef0123.jpg', b'jpeg bytes')
+    time.sleep(0.01)
+    second = storage.put('tryon_0123456789abcdef0123.jpg', b'jpeg bytes')
+
+    assert second.etag == first.etag
+    assert storage.stat('tryon_0123456789abcdef0123.jpg').etag == first.etag
+
+
+def test_missing_objects(storage):
+    assert storage.stat('tryon_missing.jpg') is None
+    assert storage.read('tryon_missing.jpg') is None
+    storage.delete('tryon_missing.jpg')
+
+
+def test_delete(storage):
+    storage.put('tryon_a.jpg', b'a')
+    storage.delete('tryon_a.jpg')
+
+    assert storage.stat('tryon_a.jpg') is None
+    assert storage.read('tryon_a.jpg') is None
+
+
+def test_list_by_prefix(storage):
+    storage.put('tryon_a.jpg', b'a')
+    storage.put('tryon_b.webp', b'bb')
+    storage.put('thumbs/tryon_a_w160.webp', b'ccc')
+
+    assert sorted((o.name, o.size) for o in storage.list('thumbs/')) == [('thumbs/tryon_a_w160.webp', 3)]
+    names = {o.name for o in storage.list()}
+    assert {'tryon_a.jpg', 'tryon_b.webp'} <= names
+
+
+def test_rejects_unsafe_names(storage):
+    for name in ('../secret', '/etc/passwd', 'thumbs/../../x.jpg', ''):
+        with pytest.raises(ValueError):
+            storage.put(name, b'x')
+
+
+def test_s3_keys_live_under_the_prefix(s3_storage):
+    s3_storage.put('thumbs/tryon_a_w160.webp', b'x')
+    keys = [item['Key'] for item in s3_storage._client.list_objects_v2(Bucket=BUCKET)['Contents']]
+
+    assert keys == ['results/thumbs/tryon_a_w160.webp']
+    assert [o.name for o in s3_storage.list('thumbs/')] == ['thumbs/tryon_a_w160.webp']
+
+
+def test_memory_storage_evicts_least_recently_used():
+    storage = MemoryStorage(max_bytes=10)
+    storage.put('tryon_a.jpg', b'aaaa')
+    storage.put('tryon_b.jpg', b'bbbb')
+    storage.stat('tryon_a.jpg')
+    storage.put('tryon_c.jpg', b'cccc')
+
+    assert storage.stat('tryon_b.jpg') is None
+    assert storage.read('tryon_a.jpg') == b'aaaa'